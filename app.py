@@ -1,23 +1,51 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask import (Flask, Response, render_template, request, redirect, url_for, flash, session, current_app, abort,
+                   send_file, send_from_directory)
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
 from werkzeug.utils import secure_filename
+from werkzeug.datastructures import MultiDict
 from flask_wtf import FlaskForm, CSRFProtect
 from flask_wtf.file import FileField, FileRequired, FileAllowed
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from wtforms import StringField, TextAreaField, SubmitField
+from wtforms import StringField, TextAreaField, SubmitField, SelectField
 from wtforms.validators import DataRequired, Length, ValidationError
 import os
 import logging
 import bleach
 import re
 import hashlib
+import hmac
 import uuid
 import json
+import math
+import mimetypes
+import click
 from datetime import datetime, timedelta
 from functools import wraps
 from pathlib import Path
-from database import db, File, init_db
+from database import (db, File, FileRow, FileStats, FacetCount, FileText, ImageHash, Tag, file_tags, CATEGORY_LABELS, LANGUAGE_LABELS,
+                      DEFAULT_CREATOR, DEFAULT_RIGHTS, IMAGE_HASHABLE, MIME_BY_EXTENSION, engine_options, normalize_tag,
+                      init_db)
+from profiler import init_profiler
+from suggest import init_suggest
+from extraction import init_extraction, run_backfill
+from embedded_metadata import read_embedded_metadata, run_metadata_backfill
+from image_similarity import compute_hashes, init_similarity, run_hash_backfill
+from document_similarity import (SOURCE_LABELS, init_document_similarity, meta_text, run_signature_backfill,
+                                 signature_for)
+from related import init_related
+from storage import init_storage
+from compression import SUFFIX, gzip_original_size, init_compression, is_compressed, iter_decompressed, original_size
+from bulk import init_bulk
+from reconcile import init_reconcile
+from assets import build_assets, init_assets
+from http_cache import init_http_cache
+from health import init_health
+from archive import ArchiveTooLarge, file_checksum, init_archive
+from sitemap import FEED, INDEX, PAGES, init_sitemaps
+from batch_upload import BatchFull, BatchNotFound, init_batch_upload
+from events import init_events
+from usage import init_usage_counters
 
 # Configuración de logging
 logging.basicConfig(
@@ -42,11 +70,18 @@ class Config:
             raise RuntimeError("SECRET_KEY environment variable must be set in production!")
     
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'sqlite:///metadatos.db')
+    if SQLALCHEMY_DATABASE_URI.startswith('postgres://'):
+        # Forma abreviada de algunos proveedores, no aceptada por SQLAlchemy
+        SQLALCHEMY_DATABASE_URI = 'postgresql://' + SQLALCHEMY_DATABASE_URI[len('postgres://'):]
+    SQLALCHEMY_ENGINE_OPTIONS = engine_options(SQLALCHEMY_DATABASE_URI)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ECHO = False  # No mostrar SQL en logs de producción
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_CONTENT_LENGTH', 16 * 1024 * 1024))
 
+    # Permite desactivar el rate limiting en entornos de benchmark
+    RATELIMIT_ENABLED = os.environ.get('RATELIMIT_ENABLED', 'true').lower() == 'true'
+
     # Configuración de archivos permitidos - más restrictiva
     ALLOWED_EXTENSIONS = {
         'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp',
@@ -124,6 +159,29 @@ init_db(app)
 with app.app_context():
     db.create_all()
 
+# Perfilador de peticiones lentas (opcional, PROFILER_ENABLED=true)
+profiler = init_profiler(app)
+suggest_index = init_suggest(app)
+text_extractor = init_extraction(app)
+image_index = init_similarity(app)
+document_index = init_document_similarity(app)
+related_files = init_related(app)
+storage = init_storage(app)
+upload_compressor = init_compression(app)
+bulk_editor = init_bulk(app, storage)
+upload_reconciler = init_reconcile(app)
+static_assets = init_assets(app)
+page_cache = init_http_cache(app)
+health_monitor = init_health(app, storage, extractor=text_extractor, sweeper=bulk_editor.sweeper)
+zip_archiver = init_archive(app, storage)
+sitemaps = init_sitemaps(app)
+upload_batches = init_batch_upload(app, storage, upload_compressor, image_index, document_index)
+event_broadcaster = init_events(app)
+usage_counters = init_usage_counters(app)
+
+# Las sondas de salud nunca se cachean
+NO_STORE = {'Cache-Control': 'no-store'}
+
 # Security headers para todas las respuestas
 @app.after_request
 def add_security_headers(response):
@@ -202,6 +260,15 @@ class FileUploadForm(FlaskForm):
     dc_subject = StringField('Palabras clave', validators=[
         Length(max=500, message='Las palabras clave no pueden exceder 500 caracteres')
     ])
+    dc_creator = StringField('Autor', validators=[
+        Length(max=255, message='El autor no puede exceder 255 caracteres')
+    ])
+    dc_rights = StringField('Derechos', validators=[
+        Length(max=500, message='Los derechos no pueden exceder 500 caracteres')
+    ])
+    # 'auto' toma el idioma declarado en el archivo (o español si no declara ninguno)
+    dc_language = SelectField('Idioma', choices=[('auto', 'Detectar del archivo')] + list(LANGUAGE_LABELS.items()),
+                              default='auto')
     submit = SubmitField('Subir Archivo')
     
     def validate_file(self, field):
@@ -307,8 +374,8 @@ def is_safe_filename(filename):
     
     return True
 
-def generate_safe_filename(original_filename, upload_folder, max_length=100):
-    """Genera un nombre de archivo seguro y único"""
+def generate_safe_filename(original_filename, storage, max_length=100, taken=()):
+    """Genera un nombre de archivo seguro y único (también respecto a los nombres de `taken`)"""
     # Usar secure_filename primero
     name, ext = os.path.splitext(secure_filename(original_filename))
     
@@ -322,7 +389,7 @@ def generate_safe_filename(original_filename, upload_folder, max_length=100):
     filename = f"{name}_{timestamp}{ext}"
     
     counter = 1
-    while os.path.exists(os.path.join(upload_folder, filename)):
+    while filename in taken or storage.locate(filename) is not None:
         if counter > 9999:  # Prevenir bucle infinito
             # Usar UUID como último recurso
             filename = f"{name}_{uuid.uuid4().hex[:8]}{ext}"
@@ -363,6 +430,51 @@ def get_file_size_mb(file_path):
     except OSError:
         return 0
 
+def upload_metadata(form):
+    """Metadatos sanitizados de un FileUploadForm validado (dc_language puede ser 'auto')"""
+    return {
+        'title': sanitize_input(form.title.data.strip(), 255),
+        'description': sanitize_input(form.description.data.strip(), 1000),
+        'dc_subject': sanitize_input(form.dc_subject.data.strip() if form.dc_subject.data else '', 500),
+        'dc_creator': sanitize_input(form.dc_creator.data.strip() if form.dc_creator.data else '', 255),
+        'dc_rights': sanitize_input(form.dc_rights.data.strip() if form.dc_rights.data else '', 500),
+        'dc_language': form.dc_language.data or 'auto',
+    }
+
+def apply_embedded_metadata(embedded, dc_creator, dc_rights, dc_language):
+    """Completa los campos vacíos con los metadatos embebidos (solo cabeceras)
+
+    Devuelve (dc_creator, dc_rights, dc_language, campos completados).
+    """
+    prefilled = []
+    if not dc_creator and embedded.get('creator'):
+        dc_creator = sanitize_input(embedded['creator'], 255)
+        prefilled.append('autor')
+    if not dc_rights and embedded.get('rights'):
+        dc_rights = sanitize_input(embedded['rights'], 500)
+        prefilled.append('derechos')
+    if dc_language == 'auto':
+        dc_language = embedded.get('language', 'es')
+        if 'language' in embedded:
+            prefilled.append('idioma')
+    return dc_creator, dc_rights, dc_language, prefilled
+
+def duplicate_warnings(near_duplicates, similar_documents):
+    """Avisos de imágenes y documentos casi duplicados de un archivo recién subido"""
+    warnings = []
+    if near_duplicates:
+        titles = dict(db.session.query(File.id, File.title).filter(
+            File.id.in_([duplicate_id for _, duplicate_id in near_duplicates])))
+        names = ', '.join(f'"{titles[duplicate_id]}" (#{duplicate_id})'
+                          for _, duplicate_id in near_duplicates if duplicate_id in titles)
+        if names:
+            warnings.append(f'La imagen parece una copia de: {names}. Revisa si es un duplicado.')
+    if similar_documents:
+        names = ', '.join(f'"{match_title}" (#{match_id}, {score:.0%})'
+                          for score, match_id, match_title in similar_documents)
+        warnings.append(f'Título y descripción casi idénticos a: {names}. ¿Es otra versión del mismo documento?')
+    return warnings
+
 def safe_log_user_action(action, username=None, ip=None, additional_info=None, file_info=None):
     """Log de acciones de usuario sin exponer información sensible"""
     # Máscarar IP para privacidad
@@ -476,35 +588,161 @@ def too_large(e):
     flash('El archivo es demasiado grande. Tamaño máximo permitido: 16MB', 'danger')
     return redirect(request.url)
 
+# Filtros de navegación facetada aceptados por la página principal
+FACET_FILTERS = ('type', 'lang', 'subject', 'year', 'ext')
+FACET_LABELS = {
+    'type': 'Tipo',
+    'lang': 'Idioma',
+    'subject': 'Palabra clave',
+    'year': 'Año',
+}
+MAX_FACET_VALUES = 12
+
+def get_active_filters(args):
+    """Extrae los filtros de facetas válidos de la query string"""
+    filters = {}
+    for name in FACET_FILTERS:
+        value = args.get(name, '', type=str).strip()[:100]
+        if value:
+            filters[name] = value
+    if 'year' in filters and not filters['year'].isdigit():
+        del filters['year']
+    if 'subject' in filters:
+        filters['subject'] = normalize_tag(filters['subject'])
+        if not filters['subject']:
+            del filters['subject']
+    return filters
+
+def file_filter_conditions(filters, search=''):
+    """Condiciones SQL para búsqueda y facetas (servidas por índices salvo el LIKE de search en SQLite)"""
+    conditions = []
+    if search:
+        matches = [File.search_condition(search)]
+        content_ids = FileText.matching_file_ids(search)
+        if content_ids is not None:
+            matches.append(File.id.in_(db.select(content_ids.subquery().c.rowid)))
+        conditions.append(db.or_(*matches))
+    if 'type' in filters:
+        conditions.append(File.category == filters['type'])
+    if 'lang' in filters:
+        conditions.append(File.dc_language == filters['lang'])
+    if 'year' in filters:
+        conditions.append(File.upload_year == int(filters['year']))
+    if 'ext' in filters:
+        conditions.append(File.extension == filters['ext'].lower())
+    if 'subject' in filters:
+        conditions.append(File.id.in_(Tag.file_ids(filters['subject'])))
+    return conditions
+
+def _collect_facet_rows(rows):
+    """Agrupa filas (faceta, valor, etiqueta, cuenta) en cuentas y etiquetas"""
+    counts, labels = {}, {}
+    for facet, value, label, count in rows:
+        if value is not None:
+            counts.setdefault(facet, {})[value] = count
+            labels[(facet, value)] = label
+    return counts, labels
+
+def _top_tags(select):
+    """Limita la rama de palabras clave a las más frecuentes (subconsulta para UNION)"""
+    top = select.order_by(db.literal_column('n').desc(), Tag.name).limit(MAX_FACET_VALUES).subquery()
+    return db.select(top.c.facet, top.c.value, top.c.label, top.c.n)
+
+def catalog_facet_counts():
+    """Cuentas de todo el catálogo: facet_counts y tags.file_count en una consulta"""
+    precomputed = db.select(
+        FacetCount.facet, FacetCount.value, FacetCount.value.label('label'), FacetCount.count.label('n')
+    ).where(FacetCount.count > 0)
+    tags = _top_tags(db.select(
+        db.literal('subject').label('facet'), Tag.name.label('value'), Tag.label.label('label'),
+        Tag.file_count.label('n')
+    ).where(Tag.file_count > 0))
+    return _collect_facet_rows(db.session.execute(db.union_all(precomputed, tags)))
+
+def filtered_facet_counts(conditions):
+    """Cuentas de tipo, idioma, año y palabra clave dentro del conjunto filtrado, en una consulta"""
+    grouped = [
+        db.select(db.literal(facet).label('facet'), db.cast(column, db.String).label('value'),
+                  db.cast(column, db.String).label('label'), db.func.count().label('n'))
+        .where(*conditions).group_by(column)
+        for facet, column in (('type', File.category), ('lang', File.dc_language), ('year', File.upload_year))
+    ]
+    grouped.append(_top_tags(
+        db.select(db.literal('subject').label('facet'), Tag.name.label('value'), Tag.label.label('label'),
+                  db.func.count().label('n'))
+        .select_from(file_tags).join(Tag, Tag.id == file_tags.c.tag_id).join(File, File.id == file_tags.c.file_id)
+        .where(*conditions).group_by(Tag.id, Tag.name, Tag.label)
+    ))
+    return _collect_facet_rows(db.session.execute(db.union_all(*grouped)))
+
+def build_facets(counts, labels, filters, search):
+    """Estructura de facetas para la plantilla con URLs de selección"""
+    value_labels = {'type': CATEGORY_LABELS, 'lang': LANGUAGE_LABELS}
+    facets = []
+    for name, label in FACET_LABELS.items():
+        values = counts.get(name, {})
+        if name == 'year':
+            ordered = sorted(values.items(), key=lambda item: item[0], reverse=True)
+        else:
+            ordered = sorted(values.items(), key=lambda item: (-item[1], item[0]))
+        entries = []
+        for value, count in ordered[:MAX_FACET_VALUES]:
+            active = filters.get(name) == value
+            params = dict(filters)
+            if active:
+                params.pop(name)
+            else:
+                params[name] = value
+            entries.append({
+                'value': value,
+                'label': value_labels.get(name, {}).get(value, labels.get((name, value), value)),
+                'count': count,
+                'active': active,
+                'url': url_for('index', search=search or None, **params),
+            })
+        if name in filters and not any(entry['active'] for entry in entries):
+            params = dict(filters)
+            params.pop(name)
+            entries.insert(0, {
+                'value': filters[name],
+                'label': value_labels.get(name, {}).get(filters[name], filters[name]),
+                'count': None,
+                'active': True,
+                'url': url_for('index', search=search or None, **params),
+            })
+        if entries:
+            facets.append({'name': name, 'label': label, 'values': entries})
+    return facets
+
 @app.route('/')
+@page_cache.conditional(page_cache.catalog_validators)
 def index():
     """Página principal con lista de archivos"""
     try:
         page = request.args.get('page', 1, type=int)
         search = request.args.get('search', '', type=str)
+        filters = get_active_filters(request.args)
+        conditions = file_filter_conditions(filters, search)
 
-        query = File.query
+        files = FileRow.paginate(conditions, page=page, per_page=12)
 
-        if search:
-            query = query.filter(
-                db.or_(
-                    File.title.contains(search),
-                    File.description.contains(search)
-                )
-            )
-
-        files = query.order_by(File.upload_date.desc()).paginate(
-            page=page, per_page=12, error_out=False
-        )
+        # Sin filtros las cuentas salen de la tabla precalculada; con filtros,
+        # de un GROUP BY sobre columnas indexadas del conjunto filtrado
+        if conditions:
+            counts, labels = filtered_facet_counts(conditions)
+        else:
+            counts, labels = catalog_facet_counts()
+        facets = build_facets(counts, labels, filters, search)
 
-        return render_template('index.html', files=files, search=search)
+        return render_template('index.html', files=files, search=search, filters=filters, facets=facets)
     except Exception as e:
         error_id = str(uuid.uuid4())[:8]
         current_app.logger.error(f'Error ID {error_id} en página principal: {type(e).__name__}', exc_info=True)
         flash('Error interno al cargar los archivos', 'danger')
-        return render_template('index.html', files=None)
+        return render_template('index.html', files=None, filters={}, facets=[])
 
 @app.route('/help')
+@page_cache.conditional(page_cache.template_validators)
 def help_page():
     """Página de ayuda"""
     return render_template('help.html')
@@ -583,6 +821,10 @@ def logout():
     flash('Has cerrado sesión correctamente.', 'info')
     return redirect(url_for('index'))
 
+# Archivos por página del panel (más por página para las acciones masivas)
+ADMIN_PER_PAGE = 10
+ADMIN_PER_PAGE_OPTIONS = (10, 50, 100, 200)
+
 @app.route('/admin', methods=['GET', 'POST'])
 @login_required
 @limiter.limit("10 per minute")
@@ -591,10 +833,11 @@ def admin_panel():
     form = FileUploadForm()
     
     if form.validate_on_submit():
+        file_path = None
         try:
-            title = sanitize_input(form.title.data.strip(), 255)
-            description = sanitize_input(form.description.data.strip(), 1000)
-            dc_subject = sanitize_input(form.dc_subject.data.strip() if form.dc_subject.data else '', 500)
+            metadata = upload_metadata(form)
+            title, description, dc_subject = metadata['title'], metadata['description'], metadata['dc_subject']
+            dc_creator, dc_rights, dc_language = metadata['dc_creator'], metadata['dc_rights'], metadata['dc_language']
 
             # Las validaciones están en el formulario WTF
 
@@ -606,12 +849,30 @@ def admin_panel():
                 return redirect(request.url)
 
             # Procesar archivo con generación segura de nombre
-            filename = generate_safe_filename(file.filename, app.config['UPLOAD_FOLDER'])
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filename = generate_safe_filename(file.filename, storage)
+            file_path = storage.staging_path(filename)
             file.save(file_path)
 
-            # Obtener tamaño del archivo
+            # Obtener tamaño del archivo (y el exacto con su CRC-32, para las descargas en ZIP)
             file_size = get_file_size_mb(file_path)
+            size_bytes, crc32 = file_checksum(file_path)
+
+            # Completar los campos vacíos con los metadatos embebidos (solo cabeceras)
+            embedded = read_embedded_metadata(file_path, file.filename.rsplit('.', 1)[-1])
+            dc_creator, dc_rights, dc_language, prefilled = apply_embedded_metadata(embedded, dc_creator, dc_rights,
+                                                                                    dc_language)
+
+            # Hashes perceptuales para avisar de copias redimensionadas o recomprimidas
+            extension = file.filename.rsplit('.', 1)[-1].lower()
+            hashes = compute_hashes(file_path) if image_index.enabled and extension in IMAGE_HASHABLE else None
+            near_duplicates = image_index.near(hashes[2], hashes[1]) if hashes else []
+
+            # txt/csv se guardan comprimidos con gzip (después de leer el archivo original)
+            file_path = upload_compressor.compress_file(file_path, extension)
+            compressed = is_compressed(file_path)
+            storage.save(file_path, filename + SUFFIX if compressed else filename,
+                         content_type=MIME_BY_EXTENSION.get(extension),
+                         content_encoding='gzip' if compressed else None)
 
             # Guardar en base de datos con metadatos sanitizados
             new_file = File(
@@ -619,11 +880,34 @@ def admin_panel():
                 description=description,
                 filename=filename,
                 file_size=file_size,
+                size_bytes=size_bytes,
+                crc32=crc32,
                 dc_subject=dc_subject,
-                original_filename=file.filename
+                dc_language=dc_language,
+                dc_creator=dc_creator or DEFAULT_CREATOR,
+                dc_rights=dc_rights or DEFAULT_RIGHTS,
+                original_filename=file.filename,
+                compressed=compressed
             )
             db.session.add(new_file)
+            db.session.flush()
+            file_id, extension = new_file.id, new_file.extension
+            if hashes:
+                ImageHash.store(db.session.connection(), file_id, *hashes)
+            # Firma MinHash de título y descripción (la del contenido llega tras la extracción)
+            signature = document_index.index(db.session.connection(), file_id, 'meta', meta_text(title, description),
+                                             replace=False)
+            similar_documents = document_index.near('meta', signature, exclude=file_id)
             db.session.commit()
+            sitemaps.schedule()
+
+            # Extracción del contenido en segundo plano, fuera de la petición; con un
+            # backend remoto la copia preparada se borra cuando termina
+            if not text_extractor.submit(file_id, file_path, extension, cleanup=storage.remote) and storage.remote:
+                os.remove(file_path)
+            file_path = None
+            if hashes:
+                image_index.add(file_id, hashes)
 
             # Log detallado del evento de seguridad
             client_ip = get_remote_address()
@@ -631,10 +915,16 @@ def admin_panel():
             # Log seguro estructurado
             safe_log_user_action('FILE_UPLOAD', session.get('username'), client_ip, f'size:{file_size}MB', filename[:30])
             flash(f'Archivo "{title}" subido exitosamente.', 'success')
+            if prefilled:
+                flash(f'Tomado de los metadatos del archivo: {", ".join(prefilled)}.', 'info')
+            for warning in duplicate_warnings(near_duplicates, similar_documents):
+                flash(warning, 'warning')
             return redirect(url_for('admin_panel'))
 
         except Exception as e:
             db.session.rollback()
+            if storage.remote and file_path and os.path.exists(file_path):
+                os.remove(file_path)
             client_ip = get_remote_address()
             error_id = str(uuid.uuid4())[:8]
             current_app.logger.error(f'Error ID {error_id} subiendo archivo - Usuario: {session.get("username")}, IP: {client_ip}, Error: {type(e).__name__}', exc_info=True)
@@ -652,16 +942,158 @@ def admin_panel():
     # Mostrar archivos existentes
     try:
         page = request.args.get('page', 1, type=int)
-        files = File.query.order_by(File.upload_date.desc()).paginate(
-            page=page, per_page=10, error_out=False
-        )
-        return render_template('admin.html', files=files, form=form)
+        per_page = request.args.get('per_page', ADMIN_PER_PAGE, type=int)
+        if per_page not in ADMIN_PER_PAGE_OPTIONS:
+            per_page = ADMIN_PER_PAGE
+        sort = request.args.get('sort', 'recent', type=str)
+        if sort not in FileRow.ORDERS:
+            sort = 'recent'
+        files = FileRow.paginate(page=page, per_page=per_page, with_stats=True, order=sort)
+        return render_template('admin.html', files=files, form=form, per_page_options=ADMIN_PER_PAGE_OPTIONS,
+                               language_labels=LANGUAGE_LABELS, sort=sort)
     except Exception as e:
         error_id = str(uuid.uuid4())[:8]
         current_app.logger.error(f'Error ID {error_id} cargando panel admin: {type(e).__name__}', exc_info=True)
         flash('Error interno al cargar los archivos', 'danger')
         return render_template('admin.html', files=None, form=form)
 
+# Campos del formulario de subida que acompañan a cada archivo de un lote
+BATCH_FIELDS = ('title', 'description', 'dc_subject', 'dc_creator', 'dc_rights', 'dc_language')
+
+def _batch_fields(index):
+    """Campos del archivo `index`: cada campo lleva un valor por archivo, o uno solo para todos"""
+    fields = MultiDict()
+    for name in BATCH_FIELDS:
+        values = request.form.getlist(name)
+        if values:
+            fields[name] = values[index] if len(values) > 1 else values[0]
+    return fields
+
+def _batch_urls(batch_id):
+    return {
+        'files_url': url_for('upload_batch_files', batch_id=batch_id),
+        'commit_url': url_for('upload_batch_commit', batch_id=batch_id),
+        'discard_url': url_for('upload_batch_discard', batch_id=batch_id),
+    }
+
+@app.route('/admin/uploads', methods=['POST'])
+@login_required
+@limiter.limit("10 per minute")
+def upload_batch_create():
+    """Abre un lote de subida múltiple; devuelve su id y las URL para enviar, confirmar o descartar"""
+    try:
+        batch_id = upload_batches.create(session.get('username'))
+    except OSError as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} abriendo lote de subida: {type(e).__name__}', exc_info=True)
+        return {'error': f'Error interno al abrir el lote (ID: {error_id})'}, 500
+    return dict(_batch_urls(batch_id), batch=batch_id, max_files=app.config['UPLOAD_BATCH_MAX_FILES']), 201
+
+@app.route('/admin/uploads/<batch_id>/files', methods=['POST'])
+@login_required
+@limiter.limit("600 per hour")
+def upload_batch_files(batch_id):
+    """Recibe uno o varios archivos `file` del lote y los prepara en paralelo
+
+    Los campos del formulario de subida se envían una vez por archivo, en
+    el mismo orden, o una sola vez para todos. Cada archivo se valida como
+    en el formulario individual; los rechazados no entran en el lote.
+    """
+    username = session.get('username')
+    uploads = request.files.getlist('file')
+    if not uploads:
+        return {'error': 'Debe seleccionar un archivo'}, 400
+
+    results, accepted = [None] * len(uploads), []
+    for index, upload in enumerate(uploads):
+        formdata = _batch_fields(index)
+        formdata['file'] = upload
+        form = FileUploadForm(formdata=formdata, meta={'csrf': False})
+        if form.validate():
+            accepted.append((index, upload, upload_metadata(form)))
+        else:
+            results[index] = {'name': upload.filename, 'ok': False,
+                              'errors': [error for errors in form.errors.values() for error in errors]}
+
+    try:
+        entries = upload_batches.prepare(batch_id, username, [(upload, metadata) for _, upload, metadata in accepted])
+        for (index, upload, _), entry in zip(accepted, entries):
+            metadata = entry['metadata']
+            dc_creator, dc_rights, dc_language, prefilled = apply_embedded_metadata(
+                entry['embedded'], metadata['dc_creator'], metadata['dc_rights'], metadata['dc_language'])
+            metadata.update(dc_creator=dc_creator or DEFAULT_CREATOR, dc_rights=dc_rights or DEFAULT_RIGHTS,
+                            dc_language=dc_language)
+            upload_batches.stage(batch_id, username, entry)
+
+            warnings = [f'Tomado de los metadatos del archivo: {", ".join(prefilled)}.'] if prefilled else []
+            hashes = entry['hashes']
+            near_duplicates = image_index.near(hashes[2], hashes[1]) if hashes else []
+            similar_documents = document_index.near(
+                'meta', signature_for('meta', meta_text(metadata['title'], metadata['description'])))
+            warnings.extend(duplicate_warnings(near_duplicates, similar_documents))
+            results[index] = {'name': upload.filename, 'ok': True, 'key': entry['key'], 'title': metadata['title'],
+                              'size': entry['file_size'], 'warnings': warnings}
+    except BatchNotFound:
+        return {'error': 'El lote no existe o ha caducado'}, 404
+    except BatchFull as e:
+        return {'error': str(e)}, 400
+    except Exception as e:
+        db.session.rollback()
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} preparando archivos del lote {batch_id} - Usuario: {username}, '
+                                 f'Error: {type(e).__name__}', exc_info=True)
+        return {'error': f'Error interno al procesar el archivo (ID: {error_id})'}, 500
+
+    return {'files': results}, 200 if accepted else 400
+
+@app.route('/admin/uploads/<batch_id>/commit', methods=['POST'])
+@login_required
+@limiter.limit("10 per minute")
+def upload_batch_commit(batch_id):
+    """Guarda todos los archivos preparados del lote en una única transacción"""
+    username = session.get('username')
+    client_ip = get_remote_address()
+    try:
+        created = upload_batches.commit(
+            batch_id, username, lambda original, taken: generate_safe_filename(original, storage, taken=taken))
+    except BatchNotFound:
+        return {'error': 'El lote no existe o ha caducado'}, 404
+    except Exception as e:
+        db.session.rollback()
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} confirmando el lote {batch_id} - Usuario: {username}, '
+                                 f'IP: {client_ip}, Error: {type(e).__name__}', exc_info=True)
+        return {'error': f'Error interno al guardar el lote (ID: {error_id}). Vuelve a subir los archivos.'}, 500
+    if not created:
+        return {'error': 'El lote no tiene archivos preparados'}, 400
+    sitemaps.schedule()
+
+    # Extracción del contenido en segundo plano, como en la subida individual
+    for item in created:
+        if not text_extractor.submit(item['id'], item['local'], item['extension'], cleanup=storage.remote) \
+                and storage.remote:
+            os.remove(item['local'])
+        if item['hashes']:
+            image_index.add(item['id'], item['hashes'])
+
+    current_app.logger.info(f'Lote subido - Usuario: {username}, IP: {client_ip}, Archivos: {len(created)}')
+    safe_log_user_action('FILE_UPLOAD_BATCH', username, client_ip, f'files:{len(created)}')
+    flash(f'{len(created)} archivo(s) subidos exitosamente.', 'success')
+    return {'created': len(created), 'files': [
+        {'id': item['id'], 'title': item['title'], 'url': url_for('view_file', file_id=item['id'])} for item in created
+    ]}
+
+@app.route('/admin/uploads/<batch_id>/discard', methods=['POST'])
+@login_required
+@limiter.limit("10 per minute")
+def upload_batch_discard(batch_id):
+    """Descarta un lote sin confirmar"""
+    try:
+        upload_batches.discard(batch_id, session.get('username'))
+    except BatchNotFound:
+        return {'error': 'El lote no existe o ha caducado'}, 404
+    return '', 204
+
 @app.route('/admin/delete/<int:file_id>', methods=['POST'])
 @login_required
 @limiter.limit("5 per minute")
@@ -672,14 +1104,11 @@ def delete_file(file_id):
         filename = file_to_delete.filename
         title = file_to_delete.title
 
-        # Eliminar archivo físico
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        if os.path.exists(file_path):
-            os.remove(file_path)
-
-        # Eliminar de base de datos
+        # Eliminar de base de datos; el archivo físico se borra en segundo plano tras el commit
         db.session.delete(file_to_delete)
         db.session.commit()
+        bulk_editor.sweeper.schedule([filename])
+        sitemaps.schedule()
 
         # Log detallado del evento de eliminación
         client_ip = get_remote_address()
@@ -688,12 +1117,6 @@ def delete_file(file_id):
         safe_log_user_action('FILE_DELETE', session.get('username'), client_ip, f'file_id:{file_id}', filename[:30])
         flash(f'Archivo "{title}" eliminado exitosamente.', 'success')
 
-    except FileNotFoundError:
-        current_app.logger.warning(f'Archivo físico no encontrado: {filename}')
-        db.session.delete(file_to_delete)
-        db.session.commit()
-        flash(f'Archivo "{title}" eliminado de la base de datos (archivo físico no encontrado).', 'warning')
-
     except Exception as e:
         db.session.rollback()
         error_id = str(uuid.uuid4())[:8]
@@ -702,38 +1125,464 @@ def delete_file(file_id):
 
     return redirect(url_for('admin_panel'))
 
+@app.route('/admin/bulk', methods=['POST'])
+@login_required
+@limiter.limit("10 per minute")
+def bulk_action():
+    """Eliminar, reetiquetar o editar los metadatos de los archivos seleccionados"""
+    action = request.form.get('action', '')
+    file_ids = request.form.getlist('file_ids', type=int)
+    back = url_for('admin_panel', page=request.form.get('page', 1, type=int),
+                   per_page=request.form.get('per_page', ADMIN_PER_PAGE, type=int))
+    if not file_ids:
+        flash('No se seleccionó ningún archivo', 'warning')
+        return redirect(back)
+    if len(file_ids) > app.config['BULK_MAX_FILES']:
+        flash(f'Se pueden procesar como mucho {app.config["BULK_MAX_FILES"]} archivos a la vez', 'danger')
+        return redirect(back)
+
+    if action == 'zip':
+        # GET sin estado: la descarga se puede reanudar con Range
+        return redirect(url_for('download_zip', ids=','.join(map(str, sorted(set(file_ids))))))
+
+    client_ip = get_remote_address()
+    try:
+        if action == 'delete':
+            changed = len(bulk_editor.delete(file_ids))
+            flash(f'{changed} archivo(s) eliminados.', 'success')
+        elif action == 'retag':
+            add_tags = sanitize_input(request.form.get('add_tags', '').strip(), 500)
+            remove_tags = sanitize_input(request.form.get('remove_tags', '').strip(), 500)
+            if not add_tags and not remove_tags:
+                flash('Indica las palabras clave que añadir o quitar', 'warning')
+                return redirect(back)
+            changed = bulk_editor.retag(file_ids, add=add_tags, remove=remove_tags)
+            flash(f'Palabras clave actualizadas en {changed} archivo(s).', 'success')
+        elif action == 'edit':
+            values = {
+                'dc_creator': sanitize_input(request.form.get('dc_creator', '').strip(), 255),
+                'dc_rights': sanitize_input(request.form.get('dc_rights', '').strip(), 500),
+                'dc_language': request.form.get('dc_language', ''),
+            }
+            if values['dc_language'] and values['dc_language'] not in LANGUAGE_LABELS:
+                flash('Idioma no válido', 'danger')
+                return redirect(back)
+            if not any(values.values()):
+                flash('Indica al menos un campo que modificar', 'warning')
+                return redirect(back)
+            changed = bulk_editor.update(file_ids, values)
+            flash(f'Metadatos actualizados en {changed} archivo(s).', 'success')
+        else:
+            flash('Acción masiva no válida', 'danger')
+            return redirect(back)
+
+        sitemaps.schedule()
+        current_app.logger.info(f'Acción masiva {action} - Usuario: {session.get("username")}, IP: {client_ip}, '
+                                f'Seleccionados: {len(file_ids)}, Cambiados: {changed}')
+        safe_log_user_action(f'FILE_BULK_{action.upper()}', session.get('username'), client_ip,
+                             f'selected:{len(file_ids)} changed:{changed}')
+    except Exception as e:
+        db.session.rollback()
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} en acción masiva {action}: {type(e).__name__}', exc_info=True)
+        flash(f'Error interno en la acción masiva (ID: {error_id})', 'danger')
+
+    return redirect(back)
+
+@app.route('/admin/profiler')
+@login_required
+def profiler_panel():
+    """Registros recientes del perfilador de peticiones lentas"""
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    records = profiler.recent_records(limit=limit)
+    return render_template(
+        'admin_profiler.html',
+        records=records,
+        profiler_enabled=profiler.enabled,
+        threshold_ms=profiler.threshold_ms,
+        profile_header=profiler.header
+    )
+
+# Grupos mostrados como mucho en el informe de duplicados
+DUPLICATE_CLUSTER_LIMIT = 200
+
+@app.route('/admin/duplicates')
+@login_required
+def duplicates_report():
+    """Grupos de documentos casi duplicados según sus firmas MinHash"""
+    source = request.args.get('source', 'text')
+    if source not in SOURCE_LABELS:
+        source = 'text'
+    try:
+        return render_template(
+            'admin_duplicates.html',
+            groups=document_index.clusters(source)[:DUPLICATE_CLUSTER_LIMIT],
+            source=source,
+            source_labels=SOURCE_LABELS,
+            threshold=document_index.threshold,
+            enabled=document_index.enabled
+        )
+    except Exception as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} en el informe de duplicados: {type(e).__name__}', exc_info=True)
+        flash('Error interno al calcular los duplicados', 'danger')
+        return redirect(url_for('admin_panel'))
+
+def counts_view(f):
+    """Decorador: cuenta la vista de una ficha antes de la validación condicional
+
+    Así cuentan también las visitas repetidas que acaban en 304.
+    """
+    @wraps(f)
+    def decorated_function(*args, file_id, **kwargs):
+        if request.method == 'GET':
+            # Sin consulta: el volcado descarta los ids que ya no existen
+            usage_counters.view(file_id)
+        return f(*args, file_id=file_id, **kwargs)
+    return decorated_function
+
 @app.route('/file/<int:file_id>')
+@counts_view
+@page_cache.conditional(page_cache.file_validators)
 def view_file(file_id):
     """Ver detalles de un archivo específico"""
     try:
-        file = File.query.get_or_404(file_id)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-
+        # El archivo y sus cuentas de file_stats en la misma consulta
+        row = db.session.execute(
+            db.select(File, FileStats.views, FileStats.downloads)
+            .outerjoin(FileStats, FileStats.file_id == File.id).where(File.id == file_id)
+        ).first()
+        if row is None:
+            abort(404)
+        file = row.File
         # Verificar si el archivo existe físicamente
-        file_exists = os.path.exists(file_path)
-
-        return render_template('file_detail.html', file=file, file_exists=file_exists)
+        file_exists = storage.resolve(file.filename, file.compressed) is not None
+
+        # La ficha puede quedarse en la caché del navegador: la página recarga las cuentas de api_file_stats
+        pending_views, pending_downloads = usage_counters.pending(file.id, file.filename)
+        stats = {'views': (row.views or 0) + pending_views, 'downloads': (row.downloads or 0) + pending_downloads}
+
+        similar_images = []
+        if file.extension in IMAGE_HASHABLE and image_index.enabled:
+            matches = image_index.similar(file.id)
+            if matches:
+                rows = {row.id: row for row in db.session.query(File.id, File.title, File.filename).filter(
+                    File.id.in_([match_id for _, match_id in matches]))}
+                similar_images = [(rows[match_id], distance) for distance, match_id in matches if match_id in rows]
+
+        return render_template('file_detail.html', file=file, file_exists=file_exists, stats=stats,
+                               similar_images=similar_images, related=related_files.for_file(file.id))
     except Exception as e:
         error_id = str(uuid.uuid4())[:8]
         current_app.logger.error(f'Error ID {error_id} viendo archivo {file_id}: {type(e).__name__}', exc_info=True)
         flash('Error interno al cargar el archivo', 'danger')
         return redirect(url_for('index'))
 
+@app.route('/api/files/<int:file_id>/stats')
+def api_file_stats(file_id):
+    """Vistas y descargas de un archivo, sin caché (la ficha sí se cachea y revalida)"""
+    try:
+        row = db.session.execute(
+            db.select(File.filename, FileStats.views, FileStats.downloads)
+            .outerjoin(FileStats, FileStats.file_id == File.id).where(File.id == file_id)
+        ).first()
+        if row is None:
+            return {'error': 'not_found'}, 404, NO_STORE
+        pending_views, pending_downloads = usage_counters.pending(file_id, row.filename)
+        return {'views': (row.views or 0) + pending_views,
+                'downloads': (row.downloads or 0) + pending_downloads}, 200, NO_STORE
+    except Exception as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} en API de uso: {type(e).__name__}', exc_info=True)
+        return {'error': 'internal_error', 'error_id': error_id}, 500, NO_STORE
+
+@app.route('/download.zip')
+@limiter.limit("30 per minute")
+def download_zip():
+    """Los archivos seleccionados (ids=1,2,3) o los resultados de la búsqueda en un ZIP generado al vuelo"""
+    ids = request.args.get('ids', '', type=str)
+    search = request.args.get('search', '', type=str)
+    filters = get_active_filters(request.args)
+    if ids:
+        file_ids = [int(value) for value in ids.split(',') if value.strip().isdigit()]
+        conditions = [File.id.in_(file_ids[:app.config['ZIP_MAX_FILES'] + 1])]
+        back = url_for('admin_panel') if session.get('logged_in') else url_for('index')
+    else:
+        conditions = file_filter_conditions(filters, search)
+        back = url_for('index', search=search or None, **filters)
+    try:
+        plan = zip_archiver.plan(conditions)
+    except ArchiveTooLarge as e:
+        flash(str(e), 'warning')
+        return redirect(back)
+    except Exception as e:
+        db.session.rollback()
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} preparando el ZIP: {type(e).__name__}', exc_info=True)
+        flash(f'Error interno al preparar la descarga (ID: {error_id})', 'danger')
+        return redirect(back)
+    if not plan.entries:
+        flash('No hay archivos que descargar', 'warning')
+        return redirect(back)
+
+    if request.range is None:
+        current_app.logger.info(f'Descarga ZIP - IP: {get_remote_address()}, Archivos: {len(plan.entries)}, '
+                                f'Tamaño: {plan.size / 1024 ** 2:.2f}MB')
+        for entry in plan.entries:
+            usage_counters.download(entry[1])
+    return zip_archiver.response(plan, f'metadatos-{plan.etag[:8]}.zip')
+
+def _send_generated(name, mimetype):
+    """Sitemap o feed generado en disco, con ETag/Last-Modified (nginx los sirve directamente)"""
+    path = sitemaps.ensure(name)
+    if path is None:
+        # Primera generación en curso (o `flask build-sitemaps` al desplegar)
+        return Response('Generando los sitemaps, vuelve a intentarlo en unos segundos\n', status=503,
+                        mimetype='text/plain', headers={'Retry-After': '30'})
+    if not os.path.exists(path):
+        abort(404)
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=True, max_age=0)
+    response.cache_control.public = True
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/sitemap.xml')
+@limiter.exempt
+def sitemap_index():
+    """Índice de sitemaps (los trozos se regeneran al subir, borrar o editar)"""
+    return _send_generated(INDEX, 'application/xml')
+
+@app.route('/sitemaps/<name>')
+@limiter.exempt
+def sitemap_chunk(name):
+    """Un trozo del sitemap: páginas públicas o hasta SITEMAP_CHUNK_SIZE fichas"""
+    if name != PAGES and not re.fullmatch(r'sitemap-\d{5}\.xml', name):
+        abort(404)
+    return _send_generated(name, 'application/xml')
+
+@app.route('/feed.atom')
+@limiter.exempt
+def atom_feed():
+    """Feed Atom de las últimas subidas"""
+    return _send_generated(FEED, 'application/atom+xml')
+
+# El flujo es público y puede servirse desde otro origen (EVENTS_PUBLIC_URL)
+EVENTS_CORS = {'Access-Control-Allow-Origin': '*', 'Access-Control-Allow-Headers': 'Last-Event-ID'}
+
+@app.route('/events', methods=['GET', 'OPTIONS'])
+@limiter.exempt
+def catalog_events():
+    """Flujo SSE de subidas, borrados y cambios del catálogo, reanudable con Last-Event-ID"""
+    if request.method == 'OPTIONS':
+        return '', 204, EVENTS_CORS
+    # EventSource envía la cabecera al reconectar; el parámetro sirve a clientes que no pueden
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    if last_event_id is None:
+        last_event_id = request.args.get('last_event_id', type=int)
+    if not event_broadcaster.subscribe():
+        return Response('Demasiadas conexiones abiertas\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30', **EVENTS_CORS})
+    try:
+        cursor, initial = event_broadcaster.resume(last_event_id)
+    except Exception as e:
+        event_broadcaster.unsubscribe()
+        db.session.rollback()
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} abriendo /events: {type(e).__name__}', exc_info=True)
+        return Response(f'Error interno (ID: {error_id})\n', status=503, mimetype='text/plain',
+                        headers={'Retry-After': '30'})
+
+    # Sin stream_with_context: la conexión a la BD vuelve al pool antes del primer evento
+    response = Response(event_broadcaster.stream(cursor, initial), mimetype='text/event-stream')
+    response.call_on_close(event_broadcaster.unsubscribe)
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers.update(EVENTS_CORS)
+    return response
+
+@app.route('/robots.txt')
+@limiter.exempt
+def robots_txt():
+    """Los rastreadores encuentran los archivos en el sitemap en lugar de paginar la portada"""
+    lines = ['User-agent: *', 'Disallow: /admin', 'Disallow: /login', 'Disallow: /download.zip',
+             'Disallow: /api/', f"Sitemap: {sitemaps.base_url}{url_for('sitemap_index')}"]
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain', headers={'Cache-Control': 'public, max-age=86400'})
+
+def counts_as_download():
+    """GET completo o el primer tramo de una descarga por Range (no cada reanudación)"""
+    if request.method != 'GET':
+        return False
+    return request.range is None or request.range.ranges[0][0] == 0
+
+def stored_key(filename):
+    """Clave de un archivo subido en el almacenamiento, o None
+
+    En disco se comprueba directamente; con un backend remoto se lee
+    files.compressed en lugar de sondear las dos claves con HEAD.
+    """
+    if not storage.remote:
+        return storage.locate(filename)
+    row = db.session.execute(db.select(File.compressed).where(File.filename == filename)).first()
+    return storage.resolve(filename, row.compressed) if row is not None else None
+
+DOWNLOAD_HIT_HEADER = 'X-Download-Hit-Secret'
+
+@app.route('/internal/download-hit/uploads/<path:filename>')
+@limiter.exempt
+def download_hit(filename):
+    """Cuenta una descarga servida por nginx (directiva mirror de /uploads/)
+
+    nginx no expone /internal/, pero el puerto de la app puede estar
+    publicado: solo cuenta si llega la cabecera con DOWNLOAD_HIT_SECRET que
+    añade nginx, y solo archivos que existen.
+    """
+    secret = app.config['DOWNLOAD_HIT_SECRET']
+    sent = request.headers.get(DOWNLOAD_HIT_HEADER, '')
+    if not secret or not hmac.compare_digest(sent.encode(), secret.encode()):
+        abort(404)
+    if (counts_as_download() and safe_join(app.config['UPLOAD_FOLDER'], filename) is not None
+            and stored_key(filename) is not None):
+        usage_counters.download(filename)
+    return '', 204
+
+@app.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    """Archivo subido; los comprimidos en reposo se sirven tal cual con Content-Encoding: gzip
+
+    Equivale a `gzip_static always` + `gunzip on` de nginx cuando no hay proxy
+    delante: a los clientes que no aceptan gzip se les descomprime al vuelo.
+    Con un backend remoto se redirige a una URL prefirmada del bucket, salvo
+    los comprimidos para esos clientes, que se leen del bucket y se descomprimen.
+    """
+    folder = app.config['UPLOAD_FOLDER']
+    if safe_join(folder, filename) is None:
+        abort(404)
+    key = stored_key(filename)
+    if key is None:
+        abort(404)
+    if counts_as_download():
+        usage_counters.download(filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    if storage.remote:
+        if is_compressed(key) and not request.accept_encodings['gzip']:
+            # La URL prefirmada entregaría el gzip tal cual
+            response = Response(iter_decompressed(storage.open(key)), mimetype=mimetype)
+            response.content_length = gzip_original_size(storage.tail(key, 4))
+        else:
+            response = redirect(storage.url(key))
+        response.vary.add('Accept-Encoding')
+        return response
+    if not is_compressed(key):
+        return send_from_directory(folder, filename)
+
+    path = storage.path(key)
+
+    if request.accept_encodings['gzip']:
+        response = send_file(path, mimetype=mimetype, conditional=True)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(iter_decompressed(path), mimetype=mimetype)
+        response.content_length = original_size(path)
+        response.last_modified = datetime.utcfromtimestamp(os.path.getmtime(path))
+    response.vary.add('Accept-Encoding')
+    return response
+
+
+# Tamaños de la nube de etiquetas (clases tag-size-1 .. tag-size-5)
+TAG_CLOUD_LIMIT = 100
+TAG_CLOUD_SIZES = 5
+
+def tag_cloud(limit=TAG_CLOUD_LIMIT, min_count=1):
+    """Etiquetas más usadas con un peso logarítmico de 1 a TAG_CLOUD_SIZES"""
+    rows = Tag.cloud(limit=limit, min_count=min_count)
+    if not rows:
+        return []
+    top = math.log(rows[0].file_count + 1)
+    bottom = math.log(rows[-1].file_count + 1)
+    spread = (top - bottom) or 1.0
+    cloud = [{
+        'name': row.name,
+        'label': row.label,
+        'count': row.file_count,
+        'weight': 1 + round((math.log(row.file_count + 1) - bottom) / spread * (TAG_CLOUD_SIZES - 1)),
+        'url': url_for('index', subject=row.name),
+    } for row in rows]
+    return sorted(cloud, key=lambda tag: tag['name'])
+
+@app.route('/tags')
+@page_cache.conditional(page_cache.catalog_validators)
+def tags_page():
+    """Nube de palabras clave del catálogo"""
+    try:
+        return render_template('tags.html', tags=tag_cloud())
+    except Exception as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} cargando palabras clave: {type(e).__name__}', exc_info=True)
+        flash('Error interno al cargar las palabras clave', 'danger')
+        return redirect(url_for('index'))
+
+@app.route('/api/tags')
+def api_tags():
+    """Nube de palabras clave en JSON (?limit=, ?min=)"""
+    try:
+        limit = max(1, min(request.args.get('limit', TAG_CLOUD_LIMIT, type=int), 500))
+        min_count = request.args.get('min', 1, type=int)
+        return {'tags': tag_cloud(limit=limit, min_count=min_count)}, 200
+    except Exception as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} en API de palabras clave: {type(e).__name__}', exc_info=True)
+        return {'error': 'internal_error', 'error_id': error_id}, 500
+
+
+@app.route('/api/suggest')
+@limiter.limit("120 per minute")
+def api_suggest():
+    """Autocompletado de búsqueda desde el índice de palabras en memoria (?q=)"""
+    try:
+        query = request.args.get('q', '', type=str)[:100]
+        suggestions = suggest_index.suggest(query)
+        for item in suggestions:
+            if item['type'] == 'tag':
+                item['url'] = url_for('index', subject=item['name'])
+            else:
+                item['url'] = url_for('view_file', file_id=item['id'])
+        return {'query': query, 'suggestions': suggestions}, 200
+    except Exception as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Error ID {error_id} en API de sugerencias: {type(e).__name__}', exc_info=True)
+        return {'error': 'internal_error', 'error_id': error_id}, 500
+
 
 @app.route('/health')
+@limiter.exempt
 def health_check():
-    """Health check endpoint for Docker"""
+    """Health check clásico (compatibilidad): estado cacheado de la BD"""
     try:
-        # Verificar base de datos usando método seguro
-        from database import check_db_connection
-        
-        if not check_db_connection():
-            return {'status': 'unhealthy', 'reason': 'database_connection_failed'}, 500
-        return {'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()}, 200
+        if not health_monitor.database_ok():
+            return {'status': 'unhealthy', 'reason': 'database_connection_failed'}, 500, NO_STORE
+        return {'status': 'healthy', 'timestamp': datetime.utcnow().isoformat()}, 200, NO_STORE
     except Exception as e:
         error_id = str(uuid.uuid4())[:8]
         current_app.logger.error(f'Health check error ID {error_id}: {type(e).__name__}', exc_info=True)
-        return {'status': 'unhealthy', 'error_id': error_id}, 500
+        return {'status': 'unhealthy', 'error_id': error_id}, 500, NO_STORE
+
+@app.route('/health/live')
+@limiter.exempt
+def health_live():
+    """Liveness: el proceso responde (sin BD ni disco)"""
+    return health_monitor.live(), 200, NO_STORE
+
+@app.route('/health/ready')
+@limiter.exempt
+def health_ready():
+    """Readiness: sondas cacheadas de BD, pool, disco, colas y último escaneo de integridad"""
+    try:
+        status, report = health_monitor.ready()
+        return report, 503 if status == 'fail' else 200, NO_STORE
+    except Exception as e:
+        error_id = str(uuid.uuid4())[:8]
+        current_app.logger.error(f'Readiness error ID {error_id}: {type(e).__name__}', exc_info=True)
+        return {'status': 'fail', 'error_id': error_id}, 503, NO_STORE
 
 # Funciones de utilidad de seguridad
 def verify_file_integrity():
@@ -742,10 +1591,10 @@ def verify_file_integrity():
     try:
         files = File.query.all()
         for file_record in files:
-            file_path = os.path.join(app.config['UPLOAD_FOLDER'], file_record.filename)
-            if not os.path.exists(file_path):
+            key = storage.locate(file_record.filename)
+            if key is None:
                 issues.append(f"Archivo faltante: {file_record.filename}")
-            elif not os.access(file_path, os.R_OK):
+            elif not storage.remote and not os.access(storage.path(key), os.R_OK):
                 issues.append(f"Archivo sin permisos de lectura: {file_record.filename}")
     except Exception as e:
         error_id = str(uuid.uuid4())[:8]
@@ -758,5 +1607,151 @@ def verify_file_integrity():
     return issues
 
 
+@app.cli.command('rebuild-tags')
+def rebuild_tags_command():
+    """Reconstruye el índice de palabras clave (tags/file_tags) desde dc_subject"""
+    files, tags = Tag.rebuild()
+    db.session.commit()
+    print(f"✅ Índice de palabras clave reconstruido: {files} archivos, {tags} etiquetas")
+
+
+@app.cli.command('extract-text')
+@click.option('--workers', type=int, default=None, help='Procesos (por defecto, uno por núcleo)')
+@click.option('--retry-failed', is_flag=True, help='Reintentar también las extracciones fallidas')
+def extract_text_command(workers, retry_failed):
+    """Extrae el texto de los archivos pendientes en paralelo (backfill)"""
+    def progress(done, total):
+        print(f'\r  {done:,}/{total:,} archivos', end='', flush=True)
+
+    totals = run_backfill(app, workers=workers, retry_failed=retry_failed, progress=progress)
+    print()
+    summary = ', '.join(f'{status}: {count}' for status, count in sorted(totals.items())) or 'nada pendiente'
+    print(f"✅ Extracción de texto completada ({summary})")
+
+
+@app.cli.command('backfill-metadata')
+@click.option('--batch-size', type=int, default=500, help='Archivos por lote')
+@click.option('--include-language', is_flag=True, help='Sustituir también el idioma por el declarado en el archivo')
+def backfill_metadata_command(batch_size, include_language):
+    """Completa autor, derechos e idioma desde los metadatos embebidos de los archivos"""
+    def progress(done, total):
+        print(f'\r  {done:,}/{total:,} archivos', end='', flush=True)
+
+    scanned, updated = run_metadata_backfill(app, batch_size=batch_size, include_language=include_language,
+                                             progress=progress)
+    print()
+    print(f"✅ Metadatos embebidos aplicados: {updated} de {scanned} archivos revisados")
+
+
+@app.cli.command('hash-images')
+@click.option('--workers', type=int, default=None, help='Procesos (por defecto, uno por núcleo)')
+def hash_images_command(workers):
+    """Calcula los hashes perceptuales de las imágenes que aún no los tienen"""
+    def progress(done, total):
+        print(f'\r  {done:,}/{total:,} imágenes', end='', flush=True)
+
+    hashed, failed = run_hash_backfill(app, workers=workers, progress=progress)
+    print()
+    print(f"✅ Hashes perceptuales calculados: {hashed} imágenes ({failed} ilegibles)")
+
+
+@app.cli.command('sign-documents')
+@click.option('--batch-size', type=int, default=500, help='Archivos por lote')
+def sign_documents_command(batch_size):
+    """Calcula las firmas MinHash que faltan (título y descripción, y contenido extraído)"""
+    def progress(done, total):
+        print(f'\r  {done:,}/{total:,} archivos', end='', flush=True)
+
+    meta_count, text_count = run_signature_backfill(app, batch_size=batch_size, progress=progress)
+    print()
+    print(f"✅ Firmas MinHash calculadas: {meta_count} de metadatos, {text_count} de contenido")
+
+
+@app.cli.command('related-files')
+@click.option('--full', is_flag=True, help='Recalcular los vecinos de todo el catálogo con el IDF actual')
+@click.option('--batch-size', type=int, default=500, help='Archivos por lote')
+def related_files_command(full, batch_size):
+    """Actualiza los archivos relacionados (TF-IDF) de los archivos nuevos o modificados"""
+    def progress(done, total):
+        print(f'\r  {done:,}/{total:,} archivos', end='', flush=True)
+
+    vectorized, refreshed = related_files.refresh(full=full, batch_size=batch_size, progress=progress)
+    print()
+    print(f"✅ Archivos relacionados actualizados: {vectorized} vectorizados, {refreshed} con vecinos recalculados")
+
+@app.cli.command('compress-uploads')
+@click.option('--report', 'report_only', is_flag=True, help='Solo mostrar el espacio ahorrado, sin comprimir')
+def compress_uploads_command(report_only):
+    """Comprime con gzip los txt/csv guardados sin comprimir y muestra el espacio ahorrado"""
+    if not report_only:
+        def progress(done, total):
+            print(f'\r  {done:,}/{total:,} archivos', end='', flush=True)
+
+        compressed = upload_compressor.backfill(progress=progress)
+        print()
+        print(f'✅ Archivos comprimidos: {compressed}')
+
+    totals = upload_compressor.report()
+    original = sum(entry['original'] for entry in totals.values())
+    stored = sum(entry['stored'] for entry in totals.values())
+    for extension, entry in sorted(totals.items()):
+        print(f"  {extension:<5} {entry['compressed']:>6}/{entry['files']:<6} comprimidos  "
+              f"{entry['original'] / 1024 ** 2:>10.2f} MB -> {entry['stored'] / 1024 ** 2:>10.2f} MB")
+    saved = original - stored
+    print(f"✅ Espacio ahorrado: {saved / 1024 ** 2:.2f} MB "
+          f"({saved / original:.0%} de {original / 1024 ** 2:.2f} MB)" if original else '✅ No hay archivos comprimibles')
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Minifica, pone huella y precomprime css/js en static/dist/ (servidos como immutable)"""
+    built = build_assets(app.static_folder)
+    static_assets.load()
+    for name, (target, original, minified, compressed) in sorted(built.items()):
+        sizes = ', '.join(f'{suffix} {size / 1024:.1f} KB' for suffix, size in sorted(compressed.items()))
+        print(f"  {name:<24} -> {target:<40} {original / 1024:>7.1f} KB -> {minified / 1024:>7.1f} KB"
+              + (f'  ({sizes})' if sizes else ''))
+    print(f'✅ Recursos compilados: {len(built)} (manifiesto {static_assets.version})')
+
+@app.cli.command('checksum-files')
+@click.option('--batch-size', default=100, show_default=True, help='Archivos por transacción')
+def checksum_files_command(batch_size):
+    """Calcula el tamaño exacto y el CRC-32 de los archivos subidos antes de las descargas en ZIP"""
+    def progress(done, total):
+        print(f'\r  {done:,}/{total:,} archivos', end='', flush=True)
+
+    updated = zip_archiver.backfill(batch_size=batch_size, progress=progress)
+    print()
+    print(f'✅ Sumas de control calculadas: {updated}')
+
+@app.cli.command('build-sitemaps')
+@click.option('--full', is_flag=True, help='Regenerar todos los trozos, no solo los cambiados')
+def build_sitemaps_command(full):
+    """Genera (o pone al día) sitemap.xml, sus trozos y feed.atom en SITEMAP_FOLDER"""
+    chunks = sitemaps.refresh(full=full)
+    print(f'✅ Sitemaps al día en {sitemaps.folder}: {chunks} trozo(s) regenerados')
+
+@app.cli.command('gc-uploads')
+@click.option('--dry-run', is_flag=True, help='Solo informar, sin mover ni borrar archivos')
+def gc_uploads_command(dry_run):
+    """Concilia el almacenamiento de subidas con la BD: cuarentena de huérfanos y filas sin archivo"""
+    def progress(rows):
+        print(f'\r  {rows:,} filas recorridas', end='', flush=True)
+
+    report = upload_reconciler.run(dry_run=dry_run, progress=progress)
+    print()
+    mb = 1024 ** 2
+    print(f"  Archivos en {storage.describe()}: {report['files']:,}  Filas en la BD: {report['rows']:,}")
+    print(f"  Huérfanos: {report['orphans']:,} ({report['orphan_bytes'] / mb:.2f} MB), "
+          f"{report['in_grace']:,} aún dentro del periodo de gracia")
+    print(f"  Purgados de la cuarentena: {report['purged']:,} ({report['purged_bytes'] / mb:.2f} MB)")
+    for file_id, filename in report['dangling_sample']:
+        print(f'    fila sin archivo: #{file_id} {filename}')
+    if report['dangling'] > len(report['dangling_sample']):
+        print(f"    ... y {report['dangling'] - len(report['dangling_sample']):,} más")
+    action = 'se moverían' if dry_run else 'movidos'
+    print(f"✅ {report['quarantined']:,} huérfanos {action} a la cuarentena; "
+          f"{report['dangling']:,} filas sin archivo")
+
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -0,0 +1,310 @@
+"""
+Descarga de varios archivos en un ZIP generado al vuelo
+
+El ZIP se escribe mientras se envía, sin archivos temporales y con memoria
+constante: cada archivo se lee del almacenamiento por bloques y pasa tal
+cual al cliente. Todas las entradas van sin comprimir (STORED): pdf, jpg,
+docx... ya están comprimidos y recomprimirlos solo gastaría CPU, y los
+txt/csv guardados en .gz (compression.py) se descomprimen al vuelo.
+
+Sin compresión, la disposición del archivo depende solo de la BD: nombre,
+fecha, tamaño y CRC-32 de cada archivo (files.size_bytes y files.crc32, que
+se calculan al subirlo o con `flask checksum-files`). Con eso se conocen
+antes de leer nada el tamaño total (Content-Length), una ETag fuerte y la
+posición de cada byte, así que se atienden peticiones Range (206) y una
+descarga interrumpida se reanuda con If-Range desde donde se cortó,
+leyendo solo los archivos a partir de ese punto.
+
+Los archivos sin suma de control se leen una vez al preparar la descarga y
+se guarda el resultado; los que faltan en el almacenamiento no se incluyen.
+El formato es ZIP clásico (sin ZIP64), de ahí ZIP_MAX_MB < 4 GB.
+"""
+
+import bisect
+import gzip
+import hashlib
+import logging
+import os
+import posixpath
+import struct
+import zlib
+from contextlib import closing
+from datetime import datetime
+
+from flask import Response, request
+from werkzeug.datastructures import ContentRange
+
+from compression import READ_CHUNK, is_compressed
+from database import File, db
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+ZIP32_LIMIT = 0xFFFFFFFF
+NAME_MAX_LENGTH = 200
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+VERSION = 20  # 2.0: la versión mínima que entienden todos los descompresores
+MADE_BY = (3 << 8) | VERSION  # Unix, para que se apliquen los permisos
+UTF8_NAMES = 0x0800
+FILE_MODE = 0o100644 << 16
+
+
+class ArchiveTooLarge(ValueError):
+    """La selección supera ZIP_MAX_FILES o ZIP_MAX_MB"""
+
+
+def checksum(fh, chunk_size=READ_CHUNK):
+    """(bytes, CRC-32) del contenido de un archivo abierto en binario"""
+    size, crc = 0, 0
+    while True:
+        chunk = fh.read(chunk_size)
+        if not chunk:
+            return size, crc
+        size += len(chunk)
+        crc = zlib.crc32(chunk, crc)
+
+
+def file_checksum(path):
+    """(bytes, CRC-32) de un archivo local sin comprimir"""
+    with open(path, 'rb') as fh:
+        return checksum(fh)
+
+
+def dos_datetime(value):
+    """(hora, fecha) en formato MS-DOS; el formato no admite años anteriores a 1980"""
+    if value is None or value.year < 1980:
+        value = datetime(1980, 1, 1)
+    return ((value.hour << 11) | (value.minute << 5) | (value.second // 2),
+            ((min(value.year, 2107) - 1980) << 9) | (value.month << 5) | value.day)
+
+
+def entry_name(file_id, original_filename, filename, used):
+    """Nombre de la entrada: el original sin rutas ni caracteres de control, único en el ZIP"""
+    name = (original_filename or filename).replace('\\', '/').rsplit('/', 1)[-1]
+    name = ''.join(char for char in name if char >= ' ' and char != '\x7f').strip().lstrip('.') or filename
+    stem, extension = posixpath.splitext(name)
+    name = stem[:NAME_MAX_LENGTH - len(extension)] + extension
+    if name.lower() in used:
+        name = f'{stem[:NAME_MAX_LENGTH - len(extension) - 12]} ({file_id}){extension}'
+    used.add(name.lower())
+    return name
+
+
+class ZipPlan:
+    """Disposición byte a byte de un ZIP: cabeceras en memoria y contenido por referencia
+
+    `entries` son tuplas (file_id, filename, nombre en el ZIP, bytes, CRC-32,
+    fecha, files.compressed) en el orden del archivo.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self._offsets = []
+        self._parts = []
+        central = []
+        offset = 0
+        for file_id, filename, name, size, crc, modified, compressed in entries:
+            encoded = name.encode('utf-8')
+            dos_time, dos_date = dos_datetime(modified)
+            header = LOCAL_HEADER.pack(0x04034b50, VERSION, UTF8_NAMES, 0, dos_time, dos_date, crc, size, size,
+                                       len(encoded), 0) + encoded
+            central.append(CENTRAL_HEADER.pack(0x02014b50, MADE_BY, VERSION, UTF8_NAMES, 0, dos_time, dos_date, crc,
+                                               size, size, len(encoded), 0, 0, 0, 0, FILE_MODE, offset) + encoded)
+            self._add(offset, header)
+            offset += len(header)
+            self._add(offset, (filename, compressed, size, crc))
+            offset += size
+
+        directory = b''.join(central)
+        directory += END_RECORD.pack(0x06054b50, 0, 0, len(entries), len(entries), len(directory), offset, 0)
+        self._add(offset, directory)
+        self.size = offset + len(directory)
+
+        digest = hashlib.sha256(b'zip-stored-v1')
+        for file_id, filename, name, size, crc, modified, _ in entries:
+            digest.update(f'{file_id}|{filename}|{name}|{size}|{crc}|{modified}\n'.encode('utf-8'))
+        self.etag = digest.hexdigest()[:32]
+
+    def _add(self, offset, part):
+        self._offsets.append(offset)
+        self._parts.append(part)
+
+    def iter_bytes(self, storage, start, stop):
+        """Bytes [start, stop) del ZIP, leyendo solo los archivos de ese tramo"""
+        index = bisect.bisect_right(self._offsets, start) - 1
+        while index < len(self._parts) and self._offsets[index] < stop:
+            begin = self._offsets[index]
+            part = self._parts[index]
+            skip = max(0, start - begin)
+            if isinstance(part, bytes):
+                yield part[skip:stop - begin]
+            else:
+                filename, compressed, size, crc = part
+                try:
+                    yield from _iter_file(storage, filename, compressed, skip, min(size, stop - begin), size, crc)
+                except OSError as e:
+                    # Las cabeceras ya enviadas anuncian este archivo: solo queda cortar la descarga
+                    logger.error(f'ZIP interrumpido en {filename}: {type(e).__name__}')
+                    raise
+            index += 1
+
+
+def _open(storage, filename, compressed, start):
+    """(lector desde el byte `start` del contenido, archivo subyacente)"""
+    key = storage.resolve(filename, compressed)
+    if key is None:
+        raise FileNotFoundError(filename)
+    if not is_compressed(key):
+        raw = storage.open(key, start)
+        return raw, raw
+    raw = storage.open(key)
+    reader = gzip.GzipFile(fileobj=raw, mode='rb')
+    if start:
+        reader.seek(start)  # Descomprime y descarta hasta `start`
+    return reader, raw
+
+
+def _iter_file(storage, filename, compressed, start, stop, size, crc):
+    """Bytes [start, stop) del contenido de un archivo; comprueba el CRC si se envía entero"""
+    reader, raw = _open(storage, filename, compressed, start)
+    try:
+        remaining = stop - start
+        computed = 0
+        while remaining > 0:
+            chunk = reader.read(min(READ_CHUNK, remaining))
+            if not chunk:
+                # El tamaño declarado en la cabecera ya no se puede cumplir: se corta la descarga
+                raise IOError(f'{filename} tiene menos bytes de los registrados ({size})')
+            computed = zlib.crc32(chunk, computed)
+            remaining -= len(chunk)
+            yield chunk
+        if start == 0 and stop == size and computed != crc:
+            logger.warning(f'CRC-32 de {filename} distinto del registrado: el ZIP avisará de un error')
+    finally:
+        reader.close()
+        if raw is not reader:
+            raw.close()
+
+
+class ZipArchiver:
+    """Selecciona los archivos, prepara la disposición del ZIP y lo envía por tramos"""
+
+    def __init__(self, storage, max_files=1000, max_bytes=2048 * MB):
+        self.storage = storage
+        self.max_files = max_files
+        self.max_bytes = min(max_bytes, ZIP32_LIMIT - max_files * (76 + 8 * NAME_MAX_LENGTH))
+
+    def _fill_checksums(self, rows):
+        """Calcula y guarda size_bytes y crc32 de las filas que no los tienen; devuelve {id: (bytes, crc)}"""
+        computed = {}
+        for row in rows:
+            key = self.storage.resolve(row.filename, row.compressed)
+            if key is None:
+                continue
+            with closing(self.storage.open(key)) as raw:
+                if is_compressed(key):
+                    with gzip.GzipFile(fileobj=raw, mode='rb') as fh:
+                        computed[row.id] = checksum(fh)
+                else:
+                    computed[row.id] = checksum(raw)
+        if computed:
+            files = File.__table__
+            db.session.execute(
+                files.update().where(files.c.id == db.bindparam('file_key'))
+                .values(size_bytes=db.bindparam('size'), crc32=db.bindparam('crc')),
+                [{'file_key': file_id, 'size': size, 'crc': crc} for file_id, (size, crc) in computed.items()]
+            )
+            db.session.commit()
+        return computed
+
+    def plan(self, conditions):
+        """ZipPlan de los archivos que cumplen `conditions`, en orden de id"""
+        rows = db.session.execute(
+            db.select(File.id, File.filename, File.original_filename, File.upload_date, File.size_bytes,
+                      File.crc32, File.compressed).where(*conditions).order_by(File.id).limit(self.max_files + 1)
+        ).all()
+        if len(rows) > self.max_files:
+            raise ArchiveTooLarge(f'Se pueden descargar como mucho {self.max_files} archivos a la vez')
+
+        computed = self._fill_checksums([row for row in rows if row.crc32 is None or row.size_bytes is None])
+        entries, used, total = [], set(), 0
+        for row in rows:
+            size, crc = computed.get(row.id, (row.size_bytes, row.crc32))
+            if crc is None:
+                continue  # No está en el almacenamiento
+            total += size
+            if total > self.max_bytes:
+                raise ArchiveTooLarge(f'La descarga supera {self.max_bytes // MB} MB: acota la selección')
+            name = entry_name(row.id, row.original_filename, row.filename, used)
+            entries.append((row.id, row.filename, name, size, crc, row.upload_date, row.compressed))
+        return ZipPlan(entries)
+
+    def response(self, plan, download_name):
+        """Respuesta 200, 206 (Range) o 416 que genera el ZIP al enviarlo"""
+        if request.if_none_match.contains(plan.etag):
+            response = Response(status=304)
+            response.set_etag(plan.etag)
+            return response
+
+        start, stop, status = 0, plan.size, 200
+        if_range = request.if_range
+        # If-Range con otra ETag (o con fecha: no hay Last-Modified): el ZIP cambió, se envía entero
+        resumable = if_range.etag == plan.etag or (if_range.etag is None and if_range.date is None)
+        if request.range is not None and resumable:
+            window = request.range.range_for_length(plan.size)
+            if window is not None:
+                (start, stop), status = window, 206
+            elif len(request.range.ranges) == 1:
+                response = Response(status=416)
+                response.content_range = ContentRange('bytes', None, None, plan.size)
+                return response
+
+        response = Response(plan.iter_bytes(self.storage, start, stop), status=status, mimetype='application/zip',
+                            direct_passthrough=True)
+        response.content_length = stop - start
+        if status == 206:
+            response.content_range = ContentRange('bytes', start, stop, plan.size)
+        response.accept_ranges = 'bytes'
+        response.set_etag(plan.etag)
+        response.cache_control.no_cache = True
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+        # nginx pasa el flujo al cliente sin volcarlo a un archivo temporal
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    def backfill(self, batch_size=100, progress=None):
+        """Calcula size_bytes y crc32 de los archivos subidos antes de estas columnas
+
+        Devuelve el número de archivos actualizados.
+        """
+        pending = db.session.execute(
+            db.select(db.func.count()).select_from(File).where(db.or_(File.crc32.is_(None), File.size_bytes.is_(None)))
+        ).scalar()
+        done = updated = 0
+        last_id = 0
+        while True:
+            rows = db.session.execute(
+                db.select(File.id, File.filename, File.compressed)
+                .where(File.id > last_id, db.or_(File.crc32.is_(None), File.size_bytes.is_(None)))
+                .order_by(File.id).limit(batch_size)
+            ).all()
+            if not rows:
+                return updated
+            updated += len(self._fill_checksums(rows))
+            last_id = rows[-1].id
+            done += len(rows)
+            if progress:
+                progress(done, pending)
+
+
+def init_archive(app, storage):
+    """Registra la descarga en ZIP con configuración por defecto"""
+    app.config.setdefault('ZIP_MAX_FILES', int(os.environ.get('ZIP_MAX_FILES', 1000)))
+    app.config.setdefault('ZIP_MAX_MB', int(os.environ.get('ZIP_MAX_MB', 2048)))
+
+    archiver = ZipArchiver(storage, max_files=app.config['ZIP_MAX_FILES'], max_bytes=app.config['ZIP_MAX_MB'] * MB)
+    app.extensions['metadatos_archive'] = archiver
+    return archiver
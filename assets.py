@@ -0,0 +1,251 @@
+"""
+Compilación de los recursos estáticos: minificado, huella y precompresión
+
+`flask build-assets` (o `python assets.py` en la imagen Docker, sin
+configurar la aplicación) genera static/dist/ a partir de static/:
+
+- css y js minificados con rcssmin/rjsmin (dependencias opcionales; sin
+  ellas los js se copian tal cual y los css pierden solo comentarios y
+  espacios);
+- cada archivo con el hash de su contenido en el nombre
+  (`css/style.3f9a0c12d4e5.css`), de modo que puede servirse como
+  `immutable` durante un año: un cambio produce otro nombre;
+- las referencias url() relativas de los css apuntan a los nombres con
+  huella;
+- versiones `.gz` y `.br` (esta con el paquete opcional brotli) junto a
+  cada archivo comprimible, para `gzip_static`/`brotli_static` de nginx o
+  para la ruta /static/ de Flask, que las sirve según Accept-Encoding.
+
+dist/manifest.json relaciona el nombre original con el generado. Con el
+manifiesto cargado, `url_for('static', filename='css/style.css')` devuelve
+el nombre con huella sin cambiar las plantillas; sin él (desarrollo) se
+sirven los originales. Tras editar un css o js hay que volver a compilar.
+"""
+
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import posixpath
+import re
+import shutil
+import sys
+
+from flask import abort, request, send_file
+from werkzeug.security import safe_join
+
+try:
+    import rcssmin
+except ImportError:  # Dependencia opcional
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:  # Dependencia opcional
+    rjsmin = None
+
+try:
+    import brotli
+except ImportError:  # Dependencia opcional
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+OUTPUTS = {DIST, DIST + '.tmp', DIST + '.old'}
+HASH_LENGTH = 12
+COMPRESSIBLE = {'.css', '.js', '.svg', '.json', '.txt', '.ico', '.map'}
+MIN_COMPRESS_BYTES = 256
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600  # segundos
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+CSS_URL = re.compile(r'''url\(\s*(['"]?)([^'")\s]+)\1\s*\)''')
+CSS_COMMENT = re.compile(r'/\*.*?\*/', re.S)
+
+
+def minify(text, extension):
+    """Minifica css o js; el resto se devuelve igual"""
+    if extension == '.css':
+        if rcssmin is not None:
+            return rcssmin.cssmin(text)
+        # Sin rcssmin: comentarios y espacios, sin tocar el interior de los selectores
+        text = CSS_COMMENT.sub('', text)
+        text = re.sub(r'\s+', ' ', text)
+        return re.sub(r'\s*([{};,])\s*', r'\1', text).strip()
+    if extension == '.js' and rjsmin is not None:
+        return rjsmin.jsmin(text)
+    return text
+
+
+def fingerprint(name, content):
+    """`css/style.css` -> `css/style.<hash>.css` según el contenido"""
+    stem, extension = posixpath.splitext(name)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:HASH_LENGTH]}{extension}'
+
+
+def _rewrite_urls(css, name, manifest):
+    """Las url() relativas de un css, a los nombres con huella"""
+    folder = posixpath.dirname(name)
+
+    def replace(match):
+        quote, reference = match.groups()
+        if reference.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path = re.split(r'[?#]', reference, maxsplit=1)[0]
+        suffix = reference[len(path):]
+        target = manifest.get(posixpath.normpath(posixpath.join(folder, path)))
+        if target is None:
+            return match.group(0)
+        relative = posixpath.relpath(target[len(DIST) + 1:], folder or '.')
+        return f'url({quote}{relative}{suffix}{quote})'
+    return CSS_URL.sub(replace, css)
+
+
+def _compress(path, data, level):
+    """Escribe las versiones .gz y .br si ahorran espacio; devuelve sus tamaños"""
+    sizes = {}
+    candidates = [('.gz', gzip.compress(data, compresslevel=level, mtime=0))]
+    if brotli is not None:
+        candidates.append(('.br', brotli.compress(data, quality=11)))
+    for suffix, compressed in candidates:
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as fh:
+                fh.write(compressed)
+            sizes[suffix] = len(compressed)
+    return sizes
+
+
+def _sources(static_folder):
+    """Rutas relativas (con /) de los archivos fuente, css al final para resolver sus url()"""
+    names = []
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if not (root == static_folder and d in OUTPUTS) and not d.startswith('.'))
+        for filename in sorted(files):
+            if filename.startswith('.'):
+                continue
+            names.append(posixpath.join(*os.path.relpath(os.path.join(root, filename), static_folder).split(os.sep)))
+    return sorted(names, key=lambda name: (name.endswith('.css'), name))
+
+
+def build_assets(static_folder, level=9):
+    """Genera static/dist/ y su manifiesto; devuelve {nombre: (generado, bytes originales, bytes, {sufijo: bytes})}"""
+    output = os.path.join(static_folder, DIST)
+    staging = output + '.tmp'
+    previous = output + '.old'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    manifest, report = {}, {}
+    try:
+        for name in _sources(static_folder):
+            with open(os.path.join(static_folder, *name.split('/')), 'rb') as fh:
+                original = fh.read()
+            extension = posixpath.splitext(name)[1].lower()
+            content = original
+            if extension in ('.css', '.js'):
+                text = minify(original.decode('utf-8'), extension)
+                if extension == '.css':
+                    text = _rewrite_urls(text, name, manifest)
+                content = text.encode('utf-8')
+
+            target = fingerprint(name, content)
+            path = os.path.join(staging, *target.split('/'))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as fh:
+                fh.write(content)
+            sizes = {}
+            if extension in COMPRESSIBLE and len(content) >= MIN_COMPRESS_BYTES:
+                sizes = _compress(path, content, level)
+            manifest[name] = f'{DIST}/{target}'
+            report[name] = (manifest[name], len(original), len(content), sizes)
+
+        with open(os.path.join(staging, MANIFEST), 'w') as fh:
+            json.dump(manifest, fh, indent=2, sort_keys=True)
+
+        # Sustitución de la carpeta entera: nunca queda un manifiesto a medias
+        shutil.rmtree(previous, ignore_errors=True)
+        if os.path.exists(output):
+            os.replace(output, previous)
+        os.replace(staging, output)
+        shutil.rmtree(previous, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return report
+
+
+class AssetManifest:
+    """Resuelve los nombres con huella y sirve static/dist/ precomprimido e inmutable"""
+
+    def __init__(self, static_folder, enabled=True):
+        self.static_folder = static_folder
+        self.enabled = enabled
+        self.files = {}
+        self.version = ''
+        self.load()
+
+    def load(self):
+        """(Re)carga dist/manifest.json; sin él se usan los nombres originales"""
+        path = os.path.join(self.static_folder, DIST, MANIFEST)
+        self.files, self.version = {}, ''
+        if not self.enabled or not os.path.exists(path):
+            return
+        with open(path, 'rb') as fh:
+            raw = fh.read()
+        self.files = json.loads(raw)
+        self.version = hashlib.sha256(raw).hexdigest()[:HASH_LENGTH]
+
+    def resolve(self, filename):
+        return self.files.get(filename, filename)
+
+    def url_defaults(self, endpoint, values):
+        """url_for('static', filename=...) con el nombre con huella si está en el manifiesto"""
+        if endpoint == 'static' and 'filename' in values:
+            values['filename'] = self.resolve(values['filename'])
+
+    def wrap_static(self, view):
+        """Vista de /static/ que sirve dist/ con .br/.gz según Accept-Encoding y caché de un año"""
+        def send_static(filename):
+            if (not filename.startswith(DIST + '/') or filename.endswith(('.gz', '.br'))
+                    or filename == f'{DIST}/{MANIFEST}'):
+                return view(filename=filename)
+            path = safe_join(self.static_folder, filename)
+            if path is None or not os.path.isfile(path):
+                abort(404)
+            mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+            for encoding, suffix in ENCODINGS:
+                if request.accept_encodings[encoding] and os.path.isfile(path + suffix):
+                    response = send_file(path + suffix, mimetype=mimetype, conditional=True,
+                                         max_age=IMMUTABLE_MAX_AGE)
+                    response.headers['Content-Encoding'] = encoding
+                    break
+            else:
+                response = send_file(path, mimetype=mimetype, conditional=True, max_age=IMMUTABLE_MAX_AGE)
+            response.vary.add('Accept-Encoding')
+            response.cache_control.public = True
+            response.cache_control.immutable = True
+            return response
+        return send_static
+
+
+def init_assets(app):
+    """Registra el manifiesto de recursos estáticos con configuración por defecto"""
+    app.config.setdefault('ASSETS_FINGERPRINT', os.environ.get('ASSETS_FINGERPRINT', 'true').lower() == 'true')
+
+    assets = AssetManifest(app.static_folder, enabled=app.config['ASSETS_FINGERPRINT'])
+    if assets.enabled and not assets.files:
+        logger.info('Sin static/dist/manifest.json: se sirven los recursos sin huella (flask build-assets)')
+    app.url_defaults(assets.url_defaults)
+    app.view_functions['static'] = assets.wrap_static(app.view_functions['static'])
+    app.extensions['metadatos_assets'] = assets
+    return assets
+
+
+if __name__ == '__main__':
+    # Paso de compilación de la imagen: no necesita la configuración de la aplicación
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    built = build_assets(folder)
+    print(f'✅ {len(built)} recursos compilados en {os.path.join(folder, DIST)}')
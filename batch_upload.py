@@ -0,0 +1,304 @@
+"""
+Subidas por lotes del panel de administración
+
+Un lote es una carpeta de preparación con un manifiesto por archivo:
+
+1. create() abre el lote para un usuario.
+2. prepare() recibe uno o varios archivos de una petición, los guarda en la
+   carpeta del lote y calcula en paralelo (UPLOAD_BATCH_WORKERS hilos) lo que
+   no necesita la BD: tamaño, CRC-32, metadatos embebidos, hashes
+   perceptuales y la compresión gzip. stage() anota el manifiesto con los
+   metadatos ya completados por la ruta.
+3. commit() asigna los nombres definitivos, envía los archivos al
+   almacenamiento en paralelo e inserta todas las filas de File en una
+   única transacción con un número fijo de sentencias (INSERT múltiple con
+   RETURNING, facet_counts, tags, hashes, firmas y catalog_changes), igual
+   que las operaciones masivas de bulk.py, que tampoco pasan por los
+   eventos del ORM.
+
+La carpeta de lotes debe ser compartida por todos los workers que atiendan
+las peticiones del panel (en Docker Compose, un único contenedor). Los
+lotes que nadie confirma se borran pasadas UPLOAD_BATCH_TTL_HOURS.
+"""
+
+import atexit
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from archive import file_checksum
+from compression import SUFFIX, is_compressed
+from database import (IMAGE_HASHABLE, MIME_BY_EXTENSION, CatalogChange, FacetCount, File, ImageHash, Tag, db,
+                      derived_file_columns, extension_of, facet_values, parse_tags)
+from document_similarity import meta_text
+from embedded_metadata import read_embedded_metadata
+from image_similarity import compute_hashes
+
+logger = logging.getLogger(__name__)
+
+BATCH_FILE = 'batch.json'
+MANIFEST_SUFFIX = '.entry.json'
+_BATCH_ID = re.compile(r'^[0-9a-f]{32}$')
+
+# Columnas de files que vienen de los metadatos de cada archivo
+METADATA_FIELDS = ('title', 'description', 'dc_subject', 'dc_creator', 'dc_rights', 'dc_language')
+
+
+class BatchNotFound(LookupError):
+    """El lote no existe, caducó o es de otro usuario"""
+
+
+class BatchFull(ValueError):
+    """El lote alcanzó UPLOAD_BATCH_MAX_FILES"""
+
+
+class UploadBatches:
+    """Lotes de subida preparados en disco y confirmados en una transacción"""
+
+    def __init__(self, folder, storage, compressor, images, documents, max_files=100, workers=4, ttl_hours=24.0):
+        self.folder = folder
+        self.storage = storage
+        self.compressor = compressor
+        self.images = images
+        self.documents = documents
+        self.max_files = max_files
+        self.ttl_hours = ttl_hours
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='upload-batch')
+        os.makedirs(folder, exist_ok=True)
+        atexit.register(self.shutdown)
+
+    # ----- ciclo de vida -----
+
+    def create(self, owner):
+        """Abre un lote vacío para `owner`; devuelve su id"""
+        self.purge()
+        batch_id = uuid.uuid4().hex
+        path = os.path.join(self.folder, batch_id)
+        os.makedirs(path)
+        with open(os.path.join(path, BATCH_FILE), 'w', encoding='utf-8') as fh:
+            json.dump({'owner': owner, 'created': datetime.utcnow().isoformat()}, fh)
+        return batch_id
+
+    def _path(self, batch_id, owner):
+        if not _BATCH_ID.match(batch_id or ''):
+            raise BatchNotFound(batch_id)
+        path = os.path.join(self.folder, batch_id)
+        try:
+            with open(os.path.join(path, BATCH_FILE), encoding='utf-8') as fh:
+                info = json.load(fh)
+        except (OSError, ValueError):
+            raise BatchNotFound(batch_id)
+        if info.get('owner') != owner:
+            raise BatchNotFound(batch_id)
+        return path
+
+    def discard(self, batch_id, owner):
+        """Descarta un lote sin confirmar y sus archivos"""
+        shutil.rmtree(self._path(batch_id, owner), ignore_errors=True)
+
+    def purge(self):
+        """Borra los lotes abandonados más antiguos que ttl_hours; devuelve cuántos"""
+        limit = time.time() - self.ttl_hours * 3600
+        purged = 0
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_dir() and _BATCH_ID.match(entry.name) and entry.stat().st_mtime < limit:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                    purged += 1
+        return purged
+
+    def entries(self, batch_id, owner):
+        """Manifiestos de los archivos preparados, en el orden en que llegaron"""
+        return self._entries(self._path(batch_id, owner))
+
+    @staticmethod
+    def _entries(path):
+        entries = []
+        for name in os.listdir(path):
+            if name.endswith(MANIFEST_SUFFIX):
+                with open(os.path.join(path, name), encoding='utf-8') as fh:
+                    entries.append(json.load(fh))
+        return sorted(entries, key=lambda entry: entry['received'])
+
+    # ----- preparación -----
+
+    def prepare(self, batch_id, owner, uploads):
+        """Guarda en el lote los archivos [(FileStorage, metadatos)] y los procesa en paralelo
+
+        Devuelve un manifiesto por archivo (aún sin anotar: ver stage()), en
+        el mismo orden. Los metadatos deben llegar validados y sanitizados.
+        """
+        path = self._path(batch_id, owner)
+        staged = sum(1 for name in os.listdir(path) if name.endswith(MANIFEST_SUFFIX))
+        if staged + len(uploads) > self.max_files:
+            raise BatchFull(f'Un lote admite como máximo {self.max_files} archivos')
+
+        # El cuerpo de la petición solo puede leerse desde su propio hilo
+        jobs = []
+        for upload, metadata in uploads:
+            key = uuid.uuid4().hex
+            extension = extension_of(upload.filename)
+            local = os.path.join(path, f'{key}.{extension}')
+            upload.save(local)
+            jobs.append((key, local, upload.filename, extension,
+                         {field: metadata.get(field) for field in METADATA_FIELDS}, time.time()))
+        return list(self._executor.map(self._process, jobs))
+
+    def _process(self, job):
+        key, local, original_filename, extension, metadata, received = job
+        size_bytes, crc32 = file_checksum(local)
+        hashes = None
+        if self.images.enabled and extension in IMAGE_HASHABLE:
+            hashes = compute_hashes(local)
+        embedded = read_embedded_metadata(local, extension)
+        # txt/csv se guardan comprimidos con gzip (después de leer el archivo original)
+        local = self.compressor.compress_file(local, extension)
+        return {
+            'key': key,
+            'stored': os.path.basename(local),
+            'compressed': is_compressed(local),
+            'original_filename': original_filename,
+            'extension': extension,
+            'file_size': round(size_bytes / (1024 * 1024), 2),
+            'size_bytes': size_bytes,
+            'crc32': crc32,
+            'hashes': list(hashes) if hashes else None,
+            'embedded': embedded,
+            'metadata': metadata,
+            'received': received,
+        }
+
+    def stage(self, batch_id, owner, entry):
+        """Anota el manifiesto de un archivo preparado (con sus metadatos definitivos)"""
+        path = self._path(batch_id, owner)
+        target = os.path.join(path, entry['key'] + MANIFEST_SUFFIX)
+        with open(target + '.tmp', 'w', encoding='utf-8') as fh:
+            json.dump(entry, fh)
+        os.replace(target + '.tmp', target)
+
+    # ----- confirmación -----
+
+    def commit(self, batch_id, owner, name_for):
+        """Guarda todos los archivos del lote y sus filas en una transacción
+
+        `name_for(nombre_original, ocupados)` devuelve el nombre definitivo
+        de cada archivo sin repetir los ya asignados en el lote. Devuelve
+        [{id, title, filename, extension, local, hashes}], con `local` la
+        copia local que puede leer la extracción de texto. El lote se
+        elimina tanto si se confirma como si falla.
+        """
+        path = self._path(batch_id, owner)
+        entries = self._entries(path)
+        if not entries:
+            shutil.rmtree(path, ignore_errors=True)
+            return []
+        taken = set()
+        for entry in entries:
+            entry['filename'] = name_for(entry['original_filename'], taken)
+            taken.add(entry['filename'])
+
+        saved, error = [], None
+        try:
+            futures = [self._executor.submit(self._save, path, entry) for entry in entries]
+            for entry, future in zip(entries, futures):
+                try:
+                    entry['local'] = future.result()
+                    saved.append(entry)
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                raise error
+            file_ids = self._insert(entries)
+            db.session.commit()
+        except BaseException:
+            db.session.rollback()
+            # Lo ya enviado no tiene fila: se retira del almacenamiento
+            for entry in saved:
+                try:
+                    self.storage.delete(entry['filename'])
+                    if self.storage.remote and os.path.exists(entry['local']):
+                        os.remove(entry['local'])
+                except OSError as e:
+                    logger.warning(f'No se pudo retirar {entry["filename"]}: {type(e).__name__}')
+            raise
+        finally:
+            shutil.rmtree(path, ignore_errors=True)
+
+        return [{'id': file_id, 'title': entry['metadata']['title'], 'filename': entry['filename'],
+                 'extension': entry['extension'], 'local': entry['local'],
+                 'hashes': tuple(entry['hashes']) if entry['hashes'] else None}
+                for file_id, entry in zip(file_ids, entries)]
+
+    def _save(self, path, entry):
+        """Mueve la copia preparada a su sitio y la envía al almacenamiento; devuelve la ruta local"""
+        key = entry['filename'] + SUFFIX if entry['compressed'] else entry['filename']
+        local = self.storage.staging_path(key)
+        shutil.move(os.path.join(path, entry['stored']), local)
+        self.storage.save(local, key, content_type=MIME_BY_EXTENSION.get(entry['extension']),
+                          content_encoding='gzip' if entry['compressed'] else None)
+        return local
+
+    def _insert(self, entries):
+        """INSERT múltiple de las filas y sus datos derivados; devuelve los ids en el orden de `entries`"""
+        connection = db.session.connection()
+        files = File.__table__
+        now = datetime.utcnow()
+        rows = []
+        for entry in entries:
+            row = dict(derived_file_columns(entry['filename'], now), **entry['metadata'])
+            row.update(filename=entry['filename'], original_filename=entry['original_filename'],
+                       file_size=entry['file_size'], size_bytes=entry['size_bytes'], crc32=entry['crc32'],
+                       compressed=entry['compressed'], upload_date=now, created_at=now, updated_at=now)
+            rows.append(row)
+        # Los ids se casan por nombre (único): pedir RETURNING en el orden de los parámetros
+        # obliga a SQLite a insertar fila a fila
+        inserted = dict(connection.execute(files.insert().returning(files.c.filename, files.c.id), rows).all())
+        file_ids = [inserted[row['filename']] for row in rows]
+
+        deltas, links, hashes, texts = {}, [], [], {}
+        for file_id, row, entry in zip(file_ids, rows, entries):
+            for pair in facet_values(row['category'], row['dc_language'], row['upload_year']):
+                deltas[pair] = deltas.get(pair, 0) + 1
+            links.extend((file_id, name, label) for name, label in parse_tags(row['dc_subject']).items())
+            if entry['hashes']:
+                hashes.append((file_id, *entry['hashes']))
+            texts[file_id] = meta_text(row['title'], row['description'])
+        FacetCount.apply_deltas(connection, deltas)
+        Tag.attach_many(connection, links)
+        ImageHash.store_many(connection, hashes)
+        # Firma MinHash de título y descripción (la del contenido llega tras la extracción)
+        self.documents.index_many(connection, 'meta', texts)
+        CatalogChange.record_many(connection, 'insert', file_ids)
+        return file_ids
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def init_batch_upload(app, storage, compressor, images, documents):
+    """Registra las subidas por lotes con configuración por defecto"""
+    default_folder = os.path.join(os.path.dirname(os.path.abspath(app.config['UPLOAD_FOLDER'])), 'upload_batches')
+    app.config.setdefault('UPLOAD_BATCH_FOLDER', os.environ.get('UPLOAD_BATCH_FOLDER', default_folder))
+    app.config.setdefault('UPLOAD_BATCH_MAX_FILES', int(os.environ.get('UPLOAD_BATCH_MAX_FILES', 100)))
+    app.config.setdefault('UPLOAD_BATCH_WORKERS', int(os.environ.get('UPLOAD_BATCH_WORKERS', 4)))
+    app.config.setdefault('UPLOAD_BATCH_CONCURRENCY', int(os.environ.get('UPLOAD_BATCH_CONCURRENCY', 3)))
+    app.config.setdefault('UPLOAD_BATCH_TTL_HOURS', float(os.environ.get('UPLOAD_BATCH_TTL_HOURS', 24)))
+
+    batches = UploadBatches(
+        app.config['UPLOAD_BATCH_FOLDER'],
+        storage,
+        compressor,
+        images,
+        documents,
+        max_files=app.config['UPLOAD_BATCH_MAX_FILES'],
+        workers=app.config['UPLOAD_BATCH_WORKERS'],
+        ttl_hours=app.config['UPLOAD_BATCH_TTL_HOURS'],
+    )
+    app.extensions['metadatos_batches'] = batches
+    return batches
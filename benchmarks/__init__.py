@@ -0,0 +1,13 @@
+"""
+Suite de benchmarks reproducibles para Metadatos App
+
+- catalog: generador de catálogos sintéticos (filas File + archivos en disco)
+- harness: arranque de la app contra un directorio de benchmark y drivers
+  WSGI (cliente de pruebas en proceso) y HTTP (servidor real con concurrencia)
+- stats: percentiles, throughput, RSS y comparación contra líneas base
+
+Uso rápido:
+    python -m benchmarks generate --rows 10000
+    python -m benchmarks run --rows 10000 --mode wsgi --concurrency 4
+    python -m benchmarks run --rows 10000 --mode http --concurrency 16 --save-baseline
+"""
@@ -0,0 +1,237 @@
+"""
+CLI de la suite de benchmarks
+
+    python -m benchmarks generate --rows 100000 [--dense]
+    python -m benchmarks run --rows 100000 --mode wsgi|http [--concurrency 8]
+                             [--scenarios index,view_file] [--save-baseline]
+    python -m benchmarks budget [--rows 40] [--grow-to 400]
+    python -m benchmarks compare --rows 1000000 --postgres-url postgresql+psycopg2://...
+
+Con --database-url (o BENCH_DATABASE_URL) generate y run usan esa BD en
+lugar del SQLite del directorio de trabajo.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+from pathlib import Path
+
+from .harness import DEFAULT_WORKDIR, PROJECT_ROOT, HTTPDriver, LocalServer, WSGIDriver, load_app
+from .runner import SCENARIOS, measure_allocations, run_scenario, uploaded_ids
+from . import stats
+
+
+def _progress(done, total):
+    print(f'\r  {done:,}/{total:,} filas', end='', flush=True)
+    if done >= total:
+        print()
+
+
+def cmd_generate(args):
+    from .catalog import generate_catalog
+    app_module = load_app(args.workdir, args.rows, args.database_url)
+    print(f'Generando catálogo de {args.rows:,} filas en {Path(args.workdir).resolve()}')
+    generate_catalog(app_module, args.rows, seed=args.seed, dense=args.dense, progress=_progress)
+    return 0
+
+
+def _print_results(results):
+    print(f"\n{'escenario':<18}{'n':>7}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>10}"
+          f"{'KB/pet':>10}")
+    for name, summary in results['scenarios'].items():
+        alloc = summary.get('alloc_kb')
+        print(f"{name:<18}{summary['count']:>7}{summary['errors']:>5}"
+              f"{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}"
+              f"{summary['p99_ms']:>10.2f}{summary['throughput_rps']:>10.1f}"
+              f"{alloc if alloc is not None else '-':>10}")
+    rss = results.get('rss') or {}
+    print(f"RSS actual {rss.get('current_mb')} MB, pico {rss.get('peak_mb')} MB")
+
+
+def cmd_run(args):
+    from .catalog import generate_catalog
+
+    names = args.scenarios.split(',') if args.scenarios else list(SCENARIOS)
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        print(f'Escenarios desconocidos: {", ".join(unknown)}', file=sys.stderr)
+        return 2
+
+    # El catálogo se prepara siempre en proceso; en modo http se sirve aparte
+    app_module = load_app(args.workdir, args.rows, args.database_url)
+    generate_catalog(app_module, args.rows, seed=args.seed, progress=_progress)
+    with app_module.app.app_context():
+        database = app_module.db.engine.dialect.name
+
+    ctx = {'rows': args.rows, 'uploaded_ids': [], 'lock': threading.Lock()}
+
+    results = {
+        'meta': dict(stats.environment_info(), rows=args.rows, mode=args.mode, database=database,
+                     concurrency=args.concurrency, requests=args.requests),
+        'scenarios': {},
+    }
+
+    def run_all(driver, pid=None):
+        for name in names:
+            if name == 'delete':
+                ctx['uploaded_ids'] = uploaded_ids(app_module)
+                requests = len(ctx['uploaded_ids'])
+            else:
+                requests = args.requests
+            if requests == 0:
+                continue
+            print(f'  {name} ...', flush=True)
+            results['scenarios'][name] = run_scenario(
+                driver, SCENARIOS[name], ctx, requests, args.concurrency, seed=args.seed
+            )
+            # Memoria por petición: solo en proceso y en escenarios que no modifican el catálogo
+            if isinstance(driver, WSGIDriver) and name not in ('admin_upload', 'delete'):
+                results['scenarios'][name]['alloc_kb'] = measure_allocations(
+                    driver, SCENARIOS[name], ctx, seed=args.seed
+                )
+        results['rss'] = stats.rss_mb(pid)
+
+    if args.mode == 'wsgi':
+        run_all(WSGIDriver(app_module))
+    elif args.url:
+        run_all(HTTPDriver(args.url))
+    else:
+        with LocalServer(args.workdir, args.rows, workers=args.workers, threads=args.threads,
+                         database_url=args.database_url) as server:
+            run_all(HTTPDriver(server.base_url), pid=server.process.pid)
+
+    _print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump(results, fh, indent=2)
+
+    baseline_name = args.baseline or f'{args.mode}-{args.rows}' + ('' if database == 'sqlite' else f'-{database}')
+    exit_code = 0
+    if args.save_baseline:
+        stats.save_baseline(baseline_name, results)
+        print(f'Línea base guardada: {stats.baseline_path(baseline_name)}')
+    else:
+        baseline = stats.load_baseline(baseline_name)
+        if baseline is None:
+            print(f'Sin línea base "{baseline_name}" (usa --save-baseline para crearla)')
+        else:
+            regressions = stats.compare(results, baseline, latency_tolerance=args.tolerance)
+            if regressions:
+                print('\n❌ Regresiones respecto a la línea base:')
+                for regression in regressions:
+                    print(f'  - {regression}')
+                exit_code = 1
+            else:
+                print('\n✅ Sin regresiones respecto a la línea base')
+    return exit_code
+
+
+def cmd_budget(args):
+    from .query_budget import run_budget_check
+
+    # Catálogo desechable: la medición pequeña debe partir de cero
+    workdir = Path(args.workdir).resolve() / 'budget'
+    shutil.rmtree(workdir, ignore_errors=True)
+    app_module = load_app(workdir, 'budget')
+    ok = run_budget_check(app_module, args.rows, args.grow_to, seed=args.seed)
+    print('\n✅ Todas las rutas dentro de presupuesto' if ok else '\n❌ Presupuesto de consultas excedido')
+    return 0 if ok else 1
+
+
+COMPARE_SCENARIOS = 'index,index_search,index_search_fragment,view_file,admin_panel'
+
+
+def cmd_compare(args):
+    """Los mismos escenarios contra SQLite y PostgreSQL, cada motor en su propio proceso"""
+    workdir = Path(args.workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for label, url in (('sqlite', None), ('postgresql', args.postgres_url)):
+        output = workdir / f'compare_{label}_{args.rows}.json'
+        command = [sys.executable, '-m', 'benchmarks', '--workdir', str(workdir), '--seed', str(args.seed)]
+        if url:
+            command += ['--database-url', url]
+        command += ['run', '--rows', str(args.rows), '--mode', 'wsgi', '--concurrency', str(args.concurrency),
+                    '--requests', str(args.requests), '--scenarios', args.scenarios, '--output', str(output),
+                    '--baseline', f'compare-{label}-{args.rows}']
+        print(f'== {label}', flush=True)
+        # La app lee DATABASE_URL del entorno al importarse: un proceso por motor
+        env = dict(os.environ)
+        env.pop('BENCH_DATABASE_URL', None)
+        output.unlink(missing_ok=True)
+        subprocess.run(command, cwd=str(PROJECT_ROOT), env=env)
+        if not output.exists():
+            print(f'❌ El benchmark contra {label} no terminó', file=sys.stderr)
+            return 2
+        with open(output) as fh:
+            results[label] = json.load(fh)
+
+    sqlite, postgres = results['sqlite']['scenarios'], results['postgresql']['scenarios']
+    print(f"\n{'escenario':<22}{'SQLite p50':>12}{'PG p50':>10}{'SQLite p95':>12}{'PG p95':>10}{'PG/SQLite':>11}")
+    for name in sqlite:
+        if name not in postgres:
+            continue
+        ratio = postgres[name]['p95_ms'] / sqlite[name]['p95_ms'] if sqlite[name]['p95_ms'] else 0
+        print(f"{name:<22}{sqlite[name]['p50_ms']:>12.2f}{postgres[name]['p50_ms']:>10.2f}"
+              f"{sqlite[name]['p95_ms']:>12.2f}{postgres[name]['p95_ms']:>10.2f}{ratio:>10.2f}x")
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workdir', default=str(DEFAULT_WORKDIR),
+                        help='Directorio para BD y archivos sintéticos')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--database-url', default=os.environ.get('BENCH_DATABASE_URL'),
+                        help='BD del catálogo (por defecto SQLite en el directorio de trabajo)')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help='Generar catálogo sintético')
+    gen.add_argument('--rows', type=int, default=10000)
+    gen.add_argument('--dense', action='store_true', help='Escribir bytes reales en lugar de archivos dispersos')
+    gen.set_defaults(func=cmd_generate)
+
+    run = sub.add_parser('run', help='Ejecutar escenarios de carga')
+    run.add_argument('--rows', type=int, default=10000)
+    run.add_argument('--mode', choices=('wsgi', 'http'), default='wsgi')
+    run.add_argument('--url', help='Servidor ya levantado (modo http); si falta se arranca uno local')
+    run.add_argument('--workers', type=int, default=2)
+    run.add_argument('--threads', type=int, default=4)
+    run.add_argument('--concurrency', type=int, default=4)
+    run.add_argument('--requests', type=int, default=200, help='Peticiones por escenario')
+    run.add_argument('--scenarios', help='Lista separada por comas (por defecto todos)')
+    run.add_argument('--output', help='Guardar resultados JSON en esta ruta')
+    run.add_argument('--baseline', help='Nombre de la línea base (por defecto <modo>-<filas>)')
+    run.add_argument('--save-baseline', action='store_true')
+    run.add_argument('--tolerance', type=float, default=stats.DEFAULT_LATENCY_TOLERANCE)
+    run.set_defaults(func=cmd_run)
+
+    budget = sub.add_parser('budget', help='Verificar el presupuesto de consultas SQL por ruta')
+    budget.add_argument('--rows', type=int, default=40, help='Tamaño inicial del catálogo')
+    budget.add_argument('--grow-to', type=int, default=400, help='Tamaño tras crecer (detecta N+1)')
+    budget.set_defaults(func=cmd_budget)
+
+    compare = sub.add_parser('compare', help='Comparar SQLite y PostgreSQL con el mismo catálogo')
+    compare.add_argument('--postgres-url', required=True,
+                         help='BD PostgreSQL vacía o con un catálogo del mismo tamaño')
+    compare.add_argument('--rows', type=int, default=1_000_000)
+    compare.add_argument('--concurrency', type=int, default=4)
+    compare.add_argument('--requests', type=int, default=200, help='Peticiones por escenario')
+    compare.add_argument('--scenarios', default=COMPARE_SCENARIOS)
+    compare.set_defaults(func=cmd_compare)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
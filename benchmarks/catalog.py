@@ -0,0 +1,143 @@
+"""
+Generador de catálogos sintéticos reproducibles
+
+Inserta filas File en lotes con SQL de núcleo (sin instanciar objetos del
+ORM) y crea los archivos correspondientes en la carpeta de subida con
+tamaños realistas por extensión. Por defecto los archivos son dispersos
+(truncate), de modo que un catálogo de 1M de filas no ocupa espacio real;
+con dense=True se escriben bytes aleatorios para medir E/S real.
+"""
+
+import math
+import os
+import random
+from datetime import datetime, timedelta
+
+# Distribución de extensiones (peso) y tamaño mediano en bytes
+EXTENSION_PROFILE = {
+    'pdf': (30, 400 * 1024),
+    'jpg': (18, 1500 * 1024),
+    'png': (8, 800 * 1024),
+    'docx': (14, 60 * 1024),
+    'xlsx': (8, 40 * 1024),
+    'txt': (8, 8 * 1024),
+    'csv': (6, 30 * 1024),
+    'pptx': (4, 2 * 1024 * 1024),
+    'odt': (2, 50 * 1024),
+    'gif': (2, 300 * 1024),
+}
+
+MAX_FILE_BYTES = 16 * 1024 * 1024
+
+VOCABULARY = (
+    'informe anual presupuesto proyecto educación salud cultura archivo histórico '
+    'memoria acta reunión contrato convenio municipal regional política pública '
+    'estudio análisis datos estadística censo mapa fotografía patrimonio biblioteca '
+    'investigación tesis manual procedimiento guía normativa reglamento ley decreto '
+    'resolución licitación balance financiero auditoría evaluación diagnóstico plan '
+    'estrategia desarrollo social económico ambiental agua energía transporte vivienda '
+    'territorio comunidad participación ciudadana transparencia gestión calidad'
+).split()
+
+SUBJECTS = (
+    'educación', 'salud', 'cultura', 'patrimonio', 'finanzas', 'medio ambiente',
+    'transparencia', 'estadísticas', 'normativa', 'investigación', 'fotografía',
+    'cartografía', 'energía', 'vivienda', 'transporte', 'participación',
+)
+
+LANGUAGES = (('es', 80), ('en', 12), ('pt', 5), ('fr', 3))
+
+BATCH_SIZE = 5000
+
+
+def _weighted_choice(rng, table):
+    items = list(table)
+    weights = [w for _, w in items]
+    return rng.choices([v for v, _ in items], weights=weights, k=1)[0]
+
+
+def _file_size(rng, median):
+    # Lognormal alrededor de la mediana, acotada al límite de subida
+    size = int(rng.lognormvariate(math.log(median), 0.9))
+    return max(128, min(size, MAX_FILE_BYTES))
+
+
+def _sentence(rng, words):
+    return ' '.join(rng.choice(VOCABULARY) for _ in range(words))
+
+
+def synthetic_rows(count, seed=42, start_index=0):
+    """Genera dicts de filas File de forma determinista"""
+    rng = random.Random(seed + start_index)
+    extensions = [(ext, weight) for ext, (weight, _) in EXTENSION_PROFILE.items()]
+    now = datetime(2025, 1, 1)
+
+    for i in range(start_index, start_index + count):
+        ext = _weighted_choice(rng, extensions)
+        size_bytes = _file_size(rng, EXTENSION_PROFILE[ext][1])
+        uploaded = now - timedelta(seconds=rng.randint(0, 5 * 365 * 24 * 3600))
+        title = _sentence(rng, rng.randint(3, 8)).capitalize()
+        yield {
+            'title': title,
+            'description': _sentence(rng, rng.randint(15, 120)).capitalize() + '.',
+            'filename': f'bench_{i:08d}.{ext}',
+            'original_filename': f'{title[:40].replace(" ", "_")}.{ext}',
+            'file_size': round(size_bytes / (1024 * 1024), 2),
+            'upload_date': uploaded,
+            'created_at': uploaded,
+            'updated_at': uploaded,
+            'dc_subject': ', '.join(rng.sample(SUBJECTS, rng.randint(1, 4))),
+            'dc_language': _weighted_choice(rng, LANGUAGES),
+            '_size_bytes': size_bytes,
+        }
+
+
+def _write_file(path, size_bytes, dense, rng):
+    with open(path, 'wb') as fh:
+        if dense:
+            remaining = size_bytes
+            while remaining > 0:
+                chunk = min(remaining, 1024 * 1024)
+                fh.write(rng.randbytes(chunk))
+                remaining -= chunk
+        else:
+            fh.truncate(size_bytes)
+
+
+def generate_catalog(app_module, rows, seed=42, dense=False, progress=None):
+    """Rellena la BD y la carpeta de subida hasta tener `rows` archivos
+
+    Es idempotente: si el catálogo ya tiene filas continúa desde la última.
+    """
+    from database import FacetCount, Tag, derived_file_columns, record_catalog_change
+
+    app = app_module.app
+    db = app_module.db
+    File = app_module.File
+    upload_folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    rng = random.Random(seed)
+
+    with app.app_context():
+        existing = db.session.query(db.func.count(File.id)).scalar()
+        index = existing
+        while index < rows:
+            batch = list(synthetic_rows(min(BATCH_SIZE, rows - index), seed, index))
+            for row in batch:
+                _write_file(os.path.join(upload_folder, row['filename']), row['_size_bytes'], dense, rng)
+            db.session.execute(
+                db.insert(File),
+                [dict(derived_file_columns(row['filename'], row['upload_date']),
+                      **{k: v for k, v in row.items() if not k.startswith('_')}) for row in batch]
+            )
+            db.session.commit()
+            index += len(batch)
+            if progress:
+                progress(index, rows)
+        if index > existing:
+            # Las inserciones masivas no pasan por los eventos del ORM
+            FacetCount.rebuild()
+            Tag.rebuild()
+            record_catalog_change('bulk')
+            db.session.commit()
+        return index
@@ -0,0 +1,263 @@
+"""
+Arranque de la aplicación para benchmarks y drivers de peticiones
+
+La app lee su configuración del entorno al importarse, así que load_app()
+debe llamarse antes de cualquier `import app` en el proceso.
+"""
+
+import http.cookiejar
+import io
+import logging
+import os
+import re
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_WORKDIR = PROJECT_ROOT / 'bench_data'
+
+BENCH_ADMIN_USERNAME = 'benchadmin'
+BENCH_ADMIN_PASSWORD = 'bench-admin-password-1234'
+BENCH_DOWNLOAD_HIT_SECRET = 'bench-download-hit-secret'
+
+CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def bench_environment(workdir, rows, database_url=None):
+    """Variables de entorno para una app apuntando al catálogo sintético
+
+    Por defecto un SQLite por tamaño de catálogo; con `database_url` (p. ej.
+    PostgreSQL) la BD es la indicada, que conviene dedicar a un solo tamaño.
+    """
+    workdir = Path(workdir).resolve()
+    env = dict(os.environ)
+    env.update({
+        'FLASK_ENV': 'development',
+        'SECRET_KEY': 'bench-secret-key-' + 'x' * 32,
+        'DATABASE_URL': database_url or f'sqlite:///{workdir / f"catalog_{rows}.db"}',
+        'UPLOAD_FOLDER': str(workdir / f'uploads_{rows}'),
+        'ADMIN_USERNAME': BENCH_ADMIN_USERNAME,
+        'ADMIN_PASSWORD': BENCH_ADMIN_PASSWORD,
+        'RATELIMIT_ENABLED': 'false',
+        'DOWNLOAD_HIT_SECRET': BENCH_DOWNLOAD_HIT_SECRET,
+    })
+    return env
+
+
+def load_app(workdir, rows, database_url=None):
+    """Importa la app configurada contra el catálogo del benchmark"""
+    workdir = Path(workdir).resolve()
+    workdir.mkdir(parents=True, exist_ok=True)
+    os.environ.update(bench_environment(workdir, rows, database_url))
+    # app.py escribe app.log en el directorio actual
+    os.chdir(workdir)
+    if str(PROJECT_ROOT) not in sys.path:
+        sys.path.insert(0, str(PROJECT_ROOT))
+
+    import app as app_module
+    app_module.app.config['WTF_CSRF_ENABLED'] = False
+    # El log por petición de la app distorsiona las mediciones
+    logging.getLogger().setLevel(logging.WARNING)
+    return app_module
+
+
+def multipart_body(fields, files):
+    """Codifica un formulario multipart/form-data para urllib"""
+    boundary = uuid.uuid4().hex
+    lines = []
+    for name, values in fields.items():
+        for value in values if isinstance(values, (list, tuple)) else [values]:
+            lines.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        lines.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+        )
+        lines.append(content)
+        lines.append(b'\r\n')
+    lines.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(lines), f'multipart/form-data; boundary={boundary}'
+
+
+class RequestSpec:
+    """Petición abstracta que ambos drivers saben ejecutar"""
+
+    __slots__ = ('method', 'path', 'fields', 'files', 'admin', 'headers')
+
+    def __init__(self, method, path, fields=None, files=None, admin=False, headers=None):
+        self.method = method
+        self.path = path
+        self.fields = fields or {}
+        self.files = files or {}
+        self.admin = admin
+        self.headers = headers or {}
+
+
+class WSGIDriver:
+    """Ejecuta peticiones en proceso a través del cliente de pruebas de Flask"""
+
+    name = 'wsgi'
+
+    def __init__(self, app_module):
+        self.app = app_module.app
+
+    def new_session(self, admin=False):
+        client = self.app.test_client()
+        if admin:
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+                sess['username'] = BENCH_ADMIN_USERNAME
+                sess['login_time'] = datetime.now().isoformat()
+        return client
+
+    def execute(self, session, spec):
+        if spec.method == 'GET':
+            response = session.get(spec.path, headers=spec.headers)
+        else:
+            data = dict(spec.fields)
+            for name, (filename, content) in spec.files.items():
+                data[name] = (io.BytesIO(content), filename)
+            response = session.post(spec.path, data=data, content_type='multipart/form-data', headers=spec.headers)
+        response.close()
+        return response.status_code
+
+
+class HTTPDriver:
+    """Ejecuta peticiones reales contra un servidor HTTP"""
+
+    name = 'http'
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+
+    def new_session(self, admin=False):
+        jar = http.cookiejar.CookieJar()
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(jar), _NoRedirect()
+        )
+        session = {'opener': opener, 'csrf': None}
+        if admin:
+            self._login(session)
+        return session
+
+    def _login(self, session):
+        opener = session['opener']
+        html = opener.open(self.base_url + '/login').read().decode('utf-8', 'replace')
+        token = CSRF_RE.search(html)
+        body, content_type = multipart_body({
+            'csrf_token': token.group(1) if token else '',
+            'username': BENCH_ADMIN_USERNAME,
+            'password': BENCH_ADMIN_PASSWORD,
+        }, {})
+        request = urllib.request.Request(self.base_url + '/login', data=body, method='POST')
+        request.add_header('Content-Type', content_type)
+        self._open(opener, request)
+        html = opener.open(self.base_url + '/admin').read().decode('utf-8', 'replace')
+        token = CSRF_RE.search(html)
+        session['csrf'] = token.group(1) if token else ''
+
+    def _open(self, opener, request):
+        try:
+            with opener.open(request, timeout=60) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+    def execute(self, session, spec):
+        url = self.base_url + spec.path
+        if spec.method == 'GET':
+            request = urllib.request.Request(url, headers=spec.headers)
+        else:
+            fields = dict(spec.fields)
+            if session['csrf']:
+                fields['csrf_token'] = session['csrf']
+            body, content_type = multipart_body(fields, spec.files)
+            request = urllib.request.Request(url, data=body, method='POST', headers=spec.headers)
+            request.add_header('Content-Type', content_type)
+        return self._open(session['opener'], request)
+
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    """Mide la respuesta propia de la ruta, no la de la redirección"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+    def http_error_302(self, req, fp, code, msg, headers):
+        return fp
+
+    http_error_301 = http_error_303 = http_error_307 = http_error_302
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+class LocalServer:
+    """Levanta la app en un subproceso (gunicorn si está disponible)"""
+
+    def __init__(self, workdir, rows, workers=2, threads=4, database_url=None):
+        self.workdir = Path(workdir).resolve()
+        self.rows = rows
+        self.database_url = database_url
+        self.workers = workers
+        self.threads = threads
+        self.port = free_port()
+        self.process = None
+
+    @property
+    def base_url(self):
+        return f'http://127.0.0.1:{self.port}'
+
+    def __enter__(self):
+        env = bench_environment(self.workdir, self.rows, self.database_url)
+        env['PYTHONPATH'] = str(PROJECT_ROOT)
+        try:
+            import gunicorn  # noqa: F401
+            command = [
+                sys.executable, '-m', 'gunicorn', 'app:app',
+                '--bind', f'127.0.0.1:{self.port}',
+                '--workers', str(self.workers),
+                '--threads', str(self.threads),
+                '--log-level', 'warning',
+            ]
+        except ImportError:
+            command = [
+                sys.executable, '-c',
+                'from werkzeug.serving import run_simple; from app import app; '
+                f'run_simple("127.0.0.1", {self.port}, app, threaded=True)',
+            ]
+        self.process = subprocess.Popen(
+            command, cwd=str(self.workdir), env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            try:
+                urllib.request.urlopen(self.base_url + '/health', timeout=2).read()
+                return self
+            except Exception:
+                if self.process.poll() is not None:
+                    raise RuntimeError('El servidor de benchmark terminó al arrancar')
+                time.sleep(0.25)
+        raise RuntimeError('El servidor de benchmark no respondió a tiempo')
+
+    def __exit__(self, *exc):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        return False
@@ -0,0 +1,356 @@
+"""
+Presupuesto de consultas SQL por ruta
+
+Ejecuta cada ruta registrada contra un catálogo sembrado, cuenta las
+sentencias SQL y el tiempo total de BD con profiler.capture_sql() y falla
+si alguna supera su presupuesto declarado. Cada ruta se mide con el
+catálogo pequeño y de nuevo tras hacerlo crecer, en la primera y la última
+página, de modo que un N+1 (consultas que crecen con las filas mostradas)
+aparece como exceso aunque el caso pequeño quepa en el presupuesto.
+
+    python -m benchmarks budget [--rows 40] [--grow-to 400]
+"""
+
+import io
+from urllib.parse import quote
+
+from .harness import BENCH_ADMIN_USERNAME, BENCH_DOWNLOAD_HIT_SECRET, RequestSpec
+
+# Rutas que no tocan la BD o no son rutas de la aplicación
+UNBUDGETED = {
+    'static': 'servida por Flask/nginx sin lógica de aplicación',
+}
+
+
+class RouteBudget:
+    """Presupuesto declarado para un endpoint"""
+
+    def __init__(self, endpoint, requests, max_queries, max_db_ms=50.0, admin=False, expected=(200,)):
+        self.endpoint = endpoint
+        self.requests = requests
+        self.max_queries = max_queries
+        self.max_db_ms = max_db_ms
+        self.admin = admin
+        self.expected = expected
+
+
+def _last_page(per_page):
+    def factory(ctx):
+        pages = max(1, -(-ctx['rows'] // per_page))
+        return ctx['prefix'] + str(pages)
+    return factory
+
+
+def _get(path_or_factory):
+    def factory(ctx):
+        path = path_or_factory(ctx) if callable(path_or_factory) else path_or_factory
+        return RequestSpec('GET', path)
+    return factory
+
+
+def _view_file(ctx):
+    return RequestSpec('GET', f"/file/{ctx['any_id']}")
+
+
+def _view_image(ctx):
+    return RequestSpec('GET', f"/file/{ctx['image_id']}")
+
+
+def _suggest(query):
+    def factory(ctx):
+        ctx['sync_suggest']()
+        return RequestSpec('GET', '/api/suggest?q=' + quote(query))
+    return factory
+
+
+def _uploaded_file(ctx):
+    return RequestSpec('GET', '/uploads/' + quote(ctx['any_filename']))
+
+
+def _download_hit(ctx):
+    return RequestSpec('GET', '/internal/download-hit' + _uploaded_file(ctx).path,
+                       headers={'X-Download-Hit-Secret': BENCH_DOWNLOAD_HIT_SECRET})
+
+
+def _delete_file(ctx):
+    return RequestSpec('POST', f"/admin/delete/{ctx['create_file']()}")
+
+
+def _bulk(action, **fields):
+    def factory(ctx):
+        # El número de archivos crece con el catálogo: las sentencias no deben crecer
+        file_ids = [ctx['create_file']() for _ in range(max(2, ctx['rows'] // 40))]
+        return RequestSpec('POST', '/admin/bulk', fields=dict(fields, action=action, file_ids=file_ids))
+    return factory
+
+
+def _upload(ctx):
+    return RequestSpec('POST', '/admin', fields={
+        'title': 'Presupuesto de consultas',
+        'description': 'Archivo creado por la verificación de presupuesto SQL.',
+        'dc_subject': 'presupuesto, sql',
+    }, files={'file': ('presupuesto.txt', b'contenido de prueba')})
+
+
+def _batch(action, files=0):
+    def factory(ctx):
+        # Como en las acciones masivas, el lote crece con el catálogo
+        count = max(2, ctx['rows'] // 40) if files == 'grow' else files
+        return RequestSpec('POST', f"/admin/uploads/{ctx['create_batch'](count)}/{action}")
+    return factory
+
+
+def _batch_file(ctx):
+    return RequestSpec('POST', f"/admin/uploads/{ctx['create_batch'](0)}/files", fields={
+        'title': 'Presupuesto de lotes',
+        'description': 'Archivo preparado por la verificación de presupuesto SQL.',
+        'dc_subject': 'presupuesto, lote',
+    }, files={'file': ('lote.txt', b'contenido de prueba del lote')})
+
+
+def _login_post(ctx):
+    return RequestSpec('POST', '/login', fields={'username': 'nadie', 'password': 'incorrecta'})
+
+
+BUDGETS = [
+    # Versión del catálogo (ETag), conteo, página y facetas (tabla precalculada o un único UNION ALL)
+    RouteBudget('index', [
+        _get('/?page=1'),
+        _get(lambda ctx: _last_page(12)(dict(ctx, prefix='/?page='))),
+        _get('/?type=document&lang=es'),
+        _get('/?year=2023&page=2'),
+        _get('/?subject=' + quote('educación')),
+    ], max_queries=4),
+    RouteBudget('index', [
+        _get('/?search=' + quote('informe')),
+    ], max_queries=4, max_db_ms=200.0),
+    RouteBudget('admin_panel', [
+        _get('/admin?page=1'),
+        _get(lambda ctx: _last_page(10)(dict(ctx, prefix='/admin?page='))),
+        _get('/admin?sort=downloads'),
+    ], max_queries=2, admin=True),
+    # INSERT del archivo, upsert de facet_counts, upsert de tags, INSERT ... SELECT de
+    # file_tags, la fila de catalog_changes, la firma MinHash, sus cubetas y la búsqueda
+    # de candidatos por cubeta
+    RouteBudget('admin_panel', [_upload], max_queries=8, admin=True, expected=(302,)),
+    # Abrir y descartar un lote solo toca la carpeta de preparación
+    RouteBudget('upload_batch_create', [lambda ctx: RequestSpec('POST', '/admin/uploads')], max_queries=0,
+                admin=True, expected=(201,)),
+    RouteBudget('upload_batch_discard', [_batch('discard', 1)], max_queries=0, admin=True, expected=(204,)),
+    # Preparar un archivo: solo la búsqueda de candidatos por cubeta (firma de título y descripción)
+    RouteBudget('upload_batch_files', [_batch_file], max_queries=1, admin=True),
+    # El lote entero: INSERT múltiple con RETURNING, facet_counts, tags y file_tags, firmas
+    # MinHash y sus cubetas, y catalog_changes (las sentencias no crecen con los archivos)
+    RouteBudget('upload_batch_commit', [_batch('commit', 'grow')], max_queries=7, max_db_ms=100.0, admin=True),
+    # updated_at y último cambio suyo o de sus relacionados (ETag), el archivo con sus cuentas de file_stats y
+    # sus relacionados precalculados (búsquedas por clave primaria); la vista se cuenta en
+    # memoria por id, sin consulta
+    RouteBudget('view_file', [_view_file], max_queries=3),
+    # Imagen: además el índice de similares comprueba la versión del catálogo, aplica
+    # cambios y carga los títulos de las coincidencias
+    RouteBudget('view_file', [_view_image], max_queries=7),
+    # Cuentas al día para la ficha servida desde la caché del navegador
+    RouteBudget('api_file_stats', [lambda ctx: RequestSpec('GET', f"/api/files/{ctx['any_id']}/stats")],
+                max_queries=1),
+    # Cargar el archivo, cargar file.logs (el ORM anula su FK), el DELETE, facet_counts
+    # las dos sentencias de tags (decremento y borrado de file_tags), el texto extraído
+    # (DELETE ... RETURNING), las firmas MinHash y sus cubetas, file_stats y catalog_changes
+    RouteBudget('delete_file', [_delete_file], max_queries=11, admin=True, expected=(302,)),
+    # Por lote: leer las filas, facet_counts, tags y file_tags, texto, firmas y cubetas,
+    # file_stats, desvincular activity_logs, el DELETE y catalog_changes
+    RouteBudget('bulk_action', [_bulk('delete')], max_queries=13, admin=True, expected=(302,)),
+    # Por lote: leer dc_subject, el UPDATE, dos sentencias para quitar etiquetas, dos para
+    # añadirlas y catalog_changes
+    RouteBudget('bulk_action', [_bulk('retag', add_tags='revisado', remove_tags='presupuesto')],
+                max_queries=7, admin=True, expected=(302,)),
+    # Por lote: idiomas actuales, facet_counts, UPDATE ... RETURNING y catalog_changes
+    RouteBudget('bulk_action', [_bulk('edit', dc_language='en', dc_creator='Presupuesto')],
+                max_queries=4, admin=True, expected=(302,)),
+    # Una consulta: pares que comparten cubeta con sus firmas y títulos
+    RouteBudget('duplicates_report', [_get('/admin/duplicates'), _get('/admin/duplicates?source=meta')],
+                max_queries=1, max_db_ms=200.0, admin=True),
+    # Una consulta con las filas seleccionadas (las sumas de control pendientes se
+    # rellenan en la petición de calentamiento); el contenido sale del disco
+    RouteBudget('download_zip', [
+        _get(lambda ctx: f"/download.zip?ids={ctx['any_id']},{ctx['image_id']}"),
+        _get('/download.zip?type=image&lang=es'),
+    ], max_queries=1, max_db_ms=100.0),
+    # Servido desde el disco (comprimido o no) sin consultar la BD
+    RouteBudget('uploaded_file', [_uploaded_file], max_queries=0),
+    # La descarga se suma en memoria; el volcado a file_stats va a un hilo de fondo
+    RouteBudget('download_hit', [_download_hit], max_queries=0, expected=(204,)),
+    RouteBudget('help_page', [_get('/help')], max_queries=0),
+    # Archivos ya generados en disco; la comprobación de cambios va a un hilo de fondo
+    RouteBudget('sitemap_index', [_get('/sitemap.xml')], max_queries=0),
+    RouteBudget('sitemap_chunk', [_get('/sitemaps/sitemap-pages.xml'), _get('/sitemaps/sitemap-00001.xml')],
+                max_queries=0),
+    RouteBudget('atom_feed', [_get('/feed.atom')], max_queries=0),
+    # Abrir el flujo: como mucho la versión del catálogo o los eventos perdidos desde
+    # Last-Event-ID; después los trae el hilo difusor, no la conexión
+    RouteBudget('catalog_events', [_get('/events'), _get('/events?last_event_id=1')], max_queries=1),
+    RouteBudget('robots_txt', [_get('/robots.txt')], max_queries=0),
+    RouteBudget('tags_page', [_get('/tags')], max_queries=2),
+    RouteBudget('api_tags', [_get('/api/tags'), _get('/api/tags?limit=5&min=2')], max_queries=1),
+    # Candidatos desde memoria; cuentas de las palabras clave y títulos por índice único
+    # y clave primaria. Comprobar la versión y aplicar cambios añade hasta cuatro más
+    RouteBudget('api_suggest', [_suggest('inf'), _suggest('educación')], max_queries=2),
+    RouteBudget('login', [_get('/login'), _login_post], max_queries=0),
+    RouteBudget('logout', [_get('/logout')], max_queries=0, expected=(302,)),
+    RouteBudget('profiler_panel', [_get('/admin/profiler')], max_queries=0, admin=True),
+    # Sondas cacheadas HEALTH_CACHE_SECONDS: como mucho SELECT 1 y maintenance_runs
+    RouteBudget('health_check', [_get('/health')], max_queries=1),
+    RouteBudget('health_live', [_get('/health/live')], max_queries=0),
+    RouteBudget('health_ready', [_get('/health/ready')], max_queries=2),
+]
+
+
+class BudgetResult:
+    def __init__(self, budget, spec, status, trace):
+        self.budget = budget
+        self.spec = spec
+        self.status = status
+        self.queries = trace.count
+        self.db_ms = trace.total_ms
+        self.statements = list(trace.statements)
+
+    @property
+    def failures(self):
+        problems = []
+        if self.status not in self.budget.expected:
+            problems.append(f'estado HTTP {self.status} (esperado {self.budget.expected})')
+        if self.queries > self.budget.max_queries:
+            problems.append(f'{self.queries} consultas > presupuesto {self.budget.max_queries}')
+        if self.db_ms > self.budget.max_db_ms:
+            problems.append(f'{self.db_ms:.1f} ms de BD > presupuesto {self.budget.max_db_ms:.1f} ms')
+        return problems
+
+
+def _context(app_module, rows):
+    app = app_module.app
+    db = app_module.db
+    File = app_module.File
+
+    def create_file():
+        with app.app_context():
+            record = File(title='Archivo temporal', description='Creado para medir la eliminación.',
+                          dc_subject='presupuesto, eliminación',
+                          filename=f'budget_{db.session.query(db.func.max(File.id)).scalar() or 0}_tmp.txt')
+            db.session.add(record)
+            db.session.commit()
+            return record.id
+
+    batches = app.extensions['metadatos_batches']
+
+    def create_batch(files):
+        from werkzeug.datastructures import FileStorage
+
+        batch_id = batches.create(BENCH_ADMIN_USERNAME)
+        metadata = {'title': 'Archivo del lote', 'description': 'Preparado para medir la confirmación de un lote.',
+                    'dc_subject': 'presupuesto, lote', 'dc_creator': 'Presupuesto', 'dc_rights': 'CC0',
+                    'dc_language': 'es'}
+        uploads = [(FileStorage(io.BytesIO(b'contenido de prueba'), f'lote_{index}.txt'), metadata)
+                   for index in range(files)]
+        for entry in batches.prepare(batch_id, BENCH_ADMIN_USERNAME, uploads):
+            batches.stage(batch_id, BENCH_ADMIN_USERNAME, entry)
+        return batch_id
+
+    suggest_index = app.extensions['metadatos_suggest']
+
+    def sync_suggest():
+        # La reconstrucción va en un hilo aparte: se mide el índice ya al día
+        with app.app_context():
+            suggest_index.checked_at = 0.0
+            suggest_index.refresh()
+        suggest_index.wait()
+
+    with app.app_context():
+        any_id = db.session.query(db.func.min(File.id)).scalar()
+        image_id = db.session.query(db.func.min(File.id)).filter(File.category == 'image').scalar() or any_id
+        any_filename = db.session.get(File, any_id).filename
+    return {'rows': rows, 'any_id': any_id, 'image_id': image_id, 'any_filename': any_filename,
+            'create_file': create_file, 'create_batch': create_batch, 'sync_suggest': sync_suggest}
+
+
+def measure(app_module, driver, rows):
+    """Mide todas las rutas presupuestadas con el catálogo actual"""
+    from profiler import capture_sql
+
+    ctx = _context(app_module, rows)
+    results = []
+    for budget in BUDGETS:
+        for factory in budget.requests:
+            session = driver.new_session(admin=budget.admin)
+            spec = factory(ctx)
+            # Primera petición fuera de la medición: plantillas, sesiones, cachés
+            if spec.method == 'GET':
+                driver.execute(session, spec)
+            with capture_sql() as trace:
+                status = driver.execute(session, spec)
+            results.append(BudgetResult(budget, spec, status, trace))
+    return results
+
+
+def unbudgeted_endpoints(app):
+    declared = {budget.endpoint for budget in BUDGETS}
+    return sorted(
+        rule.endpoint for rule in app.url_map.iter_rules()
+        if rule.endpoint not in declared and rule.endpoint not in UNBUDGETED
+    )
+
+
+def report(results_by_size, missing):
+    """Imprime la tabla de resultados y devuelve True si todo cumple"""
+    ok = True
+    # Columnas al ancho del endpoint y la petición más largos
+    requests = [result.spec.method + ' ' + result.spec.path for _, results in results_by_size for result in results]
+    endpoint_width = max([len('endpoint')] + [len(budget.endpoint) for budget in BUDGETS]) + 2
+    request_width = min(max([len('petición')] + [len(request) for request in requests]), 60) + 2
+    print(f"\n{'endpoint':<{endpoint_width}}{'petición':<{request_width}}{'filas':>7}{'SQL':>5}{'máx':>5}{'BD ms':>9}")
+    for rows, results in results_by_size:
+        for result in results:
+            mark = '' if not result.failures else '  ❌'
+            request = (result.spec.method + ' ' + result.spec.path)[:request_width - 2]
+            print(f"{result.budget.endpoint:<{endpoint_width}}{request:<{request_width}}"
+                  f"{rows:>7}{result.queries:>5}{result.budget.max_queries:>5}{result.db_ms:>9.2f}{mark}")
+
+    # Una ruta cuyo número de consultas cambia al crecer el catálogo es un N+1
+    if len(results_by_size) > 1:
+        small, large = results_by_size[0][1], results_by_size[-1][1]
+        for before, after in zip(small, large):
+            if after.queries > before.queries:
+                ok = False
+                print(f'\n❌ {after.budget.endpoint} {after.spec.path}: las consultas crecen con el '
+                      f'catálogo ({before.queries} -> {after.queries})')
+                _print_statements(after.statements)
+
+    for rows, results in results_by_size:
+        for result in results:
+            if result.failures:
+                ok = False
+                print(f"\n❌ {result.budget.endpoint} {result.spec.method} {result.spec.path} "
+                      f"({rows} filas): {'; '.join(result.failures)}")
+                _print_statements(result.statements)
+
+    if missing:
+        ok = False
+        print(f"\n❌ Endpoints sin presupuesto declarado: {', '.join(missing)}")
+    return ok
+
+
+def _print_statements(statements):
+    for index, stmt in enumerate(statements, 1):
+        sql = ' '.join(stmt['sql'].split())
+        print(f"    {index:>2}. [{stmt['duration_ms']:.2f} ms] {sql[:300]}")
+
+
+def run_budget_check(app_module, rows, grow_to, seed=42):
+    """Siembra, mide, hace crecer el catálogo y vuelve a medir"""
+    from .catalog import generate_catalog
+    from .harness import WSGIDriver
+
+    driver = WSGIDriver(app_module)
+    results_by_size = []
+    for size in (rows, grow_to):
+        generate_catalog(app_module, size, seed=seed)
+        results_by_size.append((size, measure(app_module, driver, size)))
+    return report(results_by_size, unbudgeted_endpoints(app_module.app))
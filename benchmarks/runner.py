@@ -0,0 +1,174 @@
+"""
+Escenarios de carga sobre las rutas reales y ejecución concurrente
+"""
+
+import random
+import statistics
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+from .catalog import VOCABULARY
+from .harness import RequestSpec
+from .stats import summarize
+
+PER_PAGE_INDEX = 12
+PER_PAGE_ADMIN = 10
+PER_PAGE_ADMIN_FULL = 200
+UPLOAD_TITLE_PREFIX = 'Benchmark upload'
+
+
+class Scenario:
+    """Escenario de benchmark: genera peticiones para una ruta"""
+
+    def __init__(self, name, factory, admin=False, expected=(200,)):
+        self.name = name
+        self.factory = factory
+        self.admin = admin
+        self.expected = expected
+
+
+def _index(rng, ctx):
+    pages = max(1, min(ctx['rows'] // PER_PAGE_INDEX, 50))
+    return RequestSpec('GET', f'/?page={rng.randint(1, pages)}')
+
+
+def _index_search(rng, ctx):
+    return RequestSpec('GET', f'/?search={quote(rng.choice(VOCABULARY))}')
+
+
+def _index_search_fragment(rng, ctx):
+    # Trozo interior de una palabra: LIKE/ILIKE, sin ayuda de un índice de palabras
+    word = rng.choice([word for word in VOCABULARY if len(word) >= 7])
+    return RequestSpec('GET', f'/?search={quote(word[2:-2])}')
+
+
+def _view_file(rng, ctx):
+    return RequestSpec('GET', f'/file/{rng.randint(1, max(1, ctx["rows"]))}')
+
+
+def _admin_panel(rng, ctx):
+    pages = max(1, min(ctx['rows'] // PER_PAGE_ADMIN, 50))
+    return RequestSpec('GET', f'/admin?page={rng.randint(1, pages)}', admin=True)
+
+
+def _admin_panel_full(rng, ctx):
+    # La página más grande del selector: aquí pesa lo que se carga por fila
+    pages = max(1, min(ctx['rows'] // PER_PAGE_ADMIN_FULL, 50))
+    return RequestSpec('GET', f'/admin?per_page={PER_PAGE_ADMIN_FULL}&page={rng.randint(1, pages)}', admin=True)
+
+
+def _admin_upload(rng, ctx):
+    body = ' '.join(rng.choice(VOCABULARY) for _ in range(rng.randint(200, 2000))).encode()
+    return RequestSpec('POST', '/admin', fields={
+        'title': f'{UPLOAD_TITLE_PREFIX} {rng.randint(0, 10**9)}',
+        'description': 'Archivo generado por la suite de benchmarks para medir subidas.',
+        'dc_subject': 'benchmark, carga',
+    }, files={'file': (f'benchmark_{rng.randint(0, 10**9)}.txt', body)}, admin=True)
+
+
+def _delete(rng, ctx):
+    with ctx['lock']:
+        if not ctx['uploaded_ids']:
+            return None
+        file_id = ctx['uploaded_ids'].pop()
+    return RequestSpec('POST', f'/admin/delete/{file_id}', admin=True)
+
+
+def _health(rng, ctx):
+    return RequestSpec('GET', '/health')
+
+
+SCENARIOS = {
+    'health': Scenario('health', _health),
+    'index': Scenario('index', _index),
+    'index_search': Scenario('index_search', _index_search),
+    'index_search_fragment': Scenario('index_search_fragment', _index_search_fragment),
+    'view_file': Scenario('view_file', _view_file),
+    'admin_panel': Scenario('admin_panel', _admin_panel, admin=True),
+    'admin_panel_full': Scenario('admin_panel_full', _admin_panel_full, admin=True),
+    'admin_upload': Scenario('admin_upload', _admin_upload, admin=True, expected=(200, 302)),
+    'delete': Scenario('delete', _delete, admin=True, expected=(200, 302)),
+}
+
+
+def uploaded_ids(app_module):
+    """IDs de archivos subidos por el benchmark (para el escenario delete)"""
+    File = app_module.File
+    with app_module.app.app_context():
+        return app_module.db.session.execute(
+            app_module.db.select(File.id).where(File.title.startswith(UPLOAD_TITLE_PREFIX)).order_by(File.id)
+        ).scalars().all()
+
+
+def run_scenario(driver, scenario, ctx, requests, concurrency, seed=42, warmup=5):
+    """Ejecuta un escenario y devuelve su resumen de latencias"""
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = [requests]
+
+    def worker(worker_index):
+        nonlocal errors
+        rng = random.Random(seed * 1000 + worker_index)
+        session = driver.new_session(admin=scenario.admin)
+        local = []
+        local_errors = 0
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            spec = scenario.factory(rng, ctx)
+            if spec is None:
+                break
+            started = time.perf_counter()
+            try:
+                status = driver.execute(session, spec)
+            except Exception:
+                status = None
+            local.append((time.perf_counter() - started) * 1000)
+            if status not in scenario.expected:
+                local_errors += 1
+        with lock:
+            latencies.extend(local)
+            errors += local_errors
+
+    # Calentamiento: cachés de plantillas, conexiones y páginas de SQLite
+    if warmup and scenario.name not in ('admin_upload', 'delete'):
+        session = driver.new_session(admin=scenario.admin)
+        rng = random.Random(seed)
+        for _ in range(warmup):
+            driver.execute(session, scenario.factory(rng, ctx))
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    return summarize(latencies, wall, errors)
+
+
+def measure_allocations(driver, scenario, ctx, samples=10, seed=42):
+    """Mediana del pico de memoria asignada por petición, en KB (solo en proceso)
+
+    Peticiones secuenciales con tracemalloc: mide lo que crea la vista
+    (filas, objetos del ORM, HTML), no el RSS del proceso.
+    """
+    session = driver.new_session(admin=scenario.admin)
+    rng = random.Random(seed)
+    peaks = []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            spec = scenario.factory(rng, ctx)
+            if spec is None:
+                break
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+            driver.execute(session, spec)
+            peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    finally:
+        tracemalloc.stop()
+    return round(statistics.median(peaks) / 1024, 1) if peaks else None
@@ -0,0 +1,147 @@
+"""
+Estadísticas de benchmark: percentiles, memoria y comparación con líneas base
+"""
+
+import json
+import os
+import platform
+import resource
+from datetime import datetime
+from pathlib import Path
+
+BASELINE_DIR = Path(__file__).resolve().parent / 'baselines'
+
+# Tolerancias por defecto para marcar una regresión
+DEFAULT_LATENCY_TOLERANCE = 0.20
+DEFAULT_THROUGHPUT_TOLERANCE = 0.15
+DEFAULT_RSS_TOLERANCE = 0.25
+
+
+def percentile(sorted_values, pct):
+    """Percentil por interpolación lineal sobre una lista ya ordenada"""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(sorted_values) - 1)
+    weight = rank - lower
+    return sorted_values[lower] * (1 - weight) + sorted_values[upper] * weight
+
+
+def summarize(latencies_ms, wall_seconds, errors):
+    """Resume las latencias de un escenario"""
+    values = sorted(latencies_ms)
+    count = len(values)
+    return {
+        'count': count,
+        'errors': errors,
+        'p50_ms': round(percentile(values, 50), 3),
+        'p95_ms': round(percentile(values, 95), 3),
+        'p99_ms': round(percentile(values, 99), 3),
+        'max_ms': round(values[-1], 3) if values else 0.0,
+        'throughput_rps': round(count / wall_seconds, 2) if wall_seconds > 0 else 0.0,
+    }
+
+
+def _read_status_kb(pid, field):
+    try:
+        with open(f'/proc/{pid}/status') as fh:
+            for line in fh:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def _children(pid):
+    children = []
+    task_dir = f'/proc/{pid}/task'
+    try:
+        for tid in os.listdir(task_dir):
+            with open(f'{task_dir}/{tid}/children') as fh:
+                children.extend(int(c) for c in fh.read().split())
+    except OSError:
+        pass
+    return children
+
+
+def rss_mb(pid=None):
+    """RSS actual y pico (MB) de un proceso y sus hijos (p. ej. workers de gunicorn)"""
+    if pid is None and not os.path.exists('/proc/self/status'):
+        # Fallback portable: solo el pico del proceso actual
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        divisor = 1024 * 1024 if platform.system() == 'Darwin' else 1024
+        return {'current_mb': None, 'peak_mb': round(peak / divisor, 1)}
+
+    pid = pid or os.getpid()
+    pending = [pid]
+    current = peak = 0
+    while pending:
+        proc = pending.pop()
+        current += _read_status_kb(proc, 'VmRSS')
+        peak += _read_status_kb(proc, 'VmHWM')
+        pending.extend(_children(proc))
+    return {'current_mb': round(current / 1024, 1), 'peak_mb': round(peak / 1024, 1)}
+
+
+def baseline_path(name):
+    return BASELINE_DIR / f'{name}.json'
+
+
+def save_baseline(name, results):
+    BASELINE_DIR.mkdir(parents=True, exist_ok=True)
+    with open(baseline_path(name), 'w') as fh:
+        json.dump(results, fh, indent=2, sort_keys=True)
+
+
+def load_baseline(name):
+    path = baseline_path(name)
+    if not path.exists():
+        return None
+    with open(path) as fh:
+        return json.load(fh)
+
+
+def compare(results, baseline,
+            latency_tolerance=DEFAULT_LATENCY_TOLERANCE,
+            throughput_tolerance=DEFAULT_THROUGHPUT_TOLERANCE,
+            rss_tolerance=DEFAULT_RSS_TOLERANCE):
+    """Devuelve la lista de regresiones respecto a la línea base"""
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline['scenarios'].get(scenario)
+        if not previous:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if previous[metric] and current[metric] > previous[metric] * (1 + latency_tolerance):
+                regressions.append(
+                    f'{scenario}: {metric} {previous[metric]:.2f} -> {current[metric]:.2f}'
+                )
+        if previous['throughput_rps'] and \
+                current['throughput_rps'] < previous['throughput_rps'] * (1 - throughput_tolerance):
+            regressions.append(
+                f"{scenario}: throughput {previous['throughput_rps']:.1f} -> {current['throughput_rps']:.1f} req/s"
+            )
+        if previous.get('alloc_kb') and current.get('alloc_kb') and \
+                current['alloc_kb'] > previous['alloc_kb'] * (1 + rss_tolerance):
+            regressions.append(f"{scenario}: memoria por petición {previous['alloc_kb']:.0f} -> {current['alloc_kb']:.0f} KB")
+        if current['errors'] > previous['errors']:
+            regressions.append(f"{scenario}: errores {previous['errors']} -> {current['errors']}")
+
+    previous_rss = (baseline.get('rss') or {}).get('peak_mb')
+    current_rss = (results.get('rss') or {}).get('peak_mb')
+    if previous_rss and current_rss and current_rss > previous_rss * (1 + rss_tolerance):
+        regressions.append(f'RSS pico {previous_rss:.1f} -> {current_rss:.1f} MB')
+    return regressions
+
+
+def environment_info():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'timestamp': datetime.utcnow().isoformat(),
+    }
@@ -0,0 +1,239 @@
+"""
+Operaciones masivas del panel de administración
+
+Eliminar, reetiquetar y editar los metadatos de muchos archivos a la vez.
+Los IDs se recorren en lotes de BULK_BATCH_SIZE y cada lote emite un
+número fijo de sentencias sobre conjuntos (IN, UPDATE ... WHERE id IN,
+executemany), todo en una única transacción: la operación se aplica entera
+o no se aplica. Estas sentencias no pasan por los eventos del ORM, así que
+aquí se mantienen facet_counts, tags/file_tags, los datos derivados
+(texto, hashes, firmas) y catalog_changes, igual que hacen los eventos de
+database.py para un solo archivo.
+
+Los archivos físicos se borran después del commit en un hilo de fondo
+(FileSweeper): si la transacción falla no se pierde ningún archivo, y si
+el proceso termina antes de barrerlos quedan en el almacenamiento sin
+fila en la BD.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from database import (IMAGE_HASHABLE, LANGUAGE_LABELS, TEXT_EXTRACTABLE, ActivityLog, CatalogChange,
+                      DocumentSignature, FacetCount, File, FileStats, FileText, ImageHash, Tag, db, facet_values,
+                      normalize_tag, parse_tags)
+
+logger = logging.getLogger(__name__)
+
+SUBJECT_MAX_LENGTH = 500  # Longitud de files.dc_subject
+EDITABLE_FIELDS = ('dc_creator', 'dc_rights', 'dc_language')
+
+
+def _batches(file_ids, size):
+    file_ids = sorted(set(file_ids))
+    for start in range(0, len(file_ids), size):
+        yield file_ids[start:start + size]
+
+
+def retag_subject(subject, add, remove):
+    """dc_subject tras quitar las etiquetas `remove` (nombres normalizados) y añadir `add`
+
+    Conserva el orden y la forma escrita de las etiquetas existentes; las
+    nuevas se añaden al final mientras quepan en SUBJECT_MAX_LENGTH.
+    """
+    parts = [' '.join(part.split()) for part in (subject or '').split(',')]
+    kept = [part for part in parts if part and normalize_tag(part) not in remove]
+    present = {normalize_tag(part) for part in kept}
+    result = ', '.join(kept)
+    for name, label in add.items():
+        if name in present:
+            continue
+        candidate = f'{result}, {label}' if result else label
+        if len(candidate) > SUBJECT_MAX_LENGTH:
+            break
+        result = candidate
+        present.add(name)
+    return result
+
+
+class FileSweeper:
+    """Borra los archivos físicos de los registros eliminados, fuera de la petición"""
+
+    def __init__(self, storage):
+        self.storage = storage
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='unlink-sweeper')
+        self._lock = threading.Lock()
+        self._pending = 0
+        atexit.register(self.shutdown)
+
+    def schedule(self, filenames):
+        """Encola el borrado de archivos ya eliminados de la BD (llamar tras el commit)"""
+        filenames = list(filenames)
+        if filenames:
+            with self._lock:
+                self._pending += len(filenames)
+            return self._executor.submit(self._sweep, filenames)
+        return None
+
+    def backlog(self):
+        """Archivos pendientes de borrar en este proceso"""
+        return self._pending
+
+    def _sweep(self, filenames):
+        try:
+            return self._unlink(filenames)
+        finally:
+            with self._lock:
+                self._pending -= len(filenames)
+
+    def _unlink(self, filenames):
+        missing = 0
+        for filename in filenames:
+            try:
+                if not self.storage.delete(filename):
+                    missing += 1
+            except OSError as e:
+                logger.warning(f'No se pudo borrar el archivo {filename}: {type(e).__name__}')
+        if missing:
+            logger.warning(f'{missing} archivo(s) eliminados de la BD no estaban en el almacenamiento')
+        return len(filenames) - missing
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+class BulkEditor:
+    """Eliminación, reetiquetado y edición de metadatos de muchos archivos en una transacción"""
+
+    def __init__(self, sweeper, batch_size=500):
+        self.sweeper = sweeper
+        self.batch_size = batch_size
+
+    def delete(self, file_ids):
+        """Elimina los archivos y todo lo derivado de ellos; devuelve los nombres eliminados
+
+        Hace commit y encola el borrado físico; ante un error la transacción
+        queda a medias y el llamador debe hacer rollback.
+        """
+        connection = db.session.connection()
+        files = File.__table__
+        filenames = []
+        for batch in _batches(file_ids, self.batch_size):
+            rows = connection.execute(db.select(
+                files.c.id, files.c.filename, files.c.extension, files.c.category, files.c.dc_language,
+                files.c.upload_year,
+            ).where(files.c.id.in_(batch))).all()
+            if not rows:
+                continue
+            ids = [row.id for row in rows]
+
+            deltas = {}
+            for row in rows:
+                for pair in facet_values(row.category, row.dc_language, row.upload_year):
+                    deltas[pair] = deltas.get(pair, 0) - 1
+            FacetCount.apply_deltas(connection, deltas)
+            Tag.detach_files(connection, ids)
+            extractable = [row.id for row in rows if row.extension in TEXT_EXTRACTABLE]
+            if extractable:
+                FileText.remove_many(connection, extractable)
+            hashable = [row.id for row in rows if row.extension in IMAGE_HASHABLE]
+            if hashable:
+                ImageHash.remove_many(connection, hashable)
+            DocumentSignature.remove_many(connection, ids)
+            FileStats.remove_many(connection, ids)
+            # El registro de actividad conserva las entradas, sin el archivo
+            logs = ActivityLog.__table__
+            connection.execute(logs.update().where(logs.c.file_id.in_(ids)).values(file_id=None))
+            connection.execute(files.delete().where(files.c.id.in_(ids)))
+            CatalogChange.record_many(connection, 'delete', ids)
+            filenames.extend(row.filename for row in rows)
+
+        db.session.commit()
+        self.sweeper.schedule(filenames)
+        return filenames
+
+    def retag(self, file_ids, add=None, remove=None):
+        """Añade las etiquetas `add` (texto dc_subject) y quita `remove`; devuelve los archivos cambiados"""
+        add = parse_tags(add)
+        remove = set(parse_tags(remove))
+        if not add and not remove:
+            return 0
+        connection = db.session.connection()
+        files = File.__table__
+        now = datetime.utcnow()
+        changed = 0
+        for batch in _batches(file_ids, self.batch_size):
+            updates, attached, detached = [], [], []
+            for file_id, subject in connection.execute(
+                db.select(files.c.id, files.c.dc_subject).where(files.c.id.in_(batch))
+            ):
+                new_subject = retag_subject(subject, add, remove)
+                if new_subject == (subject or ''):
+                    continue
+                before, after = parse_tags(subject), parse_tags(new_subject)
+                detached.extend((file_id, name) for name in before if name not in after)
+                attached.extend((file_id, name, label) for name, label in after.items() if name not in before)
+                updates.append({'file_key': file_id, 'subject': new_subject})
+            if not updates:
+                continue
+
+            connection.execute(
+                files.update().where(files.c.id == db.bindparam('file_key'))
+                .values(dc_subject=db.bindparam('subject'), updated_at=now),
+                updates
+            )
+            Tag.detach_many(connection, detached)
+            Tag.attach_many(connection, attached)
+            CatalogChange.record_many(connection, 'update', [update['file_key'] for update in updates])
+            changed += len(updates)
+
+        db.session.commit()
+        return changed
+
+    def update(self, file_ids, values):
+        """Asigna los mismos valores de EDITABLE_FIELDS a todos los archivos; devuelve cuántos cambió"""
+        values = {field: value for field, value in values.items() if field in EDITABLE_FIELDS and value}
+        if not values:
+            return 0
+        language = values.get('dc_language')
+        if language is not None and language not in LANGUAGE_LABELS:
+            raise ValueError(f'Idioma no válido: {language}')
+        connection = db.session.connection()
+        files = File.__table__
+        changed = 0
+        for batch in _batches(file_ids, self.batch_size):
+            if language is not None:
+                deltas = {}
+                for old, count in connection.execute(
+                    db.select(files.c.dc_language, db.func.count()).where(files.c.id.in_(batch))
+                    .group_by(files.c.dc_language)
+                ):
+                    old = old or 'es'
+                    if old != language:
+                        deltas[('lang', old)] = deltas.get(('lang', old), 0) - count
+                        deltas[('lang', language)] = deltas.get(('lang', language), 0) + count
+                FacetCount.apply_deltas(connection, deltas)
+
+            ids = connection.execute(
+                files.update().where(files.c.id.in_(batch)).values(updated_at=datetime.utcnow(), **values)
+                .returning(files.c.id)
+            ).scalars().all()
+            CatalogChange.record_many(connection, 'update', ids)
+            changed += len(ids)
+
+        db.session.commit()
+        return changed
+
+
+def init_bulk(app, storage):
+    """Registra las operaciones masivas y el barrido de archivos con configuración por defecto"""
+    app.config.setdefault('BULK_BATCH_SIZE', int(os.environ.get('BULK_BATCH_SIZE', 500)))
+    app.config.setdefault('BULK_MAX_FILES', int(os.environ.get('BULK_MAX_FILES', 5000)))
+
+    editor = BulkEditor(FileSweeper(storage), batch_size=app.config['BULK_BATCH_SIZE'])
+    app.extensions['metadatos_bulk'] = editor
+    return editor
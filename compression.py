@@ -0,0 +1,177 @@
+"""
+Compresión en reposo de los archivos subidos comprimibles
+
+Los txt y csv se guardan comprimidos con gzip como `<nombre>.gz` junto a la
+ruta original, que deja de existir: es el formato de `gzip_static` de
+nginx, que con `gzip_static always` y `gunzip on` sirve el .gz tal cual a
+los clientes que aceptan gzip y lo descomprime al vuelo para el resto. La
+ruta /uploads/ de Flask hace lo mismo cuando no hay proxy delante.
+
+Solo se conserva la versión comprimida si ahorra al menos
+COMPRESS_MIN_SAVINGS del tamaño original; docx, xlsx y odt ya son ZIP
+comprimidos y se dejan como están. El tamaño original se lee del campo
+ISIZE del final del .gz, sin descomprimir. Los archivos se comprimen en
+local antes de guardarlos en el backend de storage.py.
+"""
+
+import gzip
+import os
+import shutil
+import struct
+
+from database import MIME_BY_EXTENSION, File, db
+
+COMPRESSIBLE = {'txt', 'csv'}
+SUFFIX = '.gz'
+READ_CHUNK = 64 * 1024
+
+
+def is_compressed(path):
+    return path.endswith(SUFFIX)
+
+
+def open_stored(path):
+    """Abre en binario un archivo guardado, descomprimiéndolo si hace falta"""
+    return gzip.open(path, 'rb') if is_compressed(path) else open(path, 'rb')
+
+
+def gzip_original_size(trailer):
+    """Tamaño sin comprimir a partir de los 4 últimos bytes de un .gz (ISIZE, módulo 2^32)"""
+    return struct.unpack('<I', trailer)[0]
+
+
+def original_size(path):
+    """Tamaño sin comprimir de un archivo local"""
+    if not is_compressed(path):
+        return os.path.getsize(path)
+    with open(path, 'rb') as fh:
+        fh.seek(-4, os.SEEK_END)
+        return gzip_original_size(fh.read(4))
+
+
+def iter_decompressed(source, chunk_size=READ_CHUNK):
+    """Contenido descomprimido por bloques, para clientes que no aceptan gzip
+
+    source es una ruta o un archivo abierto (p. ej. el cuerpo de un GET al
+    bucket), que se cierra al terminar.
+    """
+    try:
+        with gzip.open(source, 'rb') as fh:
+            while True:
+                chunk = fh.read(chunk_size)
+                if not chunk:
+                    return
+                yield chunk
+    finally:
+        if hasattr(source, 'close'):
+            source.close()
+
+
+class UploadCompressor:
+    """Comprime los archivos subidos comprimibles y mide el espacio ahorrado"""
+
+    def __init__(self, storage, enabled=True, level=6, min_savings=0.1, min_bytes=1024):
+        self.storage = storage
+        self.enabled = enabled
+        self.level = level
+        self.min_savings = min_savings
+        self.min_bytes = min_bytes
+
+    def compress_file(self, path, extension):
+        """Sustituye un archivo local por su versión gzip si compensa; devuelve la ruta resultante"""
+        if not self.enabled or extension not in COMPRESSIBLE:
+            return path
+        size = os.path.getsize(path)
+        if size < self.min_bytes:
+            return path
+
+        temporary = path + SUFFIX + '.tmp'
+        try:
+            with open(path, 'rb') as source, open(temporary, 'wb') as raw:
+                # Sin nombre ni fecha en la cabecera: el mismo contenido da el mismo .gz
+                with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=self.level,
+                                   mtime=0) as target:
+                    shutil.copyfileobj(source, target, READ_CHUNK)
+            if os.path.getsize(temporary) > size * (1 - self.min_savings):
+                os.remove(temporary)
+                return path
+            # Conserva la fecha del original para Last-Modified
+            stat = os.stat(path)
+            os.utime(temporary, (stat.st_atime, stat.st_mtime))
+            os.replace(temporary, path + SUFFIX)
+            os.remove(path)
+            return path + SUFFIX
+        except BaseException:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            raise
+
+    def _rows(self):
+        return db.session.execute(
+            db.select(File.id, File.filename, File.extension, File.compressed)
+            .where(File.extension.in_(sorted(COMPRESSIBLE))).order_by(File.id)
+        ).all()
+
+    def report(self):
+        """{extensión: {'files', 'compressed', 'original', 'stored'}} de los archivos comprimibles"""
+        totals = {}
+        for _, filename, extension, compressed in self._rows():
+            key = self.storage.resolve(filename, compressed)
+            stat = self.storage.stat(key) if key else None
+            if stat is None:
+                continue
+            entry = totals.setdefault(extension, {'files': 0, 'compressed': 0, 'original': 0, 'stored': 0})
+            entry['files'] += 1
+            entry['stored'] += stat[0]
+            if is_compressed(key):
+                entry['compressed'] += 1
+                entry['original'] += gzip_original_size(self.storage.tail(key, 4))
+            else:
+                entry['original'] += stat[0]
+        return totals
+
+    def backfill(self, progress=None):
+        """Comprime los archivos comprimibles subidos antes de activar la compresión
+
+        También anota en files.compressed cómo está guardado cada uno. Devuelve
+        el número de archivos comprimidos.
+        """
+        rows = self._rows()
+        compressed = 0
+        for done, (file_id, filename, extension, stored) in enumerate(rows, 1):
+            key = self.storage.locate(filename)
+            if key == filename:
+                with self.storage.local_file(filename) as path:
+                    result = self.compress_file(path, extension)
+                    if is_compressed(result):
+                        self.storage.save(result, filename + SUFFIX, content_type=MIME_BY_EXTENSION.get(extension),
+                                          content_encoding='gzip')
+                        self.storage.delete_key(filename)
+                        if self.storage.remote:
+                            os.remove(result)
+                        key = filename + SUFFIX
+                        compressed += 1
+            if key is not None and stored != is_compressed(key):
+                db.session.execute(db.update(File).where(File.id == file_id).values(compressed=is_compressed(key)))
+                db.session.commit()
+            if progress and (done % 100 == 0 or done == len(rows)):
+                progress(done, len(rows))
+        return compressed
+
+
+def init_compression(app):
+    """Registra la compresión de los archivos subidos con configuración por defecto"""
+    app.config.setdefault('COMPRESS_UPLOADS', os.environ.get('COMPRESS_UPLOADS', 'true').lower() == 'true')
+    app.config.setdefault('COMPRESS_LEVEL', int(os.environ.get('COMPRESS_LEVEL', 6)))
+    app.config.setdefault('COMPRESS_MIN_SAVINGS', float(os.environ.get('COMPRESS_MIN_SAVINGS', 0.1)))
+    app.config.setdefault('COMPRESS_MIN_BYTES', int(os.environ.get('COMPRESS_MIN_BYTES', 1024)))
+
+    compressor = UploadCompressor(
+        app.extensions['metadatos_storage'],
+        enabled=app.config['COMPRESS_UPLOADS'],
+        level=app.config['COMPRESS_LEVEL'],
+        min_savings=app.config['COMPRESS_MIN_SAVINGS'],
+        min_bytes=app.config['COMPRESS_MIN_BYTES'],
+    )
+    app.extensions['metadatos_compression'] = compressor
+    return compressor
@@ -1,9 +1,99 @@
 from flask_sqlalchemy import SQLAlchemy
+from flask_sqlalchemy.pagination import SelectPagination
+from sqlalchemy import event
+from sqlalchemy.orm.attributes import get_history
 from datetime import datetime
+import json
 import os
+import re
+import unicodedata
+import zlib
 
 db = SQLAlchemy()
 
+# Clasificación persistida de archivos por extensión
+CATEGORY_BY_EXTENSION = {
+    'jpg': 'image', 'jpeg': 'image', 'png': 'image', 'gif': 'image', 'bmp': 'image', 'webp': 'image',
+    'pdf': 'document', 'doc': 'document', 'docx': 'document', 'odt': 'document', 'txt': 'document', 'rtf': 'document',
+    'xls': 'spreadsheet', 'xlsx': 'spreadsheet', 'ods': 'spreadsheet', 'csv': 'spreadsheet',
+    'ppt': 'presentation', 'pptx': 'presentation', 'odp': 'presentation',
+    'mp3': 'media', 'wav': 'media', 'ogg': 'media', 'mp4': 'media', 'avi': 'media', 'mkv': 'media', 'mov': 'media',
+}
+
+CATEGORY_LABELS = {
+    'document': 'Documentos',
+    'image': 'Imágenes',
+    'spreadsheet': 'Hojas de cálculo',
+    'presentation': 'Presentaciones',
+    'media': 'Multimedia',
+    'other': 'Otros',
+}
+
+LANGUAGE_LABELS = {
+    'es': 'Español',
+    'en': 'Inglés',
+    'fr': 'Francés',
+    'pt': 'Portugués',
+    'other': 'Otro',
+}
+
+# Valores por defecto de Dublin Core cuando ni el formulario ni el archivo los aportan
+DEFAULT_CREATOR = 'Metadatos App Admin'
+DEFAULT_RIGHTS = '© 2024 Metadatos App. Todos los derechos reservados.'
+
+# MIME explícito para no depender de /etc/mime.types del servidor
+MIME_BY_EXTENSION = {
+    'txt': 'text/plain', 'csv': 'text/csv', 'pdf': 'application/pdf', 'rtf': 'application/rtf',
+    'png': 'image/png', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'gif': 'image/gif',
+    'bmp': 'image/bmp', 'webp': 'image/webp',
+    'doc': 'application/msword',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+    'xls': 'application/vnd.ms-excel',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    'ppt': 'application/vnd.ms-powerpoint',
+    'pptx': 'application/vnd.openxmlformats-officedocument.presentationml.presentation',
+    'odt': 'application/vnd.oasis.opendocument.text',
+    'ods': 'application/vnd.oasis.opendocument.spreadsheet',
+    'odp': 'application/vnd.oasis.opendocument.presentation',
+    'mp3': 'audio/mpeg', 'wav': 'audio/wav', 'ogg': 'audio/ogg',
+    'mp4': 'video/mp4', 'avi': 'video/x-msvideo', 'mkv': 'video/x-matroska', 'mov': 'video/quicktime',
+}
+
+
+def extension_of(filename):
+    """Extensión en minúsculas sin punto ('' si no tiene)"""
+    if filename and '.' in filename:
+        return filename.rsplit('.', 1)[1].lower()
+    return ''
+
+
+def formatted_size_of(file_size):
+    """Tamaño en MB como texto ("512 KB", "1.50 MB")"""
+    if file_size < 1:
+        return f"{int(file_size * 1024)} KB"
+    return f"{file_size:.2f} MB"
+
+
+# Caracteres de la descripción que muestran las vistas de lista
+SHORT_DESCRIPTION_CHARS = 100
+
+
+def shorten_description(description):
+    if len(description) <= SHORT_DESCRIPTION_CHARS:
+        return description
+    return description[:SHORT_DESCRIPTION_CHARS] + "..."
+
+
+def derived_file_columns(filename, upload_date=None):
+    """Columnas derivadas del nombre y la fecha, para inserciones ORM y masivas"""
+    extension = extension_of(filename)
+    return {
+        'extension': extension,
+        'category': CATEGORY_BY_EXTENSION.get(extension, 'other'),
+        'mime_type': MIME_BY_EXTENSION.get(extension, 'application/octet-stream'),
+        'upload_year': (upload_date or datetime.utcnow()).year,
+    }
+
 class File(db.Model):
     """Modelo para archivos subidos"""
 
@@ -15,16 +105,23 @@ class File(db.Model):
     filename = db.Column(db.String(255), nullable=False, unique=True)
     original_filename = db.Column(db.String(255), nullable=True)  # Nombre original del archivo
     file_size = db.Column(db.Float, default=0.0)  # Tamaño en MB
-    mime_type = db.Column(db.String(100), nullable=True)  # Tipo MIME
+    size_bytes = db.Column(db.BigInteger, nullable=True)  # Tamaño exacto del contenido (sin comprimir)
+    crc32 = db.Column(db.BigInteger, nullable=True)  # CRC-32 del contenido, para las descargas en ZIP
+    # Guardado como filename + '.gz' (compression.py); None: sin comprobar, se busca en el almacenamiento
+    compressed = db.Column(db.Boolean, nullable=True)
+    mime_type = db.Column(db.String(100), nullable=True, index=True)  # Tipo MIME
+    extension = db.Column(db.String(16), nullable=True, index=True)  # Derivada de filename
+    category = db.Column(db.String(20), nullable=True, index=True)  # image, document, ...
+    upload_year = db.Column(db.Integer, nullable=True, index=True)  # Para la faceta de año
     upload_date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
     # Metadatos adicionales para Dublin Core
-    dc_creator = db.Column(db.String(255), default='Metadatos App Admin')
+    dc_creator = db.Column(db.String(255), default=DEFAULT_CREATOR)
     dc_subject = db.Column(db.String(500), nullable=True)  # Palabras clave/categorías
-    dc_language = db.Column(db.String(10), default='es')
-    dc_rights = db.Column(db.String(500), default='© 2024 Metadatos App. Todos los derechos reservados.')
+    dc_language = db.Column(db.String(10), default='es', index=True)
+    dc_rights = db.Column(db.String(500), default=DEFAULT_RIGHTS)
 
     def __repr__(self):
         return f'<File {self.title}>'
@@ -32,41 +129,42 @@ class File(db.Model):
     @property
     def file_extension(self):
         """Obtiene la extensión del archivo"""
-        if '.' in self.filename:
-            return self.filename.rsplit('.', 1)[1].lower()
-        return ''
+        return self.extension if self.extension is not None else extension_of(self.filename)
+
+    @property
+    def file_category(self):
+        """Categoría persistida (o derivada si la fila aún no se migró)"""
+        return self.category or CATEGORY_BY_EXTENSION.get(self.file_extension, 'other')
+
+    @property
+    def subject_tags(self):
+        """Pares (nombre normalizado, etiqueta) de dc_subject sin consultar la BD"""
+        return list(parse_tags(self.dc_subject).items())
 
     @property
     def is_image(self):
         """Verifica si el archivo es una imagen"""
-        image_extensions = {'jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp'}
-        return self.file_extension in image_extensions
+        return self.file_category == 'image'
 
     @property
     def is_document(self):
         """Verifica si el archivo es un documento"""
-        doc_extensions = {'pdf', 'doc', 'docx', 'txt', 'rtf'}
-        return self.file_extension in doc_extensions
+        return self.file_category == 'document'
 
     @property
     def is_media(self):
         """Verifica si el archivo es multimedia"""
-        media_extensions = {'mp3', 'wav', 'ogg', 'mp4', 'avi', 'mkv', 'mov'}
-        return self.file_extension in media_extensions
+        return self.file_category == 'media'
 
     @property
     def formatted_size(self):
         """Retorna el tamaño formateado"""
-        if self.file_size < 1:
-            return f"{int(self.file_size * 1024)} KB"
-        return f"{self.file_size:.2f} MB"
+        return formatted_size_of(self.file_size)
 
     @property
     def short_description(self):
         """Retorna una descripción truncada para vistas de lista"""
-        if len(self.description) <= 100:
-            return self.description
-        return self.description[:100] + "..."
+        return shorten_description(self.description)
 
     def to_dict(self):
         """Convierte el objeto a diccionario para APIs"""
@@ -77,6 +175,8 @@ class File(db.Model):
             'filename': self.filename,
             'file_size': self.file_size,
             'file_extension': self.file_extension,
+            'category': self.file_category,
+            'mime_type': self.mime_type,
             'upload_date': self.upload_date.isoformat(),
             'is_image': self.is_image,
             'is_document': self.is_document,
@@ -86,38 +186,994 @@ class File(db.Model):
     @staticmethod
     def search(query):
         """Busca archivos por título o descripción"""
-        return File.query.filter(
-            db.or_(
-                File.title.contains(query),
-                File.description.contains(query),
-                File.dc_subject.contains(query) if query else False
+        return File.query.filter(File.search_condition(query))
+
+    @staticmethod
+    def search_condition(search):
+        """Condición de búsqueda en título y descripción según el dialecto
+
+        SQLite: LIKE. PostgreSQL: la columna search_vector (tsvector con
+        índice GIN, ver migración 4), con las palabras como prefijo en
+        cualquier orden y, con unaccent, sin acentos; si no encuentra nada,
+        ILIKE como en SQLite para los fragmentos dentro de una palabra,
+        servido por los índices de trigramas de pg_trgm.
+        """
+        connection = db.session.connection()
+        if connection.dialect.name != 'postgresql':
+            return db.or_(File.title.contains(search), File.description.contains(search))
+        query = search_tsquery(search, prefix=True)
+        if query and 'metadata' in pg_search_features(connection):
+            words = db.literal_column('files.search_vector').op('@@')(
+                db.func.to_tsquery(SEARCH_CONFIG, db.func.metadatos_search_text(query))
             )
-        )
+            # Con OR el planificador recorrería la tabla por el ILIKE aunque el índice GIN baste
+            if connection.execute(db.select(db.literal(1)).select_from(File).where(words).limit(1)).first():
+                return words
+        return db.or_(File.title.icontains(search, autoescape=True),
+                      File.description.icontains(search, autoescape=True))
 
     @classmethod
     def get_stats(cls):
         """Obtiene estadísticas de archivos"""
-        total_files = cls.query.count()
-        total_size = db.session.query(db.func.sum(cls.file_size)).scalar() or 0
-
-        # Archivos por tipo
-        images = cls.query.filter(cls.filename.like('%.jpg')).count() + \
-                cls.query.filter(cls.filename.like('%.jpeg')).count() + \
-                cls.query.filter(cls.filename.like('%.png')).count() + \
-                cls.query.filter(cls.filename.like('%.gif')).count()
+        total_files, total_size = db.session.query(
+            db.func.count(cls.id), db.func.sum(cls.file_size)
+        ).one()
+        total_files = total_files or 0
 
-        documents = cls.query.filter(cls.filename.like('%.pdf')).count() + \
-                   cls.query.filter(cls.filename.like('%.doc')).count() + \
-                   cls.query.filter(cls.filename.like('%.docx')).count()
+        # Archivos por tipo desde la tabla de facetas (sin recorrer files)
+        by_category = FacetCount.counts_for('type')
+        images = by_category.get('image', 0)
+        documents = by_category.get('document', 0)
 
         return {
             'total_files': total_files,
-            'total_size_mb': round(total_size, 2),
+            'total_size_mb': round(total_size or 0, 2),
             'images': images,
             'documents': documents,
             'others': total_files - images - documents
         }
 
+
+@event.listens_for(File, 'before_insert')
+def _fill_derived_columns(mapper, connection, target):
+    """Completa extension/category/mime_type/upload_year al insertar"""
+    if target.upload_date is None:
+        target.upload_date = datetime.utcnow()
+    for column, value in derived_file_columns(target.filename, target.upload_date).items():
+        if getattr(target, column) is None:
+            setattr(target, column, value)
+
+
+class FileRow:
+    """Archivo de las vistas de lista (portada y panel)
+
+    Solo las columnas que pintan las tarjetas y la tabla, y la descripción
+    ya recortada en SQL: sin description completa ni dc_*, sin identidad
+    ni seguimiento de cambios del ORM. Con with_stats, también las vistas
+    y descargas de file_stats.
+    """
+
+    __slots__ = ('id', 'title', 'description_start', 'filename', 'file_size', 'upload_date', 'views', 'downloads')
+
+    # Órdenes de paginate(): el de descargas recorre ix_file_stats_downloads
+    ORDERS = ('recent', 'downloads')
+
+    def __init__(self, id, title, description_start, filename, file_size, upload_date, views=None, downloads=None):
+        self.id = id
+        self.title = title
+        self.description_start = description_start
+        self.filename = filename
+        self.file_size = file_size
+        self.upload_date = upload_date
+        self.views = views or 0
+        self.downloads = downloads or 0
+
+    @classmethod
+    def select(cls, with_stats=False, order='recent'):
+        # Un carácter de más para saber si hay que añadir "..."
+        columns = [File.id, File.title, db.func.substr(File.description, 1, SHORT_DESCRIPTION_CHARS + 1),
+                   File.filename, File.file_size, File.upload_date]
+        if order == 'downloads':
+            # Solo los archivos descargados alguna vez, del más al menos descargado
+            return db.select(*columns, FileStats.views, FileStats.downloads).select_from(FileStats).join(
+                File, File.id == FileStats.file_id
+            ).where(FileStats.downloads > 0).order_by(FileStats.downloads.desc(), FileStats.file_id.desc())
+        select = db.select(*columns).select_from(File)
+        if with_stats:
+            select = select.add_columns(FileStats.views, FileStats.downloads).outerjoin(
+                FileStats, FileStats.file_id == File.id
+            )
+        return select.order_by(File.upload_date.desc())
+
+    @classmethod
+    def paginate(cls, conditions=(), page=1, per_page=12, with_stats=False, order='recent'):
+        """Página de archivos en el orden `order` (ver ORDERS), con la API de db.paginate"""
+        return RowPagination(
+            select=cls.select(with_stats, order).where(*conditions),
+            session=db.session(), page=page, per_page=per_page, max_per_page=None, error_out=False,
+        )
+
+    @property
+    def formatted_size(self):
+        return formatted_size_of(self.file_size)
+
+    @property
+    def short_description(self):
+        return shorten_description(self.description_start)
+
+
+class RowPagination(SelectPagination):
+    """db.paginate para FileRow.select(): cada fila se convierte en un FileRow"""
+
+    def _query_items(self):
+        select = self._query_args['select'].limit(self.per_page).offset(self._query_offset)
+        return [FileRow(*row) for row in self._query_args['session'].execute(select)]
+
+    def _query_count(self):
+        # Mismo FROM y WHERE, sin la subconsulta de columnas ni el ORDER BY
+        count = self._query_args['select'].with_only_columns(
+            db.func.count(), maintain_column_froms=True
+        ).order_by(None)
+        return self._query_args['session'].execute(count).scalar()
+
+
+def normalize_tag(text):
+    """Forma canónica de una palabra clave: minúsculas, sin tildes, espacios simples"""
+    folded = unicodedata.normalize('NFKD', (text or '').strip().lower())
+    folded = ''.join(char for char in folded if not unicodedata.combining(char))
+    return ' '.join(folded.split())[:100]
+
+
+def parse_tags(dc_subject):
+    """Etiquetas de un campo dc_subject: {nombre normalizado: etiqueta original}
+
+    Conserva el orden y la primera forma escrita de cada palabra clave,
+    descartando duplicados que solo difieren en mayúsculas o tildes.
+    """
+    tags = {}
+    for part in (dc_subject or '').split(','):
+        label = ' '.join(part.split())[:100]
+        name = normalize_tag(label)
+        if name and name not in tags:
+            tags[name] = label
+    return tags
+
+
+def facet_values(category, language, year):
+    """Pares (faceta, valor) que un archivo aporta a las cuentas"""
+    pairs = [('type', category or 'other'), ('lang', language or 'es')]
+    if year:
+        pairs.append(('year', str(year)))
+    return pairs
+
+
+def engine_options(database_url):
+    """Opciones del motor SQLAlchemy para un servidor de BD (SQLite usa las de Flask-SQLAlchemy)
+
+    El pool es por proceso: cada worker de gunicorn abre hasta
+    DB_POOL_SIZE + DB_MAX_OVERFLOW conexiones, así que workers × (ambos)
+    debe quedar por debajo de max_connections del servidor.
+    """
+    if database_url.startswith('sqlite'):
+        return {}
+    options = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 5)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 10)),
+        # Por debajo de los cortes por inactividad de balanceadores y pgbouncer
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        # Un SELECT 1 al sacar la conexión: sobrevive a reinicios y failover del servidor
+        'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        # LIFO: con poca carga se reutilizan las mismas conexiones y el resto caduca
+        'pool_use_lifo': True,
+    }
+    if database_url.startswith('postgresql'):
+        connect_args = {'application_name': 'metadatos', 'connect_timeout': 10}
+        statement_timeout = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+        if statement_timeout:
+            connect_args['options'] = f'-c statement_timeout={statement_timeout}'
+        options['connect_args'] = connect_args
+    return options
+
+
+# Búsqueda nativa de PostgreSQL (ver migración 4): configuración sin
+# stemming, como el tokenizador unicode61 de FTS5, y una función SQL que
+# normaliza el texto (quita acentos si la extensión unaccent está disponible)
+SEARCH_CONFIG = db.literal_column("'simple'::regconfig")
+_pg_features = {}  # URL del motor -> funciones de búsqueda disponibles
+
+
+def pg_search_features(connection):
+    """Subconjunto de {'metadata', 'content'} disponible en esta BD PostgreSQL"""
+    key = str(connection.engine.url)
+    if key not in _pg_features:
+        columns = {(table, column) for table, column in connection.execute(db.text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE (table_name, column_name) IN (('files', 'search_vector'), ('file_texts', 'body_tsv'))"
+        ))}
+        features = set()
+        if ('files', 'search_vector') in columns:
+            features.add('metadata')
+        if ('file_texts', 'body_tsv') in columns:
+            features.add('content')
+        _pg_features[key] = frozenset(features)
+    return _pg_features[key]
+
+
+def search_tsquery(search, prefix=False):
+    """Consulta tsquery segura: palabras unidas con & (con :* coinciden como prefijo)"""
+    words = re.findall(r'\w+', search or '')[:10]
+    return ' & '.join(f'{word}:*' if prefix else word for word in words)
+
+
+def dialect_insert(connection, table):
+    """INSERT con soporte de ON CONFLICT según el dialecto de la conexión"""
+    if connection.dialect.name == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(table)
+
+
+class FacetCount(db.Model):
+    """Cuentas precalculadas por faceta para la navegación sin filtros"""
+
+    __tablename__ = 'facet_counts'
+
+    facet = db.Column(db.String(20), primary_key=True)  # type, lang, year
+    value = db.Column(db.String(100), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def counts_for(cls, facet):
+        rows = db.session.query(cls.value, cls.count).filter(cls.facet == facet, cls.count > 0)
+        return {value: count for value, count in rows}
+
+    @classmethod
+    def all_counts(cls):
+        """Todas las facetas en una sola consulta: {faceta: {valor: cuenta}}"""
+        result = {}
+        for facet, value, count in db.session.query(cls.facet, cls.value, cls.count).filter(cls.count > 0):
+            result.setdefault(facet, {})[value] = count
+        return result
+
+    @classmethod
+    def apply(cls, connection, pairs, delta):
+        """Suma delta a cada (faceta, valor) con un upsert en la conexión dada"""
+        cls.apply_deltas(connection, {pair: delta for pair in pairs})
+
+    @classmethod
+    def apply_deltas(cls, connection, deltas):
+        """Suma a cada (faceta, valor) su delta {(faceta, valor): delta} en un único upsert"""
+        rows = [{'facet': facet, 'value': value, 'count': delta} for (facet, value), delta in deltas.items() if delta]
+        if not rows:
+            return
+        stmt = dialect_insert(connection, cls.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['facet', 'value'],
+            set_={'count': cls.__table__.c['count'] + stmt.excluded['count']}
+        )
+        connection.execute(stmt, rows)
+
+    @classmethod
+    def rebuild(cls, connection=None):
+        """Recalcula todas las cuentas desde files (backfill o tras cargas masivas)"""
+        connection = connection or db.session.connection()
+        files = File.__table__.c
+        connection.execute(cls.__table__.delete())
+        grouped = {}
+        for column, facet in ((files.category, 'type'), (files.dc_language, 'lang'), (files.upload_year, 'year')):
+            for value, count in connection.execute(
+                db.select(column, db.func.count()).where(column.isnot(None)).group_by(column)
+            ):
+                grouped[(facet, str(value))] = count
+        if grouped:
+            connection.execute(cls.__table__.insert(), [
+                {'facet': facet, 'value': value, 'count': count}
+                for (facet, value), count in grouped.items()
+            ])
+
+
+file_tags = db.Table(
+    'file_tags',
+    db.Column('file_id', db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('tag_id', db.Integer, db.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+    # "Archivos con la etiqueta X" es un recorrido de este índice
+    db.Index('ix_file_tags_tag_file', 'tag_id', 'file_id'),
+)
+
+
+class Tag(db.Model):
+    """Palabra clave normalizada con su número de archivos"""
+
+    __tablename__ = 'tags'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False, unique=True, index=True)  # Forma normalizada
+    label = db.Column(db.String(100), nullable=False)  # Primera forma escrita
+    file_count = db.Column(db.Integer, nullable=False, default=0, index=True)
+
+    def __repr__(self):
+        return f'<Tag {self.name}>'
+
+    @classmethod
+    def cloud(cls, limit=100, min_count=1):
+        """Etiquetas más usadas (nombre, etiqueta, cuenta) servidas por el índice de file_count"""
+        return db.session.query(cls.name, cls.label, cls.file_count).filter(
+            cls.file_count >= max(1, min_count)
+        ).order_by(cls.file_count.desc(), cls.name).limit(limit).all()
+
+    @classmethod
+    def file_ids(cls, name):
+        """Subconsulta con los IDs de archivos que llevan la etiqueta `name`"""
+        return db.select(file_tags.c.file_id).join(cls, cls.id == file_tags.c.tag_id).where(
+            cls.name == normalize_tag(name)
+        )
+
+    @classmethod
+    def attach(cls, connection, file_id, tags):
+        """Asocia etiquetas {nombre: etiqueta} a un archivo e incrementa sus cuentas"""
+        if not tags:
+            return
+        stmt = dialect_insert(connection, cls.__table__)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'file_count': cls.__table__.c.file_count + stmt.excluded.file_count}
+        )
+        connection.execute(stmt, [{'name': name, 'label': label, 'file_count': 1} for name, label in tags.items()])
+        # Una sola sentencia para las asociaciones, sin leer los IDs de vuelta
+        connection.execute(file_tags.insert().from_select(
+            ['file_id', 'tag_id'],
+            db.select(db.literal(file_id), cls.__table__.c.id).where(cls.__table__.c.name.in_(list(tags)))
+        ))
+
+    @classmethod
+    def detach(cls, connection, file_id, names=None):
+        """Quita etiquetas de un archivo (todas si names es None) y decrementa sus cuentas"""
+        if names is not None and not names:
+            return
+        linked = db.select(file_tags.c.tag_id).where(file_tags.c.file_id == file_id)
+        if names is not None:
+            linked = linked.where(file_tags.c.tag_id.in_(
+                db.select(cls.__table__.c.id).where(cls.__table__.c.name.in_(list(names)))
+            ))
+        tag_ids = linked.scalar_subquery()
+        connection.execute(cls.__table__.update().where(cls.__table__.c.id.in_(tag_ids)).values(
+            file_count=cls.__table__.c.file_count - 1
+        ))
+        connection.execute(file_tags.delete().where(
+            file_tags.c.file_id == file_id, file_tags.c.tag_id.in_(tag_ids)
+        ))
+
+    @classmethod
+    def attach_many(cls, connection, links):
+        """Asocia pares (file_id, nombre, etiqueta) e incrementa las cuentas: dos sentencias por lote"""
+        if not links:
+            return
+        tags_table = cls.__table__
+        counts, labels = {}, {}
+        for _, name, label in links:
+            counts[name] = counts.get(name, 0) + 1
+            labels.setdefault(name, label)
+        stmt = dialect_insert(connection, tags_table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['name'],
+            set_={'file_count': tags_table.c.file_count + stmt.excluded.file_count}
+        )
+        connection.execute(stmt, [{'name': name, 'label': labels[name], 'file_count': count}
+                                  for name, count in counts.items()])
+        connection.execute(file_tags.insert().from_select(
+            ['file_id', 'tag_id'],
+            db.select(db.bindparam('link_file'), tags_table.c.id).where(tags_table.c.name == db.bindparam('link_name'))
+        ), [{'link_file': file_id, 'link_name': name} for file_id, name, _ in links])
+
+    @classmethod
+    def detach_many(cls, connection, links):
+        """Quita pares (file_id, nombre) y decrementa las cuentas: dos sentencias por lote"""
+        if not links:
+            return
+        tags_table = cls.__table__
+        counts = {}
+        for _, name in links:
+            counts[name] = counts.get(name, 0) + 1
+        connection.execute(
+            tags_table.update().where(tags_table.c.name == db.bindparam('tag_name'))
+            .values(file_count=tags_table.c.file_count - db.bindparam('removed')),
+            [{'tag_name': name, 'removed': count} for name, count in counts.items()]
+        )
+        connection.execute(file_tags.delete().where(
+            file_tags.c.file_id == db.bindparam('link_file'),
+            file_tags.c.tag_id == db.select(tags_table.c.id).where(
+                tags_table.c.name == db.bindparam('link_name')).scalar_subquery()
+        ), [{'link_file': file_id, 'link_name': name} for file_id, name in links])
+
+    @classmethod
+    def detach_files(cls, connection, file_ids):
+        """Quita todas las etiquetas de varios archivos y descuenta cuántos de ellos llevaba cada una"""
+        tags_table = cls.__table__
+        linked = db.select(db.func.count()).where(
+            file_tags.c.tag_id == tags_table.c.id, file_tags.c.file_id.in_(file_ids)
+        ).scalar_subquery()
+        connection.execute(tags_table.update().where(tags_table.c.id.in_(
+            db.select(file_tags.c.tag_id).where(file_tags.c.file_id.in_(file_ids))
+        )).values(file_count=tags_table.c.file_count - linked))
+        connection.execute(file_tags.delete().where(file_tags.c.file_id.in_(file_ids)))
+
+    @classmethod
+    def rebuild(cls, connection=None, batch_size=1000):
+        """Reconstruye tags y file_tags desde dc_subject (backfill)
+
+        Devuelve (archivos etiquetados, etiquetas distintas).
+        """
+        connection = connection or db.session.connection()
+        files = File.__table__.c
+        tags_table = cls.__table__
+        connection.execute(file_tags.delete())
+        connection.execute(tags_table.delete())
+
+        labels, counts, links = {}, {}, []
+        for file_id, dc_subject in connection.execute(
+            db.select(files.id, files.dc_subject).where(files.dc_subject.isnot(None)).order_by(files.id)
+        ):
+            tags = parse_tags(dc_subject)
+            for name, label in tags.items():
+                labels.setdefault(name, label)
+                counts[name] = counts.get(name, 0) + 1
+                links.append((file_id, name))
+
+        if not labels:
+            return 0, 0
+        names = list(labels)
+        for start in range(0, len(names), batch_size):
+            connection.execute(tags_table.insert(), [
+                {'name': name, 'label': labels[name], 'file_count': counts[name]}
+                for name in names[start:start + batch_size]
+            ])
+        tag_ids = dict(connection.execute(db.select(tags_table.c.name, tags_table.c.id)).all())
+        for start in range(0, len(links), batch_size):
+            connection.execute(file_tags.insert(), [
+                {'file_id': file_id, 'tag_id': tag_ids[name]}
+                for file_id, name in links[start:start + batch_size]
+            ])
+        return len({file_id for file_id, _ in links}), len(names)
+
+
+# Formatos con extracción de texto (ver extraction.py)
+TEXT_EXTRACTABLE = ('txt', 'csv', 'pdf', 'docx', 'odt', 'xlsx')
+
+FTS_TABLE = 'file_text_fts'
+_fts_ready = set()  # URLs de motores con el índice FTS ya comprobado
+
+
+class FileText(db.Model):
+    """Texto extraído del contenido de un archivo, comprimido con zlib"""
+
+    __tablename__ = 'file_texts'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    status = db.Column(db.String(12), nullable=False, index=True)  # done, empty, failed, unsupported
+    content = db.Column(db.LargeBinary, nullable=True)
+    chars = db.Column(db.Integer, nullable=False, default=0)
+    truncated = db.Column(db.Boolean, nullable=False, default=False)
+    error = db.Column(db.String(255), nullable=True)
+    extracted_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<FileText {self.file_id} {self.status}>'
+
+    @property
+    def text(self):
+        return zlib.decompress(self.content).decode('utf-8') if self.content else ''
+
+    @staticmethod
+    def fts_available(connection):
+        """True si existe el índice de texto completo: FTS5 en SQLite (migración 3)
+        o la columna body_tsv en PostgreSQL (migración 4)"""
+        if connection.dialect.name == 'postgresql':
+            return 'content' in pg_search_features(connection)
+        if connection.dialect.name != 'sqlite':
+            return False
+        key = str(connection.engine.url)
+        if key not in _fts_ready:
+            found = connection.execute(db.text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+            ), {'name': FTS_TABLE}).first() is not None
+            if not found:
+                return False
+            _fts_ready.add(key)
+        return True
+
+    @classmethod
+    def store(cls, connection, file_id, status, text='', truncated=False, error=None):
+        """Guarda (o reemplaza) el resultado de una extracción y actualiza el índice FTS"""
+        cls.remove(connection, file_id)
+        connection.execute(cls.__table__.insert().values(
+            file_id=file_id,
+            status=status,
+            content=zlib.compress(text.encode('utf-8'), 6) if text else None,
+            chars=len(text),
+            truncated=truncated,
+            error=(error or '')[:255] or None,
+            extracted_at=datetime.utcnow(),
+        ))
+        if not text or not cls.fts_available(connection):
+            return
+        if connection.dialect.name == 'postgresql':
+            # Sin posiciones (strip): solo se filtra, no se ordena por relevancia
+            connection.execute(db.text(
+                "UPDATE file_texts SET body_tsv = strip(to_tsvector('simple', metadatos_search_text(:body))) "
+                "WHERE file_id = :file_id"
+            ), {'file_id': file_id, 'body': text})
+        else:
+            connection.execute(db.text(
+                f'INSERT INTO {FTS_TABLE} (rowid, body) VALUES (:rowid, :body)'
+            ), {'rowid': file_id, 'body': text})
+
+    @classmethod
+    def remove(cls, connection, file_id):
+        """Elimina el texto de un archivo y su entrada FTS (un índice sin contenido
+        necesita el texto original para borrar sus términos)"""
+        cls.remove_many(connection, [file_id])
+
+    @classmethod
+    def remove_many(cls, connection, file_ids):
+        """Elimina el texto de varios archivos con un DELETE ... RETURNING y sus entradas FTS"""
+        table = cls.__table__
+        if connection.dialect.name != 'sqlite':
+            # body_tsv vive en la propia fila
+            connection.execute(table.delete().where(table.c.file_id.in_(file_ids)))
+            return
+        removed = connection.execute(
+            table.delete().where(table.c.file_id.in_(file_ids)).returning(table.c.file_id, table.c.content)
+        ).all()
+        entries = [{'rowid': file_id, 'body': zlib.decompress(content).decode('utf-8')}
+                   for file_id, content in removed if content]
+        if entries and cls.fts_available(connection):
+            connection.execute(db.text(
+                f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, body) VALUES ('delete', :rowid, :body)"
+            ), entries)
+
+    @staticmethod
+    def match_query(search):
+        """Consulta FTS5 segura: cada palabra entre comillas (AND implícito)"""
+        words = re.findall(r'\w+', search or '')[:10]
+        return ' '.join(f'"{word}"' for word in words)
+
+    @classmethod
+    def matching_file_ids(cls, search):
+        """Subconsulta de IDs cuyo contenido coincide con la búsqueda, o None sin FTS"""
+        connection = db.session.connection()
+        if connection.dialect.name == 'postgresql':
+            query = search_tsquery(search)
+            if not query or not cls.fts_available(connection):
+                return None
+            return db.text(
+                "SELECT file_id AS rowid FROM file_texts "
+                "WHERE body_tsv @@ to_tsquery('simple', metadatos_search_text(:ts_query))"
+            ).bindparams(ts_query=query).columns(rowid=db.Integer)
+        query = cls.match_query(search)
+        if not query or not cls.fts_available(connection):
+            return None
+        return db.text(
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query'
+        ).bindparams(fts_query=query).columns(rowid=db.Integer)
+
+    @classmethod
+    def pending_query(cls):
+        """Archivos de formato soportado que aún no tienen texto extraído"""
+        return db.select(File.id, File.filename, File.extension).where(
+            File.extension.in_(TEXT_EXTRACTABLE),
+            ~db.exists().where(cls.file_id == File.id)
+        ).order_by(File.id)
+
+    @classmethod
+    def backlog(cls):
+        return db.session.execute(db.select(db.func.count()).select_from(cls.pending_query().subquery())).scalar()
+
+
+# Formatos con hash perceptual (ver image_similarity.py)
+IMAGE_HASHABLE = ('jpg', 'jpeg', 'png', 'gif', 'bmp', 'webp')
+
+_UINT64 = 1 << 64
+
+
+class ImageHash(db.Model):
+    """Hashes perceptuales de 64 bits de una imagen (aHash, dHash, pHash)
+
+    Se guardan como enteros con signo porque INTEGER de SQLite y BIGINT de
+    PostgreSQL son de 64 bits con signo.
+    """
+
+    __tablename__ = 'image_hashes'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    ahash = db.Column(db.BigInteger, nullable=False)
+    dhash = db.Column(db.BigInteger, nullable=False)
+    phash = db.Column(db.BigInteger, nullable=False)
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<ImageHash {self.file_id} {self.phash & (_UINT64 - 1):016x}>'
+
+    @staticmethod
+    def to_signed(value):
+        return value - _UINT64 if value >= _UINT64 >> 1 else value
+
+    @staticmethod
+    def to_unsigned(value):
+        return value % _UINT64
+
+    @classmethod
+    def store(cls, connection, file_id, ahash, dhash, phash):
+        """Guarda (o reemplaza) los hashes sin signo de un archivo"""
+        values = {'ahash': cls.to_signed(ahash), 'dhash': cls.to_signed(dhash), 'phash': cls.to_signed(phash),
+                  'computed_at': datetime.utcnow()}
+        insert = dialect_insert(connection, cls.__table__).values(file_id=file_id, **values)
+        connection.execute(insert.on_conflict_do_update(index_elements=['file_id'], set_=values))
+
+    @classmethod
+    def store_many(cls, connection, rows):
+        """Guarda los hashes [(file_id, ahash, dhash, phash)] de archivos nuevos con una inserción múltiple"""
+        if not rows:
+            return
+        now = datetime.utcnow()
+        connection.execute(cls.__table__.insert(), [
+            {'file_id': file_id, 'ahash': cls.to_signed(ahash), 'dhash': cls.to_signed(dhash),
+             'phash': cls.to_signed(phash), 'computed_at': now}
+            for file_id, ahash, dhash, phash in rows
+        ])
+
+    @classmethod
+    def remove(cls, connection, file_id):
+        cls.remove_many(connection, [file_id])
+
+    @classmethod
+    def remove_many(cls, connection, file_ids):
+        connection.execute(cls.__table__.delete().where(cls.__table__.c.file_id.in_(file_ids)))
+
+    @classmethod
+    def rows(cls, file_ids=None):
+        """[(file_id, ahash, dhash, phash)] sin signo, de todos o de los archivos indicados"""
+        query = db.session.query(cls.file_id, cls.ahash, cls.dhash, cls.phash)
+        if file_ids is not None:
+            query = query.filter(cls.file_id.in_(file_ids))
+        return [(file_id, cls.to_unsigned(a), cls.to_unsigned(d), cls.to_unsigned(p)) for file_id, a, d, p in query]
+
+    @classmethod
+    def pending_query(cls):
+        """Imágenes que aún no tienen hashes"""
+        return db.select(File.id, File.filename).where(
+            File.extension.in_(IMAGE_HASHABLE),
+            ~db.exists().where(cls.file_id == File.id)
+        ).order_by(File.id)
+
+
+minhash_buckets = db.Table(
+    'minhash_buckets',
+    db.Column('source', db.String(4), primary_key=True),  # text o meta
+    db.Column('band', db.SmallInteger, primary_key=True),
+    db.Column('bucket', db.BigInteger, primary_key=True),
+    db.Column('file_id', db.Integer, primary_key=True),
+    db.Index('ix_minhash_buckets_file', 'file_id'),
+)
+
+
+class DocumentSignature(db.Model):
+    """Firma MinHash de un archivo a partir de su texto o de su título y descripción
+
+    Cada archivo tiene una firma 'meta' desde la subida y, cuando se extrae
+    su contenido, otra 'text'. Las bandas de la firma se guardan en
+    minhash_buckets para encontrar candidatos con búsquedas por índice.
+    """
+
+    __tablename__ = 'document_signatures'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    source = db.Column(db.String(4), primary_key=True)
+    signature = db.Column(db.LargeBinary, nullable=False)  # uint32 little-endian
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<DocumentSignature {self.file_id} {self.source}>'
+
+    @classmethod
+    def store(cls, connection, file_id, source, signature, buckets, replace=True):
+        """Guarda la firma y sus cubetas [(banda, cubeta)]; replace=False para archivos nuevos"""
+        if replace:
+            cls.remove(connection, file_id, source)
+        connection.execute(cls.__table__.insert().values(
+            file_id=file_id, source=source, signature=signature, computed_at=datetime.utcnow()
+        ))
+        connection.execute(minhash_buckets.insert(), [
+            {'source': source, 'band': band, 'bucket': bucket, 'file_id': file_id} for band, bucket in buckets
+        ])
+
+    @classmethod
+    def store_many(cls, connection, source, rows):
+        """Guarda las firmas [(file_id, firma, cubetas)] de archivos nuevos: dos sentencias por lote"""
+        if not rows:
+            return
+        now = datetime.utcnow()
+        connection.execute(cls.__table__.insert(), [
+            {'file_id': file_id, 'source': source, 'signature': signature, 'computed_at': now}
+            for file_id, signature, _ in rows
+        ])
+        connection.execute(minhash_buckets.insert(), [
+            {'source': source, 'band': band, 'bucket': bucket, 'file_id': file_id}
+            for file_id, _, buckets in rows for band, bucket in buckets
+        ])
+
+    @classmethod
+    def remove(cls, connection, file_id, source=None):
+        cls.remove_many(connection, [file_id], source)
+
+    @classmethod
+    def remove_many(cls, connection, file_ids, source=None):
+        table = cls.__table__
+        signatures = table.delete().where(table.c.file_id.in_(file_ids))
+        buckets = minhash_buckets.delete().where(minhash_buckets.c.file_id.in_(file_ids))
+        if source is not None:
+            signatures = signatures.where(table.c.source == source)
+            buckets = buckets.where(minhash_buckets.c.source == source)
+        connection.execute(signatures)
+        connection.execute(buckets)
+
+    @classmethod
+    def candidates(cls, source, buckets, exclude=None):
+        """[(file_id, firma, título)] que comparten alguna cubeta, en una consulta por índice"""
+        table = cls.__table__
+        sharing = db.select(minhash_buckets.c.file_id).where(
+            minhash_buckets.c.source == source,
+            db.tuple_(minhash_buckets.c.band, minhash_buckets.c.bucket).in_(buckets)
+        )
+        query = db.select(table.c.file_id, table.c.signature, File.title).join(
+            File, File.id == table.c.file_id
+        ).where(table.c.source == source, table.c.file_id.in_(sharing))
+        if exclude is not None:
+            query = query.where(table.c.file_id != exclude)
+        return db.session.execute(query).all()
+
+    @classmethod
+    def colliding_pairs(cls, source):
+        """Pares con a < b que comparten al menos una cubeta, con sus firmas, títulos y fechas"""
+        first, second = minhash_buckets.alias('first'), minhash_buckets.alias('second')
+        pairs = db.select(first.c.file_id.label('first_id'), second.c.file_id.label('second_id')).distinct().where(
+            first.c.source == source,
+            second.c.source == first.c.source,
+            second.c.band == first.c.band,
+            second.c.bucket == first.c.bucket,
+            second.c.file_id > first.c.file_id,
+        ).subquery()
+        first_signature, second_signature = cls.__table__.alias(), cls.__table__.alias()
+        first_file, second_file = File.__table__.alias(), File.__table__.alias()
+        return db.session.execute(db.select(
+            pairs.c.first_id, pairs.c.second_id, first_signature.c.signature, second_signature.c.signature,
+            first_file.c.title, second_file.c.title, first_file.c.upload_date, second_file.c.upload_date,
+        ).select_from(pairs)
+            .join(first_signature, db.and_(first_signature.c.file_id == pairs.c.first_id,
+                                           first_signature.c.source == source))
+            .join(second_signature, db.and_(second_signature.c.file_id == pairs.c.second_id,
+                                            second_signature.c.source == source))
+            .join(first_file, first_file.c.id == pairs.c.first_id)
+            .join(second_file, second_file.c.id == pairs.c.second_id)).all()
+
+
+class FileVector(db.Model):
+    """Vector de términos (hash del término -> frecuencia) de un archivo para TF-IDF"""
+
+    __tablename__ = 'file_vectors'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    terms = db.Column(db.LargeBinary, nullable=False)  # índices uint32 + frecuencias float32
+    computed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @classmethod
+    def pending_query(cls):
+        """Archivos sin vector o modificados (o con texto extraído) después de calcularlo"""
+        return db.select(File.id).outerjoin(cls, cls.file_id == File.id).outerjoin(
+            FileText, FileText.file_id == File.id
+        ).where(db.or_(
+            cls.file_id.is_(None),
+            cls.computed_at < File.updated_at,
+            cls.computed_at < FileText.extracted_at,
+        )).order_by(File.id)
+
+
+class RelatedFile(db.Model):
+    """Vecinos más parecidos de cada archivo, precalculados (ver related.py)"""
+
+    __tablename__ = 'related_files'
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    rank = db.Column(db.SmallInteger, primary_key=True)
+    related_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), nullable=False)
+    score = db.Column(db.Float, nullable=False)
+
+    @classmethod
+    def for_file(cls, file_id):
+        """Archivos relacionados en orden: una búsqueda por la clave primaria"""
+        return db.session.query(File.id, File.title, File.extension, cls.score).join(
+            cls, cls.related_id == File.id
+        ).filter(cls.file_id == file_id).order_by(cls.rank).all()
+
+
+class FileStats(db.Model):
+    """Vistas y descargas acumuladas de cada archivo (ver usage.py)
+
+    Solo tienen fila los archivos vistos o descargados alguna vez. El
+    índice (downloads, file_id) sirve el orden "más descargados" sin
+    ordenar la tabla.
+    """
+
+    __tablename__ = 'file_stats'
+    __table_args__ = (db.Index('ix_file_stats_downloads', 'downloads', 'file_id'),)
+
+    file_id = db.Column(db.Integer, db.ForeignKey('files.id', ondelete='CASCADE'), primary_key=True)
+    views = db.Column(db.Integer, nullable=False, default=0)
+    downloads = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    @classmethod
+    def add_many(cls, connection, counts):
+        """Suma {file_id o filename: (vistas, descargas)} con un upsert (executemany) por tipo de clave
+
+        Las filas se resuelven dentro del INSERT ... SELECT, por files.id o,
+        para las descargas que solo traen el nombre, por files.filename: los
+        archivos ya borrados se ignoran.
+        """
+        stats, files = cls.__table__, File.__table__
+        now = datetime.utcnow()
+        for column, keys in ((files.c.id, [key for key in counts if isinstance(key, int)]),
+                             (files.c.filename, [key for key in counts if not isinstance(key, int)])):
+            if not keys:
+                continue
+            source = db.select(
+                files.c.id,
+                db.cast(db.bindparam('views'), db.Integer),
+                db.cast(db.bindparam('downloads'), db.Integer),
+                db.bindparam('now', type_=db.DateTime),
+            ).where(column == db.bindparam('key'))
+            insert = dialect_insert(connection, stats).from_select(['file_id', 'views', 'downloads', 'updated_at'],
+                                                                   source)
+            insert = insert.on_conflict_do_update(index_elements=['file_id'], set_={
+                'views': stats.c.views + insert.excluded.views,
+                'downloads': stats.c.downloads + insert.excluded.downloads,
+                'updated_at': insert.excluded.updated_at,
+            })
+            connection.execute(insert, [
+                {'key': key, 'views': counts[key][0], 'downloads': counts[key][1], 'now': now} for key in keys
+            ])
+
+    @classmethod
+    def remove_many(cls, connection, file_ids):
+        connection.execute(cls.__table__.delete().where(cls.__table__.c.file_id.in_(file_ids)))
+
+
+class CatalogChange(db.Model):
+    """Registro de cambios del catálogo; el id más alto es la versión del catálogo"""
+
+    __tablename__ = 'catalog_changes'
+
+    id = db.Column(db.Integer, primary_key=True)
+    action = db.Column(db.String(10), nullable=False)  # insert, update, delete, bulk, related
+    file_id = db.Column(db.Integer, nullable=True, index=True)  # Sin FK: sobrevive al borrado
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    # Vecinos recalculados (related.py): solo cambian la ficha de ese archivo, así que los
+    # índices, los sitemaps y los eventos no los leen
+    NEIGHBOURS = 'related'
+
+    @classmethod
+    def record(cls, connection, action, file_id=None):
+        """Anota un cambio en la conexión de la transacción en curso"""
+        connection.execute(cls.__table__.insert().values(
+            action=action, file_id=file_id, created_at=datetime.utcnow()
+        ))
+
+    @classmethod
+    def record_many(cls, connection, action, file_ids):
+        """Anota el mismo cambio para varios archivos con una inserción múltiple"""
+        if not file_ids:
+            return
+        now = datetime.utcnow()
+        connection.execute(cls.__table__.insert(), [
+            {'action': action, 'file_id': file_id, 'created_at': now} for file_id in file_ids
+        ])
+
+    @classmethod
+    def version(cls):
+        """Versión actual del catálogo (0 si nunca cambió)"""
+        return db.session.query(db.func.max(cls.id)).scalar() or 0
+
+    @classmethod
+    def since(cls, version):
+        """Cambios del catálogo posteriores a `version` en orden: [(id, action, file_id)]
+
+        Sin los de vecinos (NEIGHBOURS).
+        """
+        return db.session.query(cls.id, cls.action, cls.file_id).filter(
+            cls.id > version, cls.action != cls.NEIGHBOURS
+        ).order_by(cls.id).all()
+
+
+def record_catalog_change(action, file_id=None):
+    """Anota un cambio masivo (cargas o backfills que no pasan por el ORM)"""
+    CatalogChange.record(db.session.connection(), action, file_id)
+
+
+@event.listens_for(File, 'after_insert')
+def _count_inserted(mapper, connection, target):
+    FacetCount.apply(connection, facet_values(target.category, target.dc_language, target.upload_year), 1)
+    Tag.attach(connection, target.id, parse_tags(target.dc_subject))
+    CatalogChange.record(connection, 'insert', target.id)
+
+
+@event.listens_for(File, 'before_delete')
+def _detach_tags(mapper, connection, target):
+    # Antes del DELETE: con claves foráneas activas (PostgreSQL) el ON DELETE
+    # CASCADE ya habría borrado los enlaces sin descontar tags.file_count
+    if target.dc_subject:
+        Tag.detach(connection, target.id)
+
+
+@event.listens_for(File, 'after_delete')
+def _count_deleted(mapper, connection, target):
+    FacetCount.apply(connection, facet_values(target.category, target.dc_language, target.upload_year), -1)
+    if target.extension in TEXT_EXTRACTABLE:
+        FileText.remove(connection, target.id)
+    elif target.extension in IMAGE_HASHABLE:
+        ImageHash.remove(connection, target.id)
+    DocumentSignature.remove(connection, target.id)
+    FileStats.remove_many(connection, [target.id])
+    CatalogChange.record(connection, 'delete', target.id)
+
+
+@event.listens_for(File, 'after_update')
+def _count_updated(mapper, connection, target):
+    tracked = ('category', 'dc_language', 'upload_year')
+    histories = {name: get_history(target, name) for name in tracked + ('dc_subject',)}
+
+    def old(name):
+        history = histories[name]
+        return history.deleted[0] if history.deleted else getattr(target, name)
+
+    if any(histories[name].has_changes() for name in tracked):
+        FacetCount.apply(connection, facet_values(*(old(name) for name in tracked)), -1)
+        FacetCount.apply(connection, facet_values(*(getattr(target, name) for name in tracked)), 1)
+
+    if histories['dc_subject'].has_changes():
+        before, after = parse_tags(old('dc_subject')), parse_tags(target.dc_subject)
+        Tag.detach(connection, target.id, [name for name in before if name not in after])
+        Tag.attach(connection, target.id, {name: label for name, label in after.items() if name not in before})
+
+    CatalogChange.record(connection, 'update', target.id)
+
+class MaintenanceRun(db.Model):
+    """Última ejecución de cada tarea de mantenimiento programada (p. ej. gc-uploads)"""
+
+    __tablename__ = 'maintenance_runs'
+
+    task = db.Column(db.String(50), primary_key=True)
+    finished_at = db.Column(db.DateTime, nullable=False)
+    summary = db.Column(db.Text, nullable=True)  # JSON con las cifras del informe
+
+    @classmethod
+    def record(cls, task, summary=None):
+        """Anota (o reemplaza) la ejecución de `task`; el llamador hace commit"""
+        connection = db.session.connection()
+        values = {'finished_at': datetime.utcnow(), 'summary': json.dumps(summary) if summary is not None else None}
+        insert = dialect_insert(connection, cls.__table__).values(task=task, **values)
+        connection.execute(insert.on_conflict_do_update(index_elements=['task'], set_=values))
+
+    @classmethod
+    def last(cls, task):
+        """(finished_at, resumen) de la última ejecución, o None"""
+        row = db.session.execute(db.select(cls.finished_at, cls.summary).where(cls.task == task)).first()
+        if row is None:
+            return None
+        return row.finished_at, json.loads(row.summary) if row.summary else {}
+
+
 class ActivityLog(db.Model):
     """Modelo para registrar actividades de administración"""
 
@@ -216,6 +1272,8 @@ def init_db(app):
             # Crear todas las tablas solo si no existen
             try:
                 db.create_all()
+                from migrations import run_migrations
+                run_migrations(db)
                 print("✅ Base de datos inicializada correctamente")
             except Exception as e:
                 if "already exists" in str(e).lower():
@@ -235,6 +1293,11 @@ def init_db(app):
                 print(f"⚠️ Error verificando conexión a BD: {type(e).__name__}")
                 raise
 
+            if not db_url.startswith('sqlite'):
+                # Sin conexiones abiertas antes del fork de los workers (gunicorn --preload)
+                db.session.remove()
+                db.engine.dispose()
+
         except Exception as e:
             print(f"❌ Error inicializando base de datos: {type(e).__name__}")
             print(f"❌ DATABASE_URI: {app.config.get('SQLALCHEMY_DATABASE_URI')}")
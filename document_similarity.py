@@ -0,0 +1,265 @@
+"""
+Documentos casi duplicados con MinHash y LSH por bandas
+
+Cada documento se reduce a un conjunto de shingles (n-gramas de palabras
+normalizadas) y a una firma MinHash de NUM_PERMUTATIONS enteros: la
+fracción de posiciones iguales entre dos firmas estima la similitud de
+Jaccard de sus conjuntos. Las permutaciones se aplican con NumPy a bloques
+de shingles a la vez.
+
+La firma se divide en BANDS bandas de ROWS_PER_BAND valores y cada banda se
+resume en una cubeta de 64 bits guardada en minhash_buckets. Dos documentos
+con similitud s comparten alguna cubeta con probabilidad 1 - (1 - s^r)^b,
+que con 16 bandas de 8 filas sube bruscamente en torno a 0,7. Buscar
+duplicados es una consulta por índice sobre las cubetas de la firma y una
+comparación exacta de las firmas candidatas: el coste no depende del tamaño
+del catálogo.
+
+Hay dos fuentes de firma por archivo: 'meta' (título y descripción, se
+calcula al subir) y 'text' (contenido extraído, se calcula al terminar la
+extracción). Solo se comparan firmas de la misma fuente.
+
+NumPy es opcional: sin él no se calculan firmas.
+"""
+
+import hashlib
+import os
+import re
+import unicodedata
+import zlib
+
+from database import DocumentSignature, File, FileText, db
+
+try:
+    import numpy as np
+except ImportError:  # Dependencia opcional
+    np = None
+
+NUM_PERMUTATIONS = 128
+BANDS = 16
+ROWS_PER_BAND = NUM_PERMUTATIONS // BANDS
+SHINGLE_SIZE = {'text': 3, 'meta': 2}
+MIN_SHINGLES = 3
+HASH_CHUNK = 4096  # Shingles por bloque: acota la matriz shingles x permutaciones
+
+SOURCE_LABELS = {'text': 'Contenido', 'meta': 'Título y descripción'}
+
+_MAX_UINT32 = (1 << 32) - 1
+_PRIME = (1 << 32) + 15  # Primo mayor que 2^32: (a*x + b) cabe en uint64 con a, b, x < 2^32
+_permutations = None
+
+
+def hashing_available():
+    return np is not None
+
+
+def _coefficients():
+    global _permutations
+    if _permutations is None:
+        # Semilla fija: las firmas guardadas deben seguir siendo comparables
+        rng = np.random.default_rng(20240611)
+        _permutations = (rng.integers(1, _MAX_UINT32, NUM_PERMUTATIONS, dtype=np.uint64),
+                         rng.integers(0, _MAX_UINT32, NUM_PERMUTATIONS, dtype=np.uint64))
+    return _permutations
+
+
+def shingles(text, size):
+    """Conjunto de n-gramas de palabras (minúsculas, sin tildes) como enteros de 32 bits"""
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    words = re.findall(r'\w+', ''.join(char for char in text if not unicodedata.combining(char)))
+    if len(words) < size:
+        return set()
+    return {zlib.crc32(' '.join(words[start:start + size]).encode('utf-8'))
+            for start in range(len(words) - size + 1)}
+
+
+def minhash(values):
+    """Firma MinHash (uint32[NUM_PERMUTATIONS]) de un conjunto de enteros de 32 bits"""
+    a, b = _coefficients()
+    values = np.fromiter(values, dtype=np.uint64, count=len(values))
+    signature = np.full(NUM_PERMUTATIONS, _MAX_UINT32, dtype=np.uint64)
+    for start in range(0, len(values), HASH_CHUNK):
+        block = values[start:start + HASH_CHUNK, None]
+        np.minimum(signature, ((block * a + b) % _PRIME).min(axis=0), out=signature)
+    return (signature & _MAX_UINT32).astype('<u4')
+
+
+def band_buckets(signature):
+    """[(banda, cubeta con signo de 64 bits)] de una firma"""
+    buckets = []
+    for band in range(BANDS):
+        chunk = signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()
+        digest = hashlib.blake2b(chunk, digest_size=8).digest()
+        buckets.append((band, int.from_bytes(digest, 'big', signed=True)))
+    return buckets
+
+
+def similarity(first, second):
+    """Jaccard estimada entre dos firmas (bytes o arrays)"""
+    if isinstance(first, bytes):
+        first = np.frombuffer(first, dtype='<u4')
+    if isinstance(second, bytes):
+        second = np.frombuffer(second, dtype='<u4')
+    return float(np.count_nonzero(first == second)) / NUM_PERMUTATIONS
+
+
+def signature_for(source, text):
+    """Firma de un texto, o None si es demasiado corto o falta NumPy"""
+    if np is None:
+        return None
+    values = shingles(text, SHINGLE_SIZE[source])
+    if len(values) < MIN_SHINGLES:
+        return None
+    return minhash(values)
+
+
+def meta_text(title, description):
+    return f'{title or ""} {description or ""}'
+
+
+class DocumentSimilarity:
+    """Índice LSH persistido de firmas MinHash"""
+
+    def __init__(self, enabled=True, threshold=0.7, limit=5):
+        self.enabled = enabled and hashing_available()
+        self.threshold = threshold
+        self.limit = limit
+
+    def index(self, connection, file_id, source, text, replace=True):
+        """Calcula y guarda la firma de un archivo; devuelve la firma (o None)
+
+        replace=False evita borrar una firma anterior cuando el archivo es nuevo.
+        """
+        if not self.enabled:
+            return None
+        signature = signature_for(source, text)
+        if signature is None:
+            if replace:
+                DocumentSignature.remove(connection, file_id, source)
+            return None
+        DocumentSignature.store(connection, file_id, source, signature.tobytes(), band_buckets(signature),
+                                replace=replace)
+        return signature
+
+    def index_many(self, connection, source, texts):
+        """Firmas de varios archivos nuevos {file_id: texto}, guardadas con inserciones múltiples"""
+        if not self.enabled:
+            return
+        rows = []
+        for file_id, text in texts.items():
+            signature = signature_for(source, text)
+            if signature is not None:
+                rows.append((file_id, signature.tobytes(), band_buckets(signature)))
+        DocumentSignature.store_many(connection, source, rows)
+
+    def near(self, source, signature, exclude=None, limit=None):
+        """[(similitud, file_id, título)] de los archivos casi duplicados, de más a menos parecido"""
+        if not self.enabled or signature is None:
+            return []
+        matches = []
+        for file_id, stored, title in DocumentSignature.candidates(source, band_buckets(signature), exclude=exclude):
+            score = similarity(signature, stored)
+            if score >= self.threshold:
+                matches.append((score, file_id, title))
+        return sorted(matches, key=lambda match: (-match[0], match[1]))[:limit or self.limit]
+
+    def clusters(self, source):
+        """Grupos de archivos casi duplicados: [(similitud mínima, [{id, title, upload_date}])]
+
+        Solo se comparan los pares que comparten cubeta, y los pares que
+        superan el umbral se unen con union-find.
+        """
+        if not self.enabled:
+            return []
+        parent, lowest, files = {}, {}, {}
+
+        def root(node):
+            parent.setdefault(node, node)
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        for first, second, first_signature, second_signature, *details in DocumentSignature.colliding_pairs(source):
+            score = similarity(first_signature, second_signature)
+            if score < self.threshold:
+                continue
+            first_title, second_title, first_date, second_date = details
+            files[first] = {'id': first, 'title': first_title, 'upload_date': first_date}
+            files[second] = {'id': second, 'title': second_title, 'upload_date': second_date}
+            first_root, second_root = root(first), root(second)
+            merged = min(lowest.pop(first_root, 1.0), lowest.pop(second_root, 1.0), score)
+            if first_root != second_root:
+                parent[second_root] = first_root
+            lowest[first_root] = merged
+
+        groups = {}
+        for node in parent:
+            groups.setdefault(root(node), []).append(files[node])
+        return sorted(((lowest.get(head, 1.0), sorted(members, key=lambda file: file['id']))
+                       for head, members in groups.items()),
+                      key=lambda group: (-len(group[1]), group[0]))
+
+
+def run_signature_backfill(app, batch_size=500, progress=None):
+    """Calcula las firmas 'meta' y 'text' que faltan en todo el catálogo
+
+    Devuelve (firmas de metadatos, firmas de contenido).
+    """
+    if np is None:
+        raise RuntimeError('NumPy no está instalado')
+    similarity_index = app.extensions['metadatos_documents']
+    meta_count = text_count = 0
+
+    with app.app_context():
+        signed = DocumentSignature.__table__.c
+
+        def missing(source):
+            return ~db.exists().where(signed.file_id == File.id, signed.source == source)
+
+        total = db.session.query(db.func.count(File.id)).scalar()
+        last_id = processed = 0
+        while True:
+            # Paginación por clave; el texto comprimido solo se lee si falta su firma
+            rows = db.session.execute(
+                db.select(File.id, File.title, File.description, missing('meta').label('needs_meta'),
+                          (missing('text') & db.exists().where(FileText.file_id == File.id,
+                                                               FileText.content.isnot(None))).label('needs_text'))
+                .where(File.id > last_id).order_by(File.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            connection = db.session.connection()
+            texts = {}
+            pending_text = [row.id for row in rows if row.needs_text]
+            if pending_text:
+                texts = dict(db.session.query(FileText.file_id, FileText.content)
+                             .filter(FileText.file_id.in_(pending_text)))
+            for row in rows:
+                if row.needs_meta and similarity_index.index(connection, row.id, 'meta', meta_text(row.title, row.description),
+                                                              replace=False) is not None:
+                    meta_count += 1
+                if row.id in texts and similarity_index.index(
+                        connection, row.id, 'text', zlib.decompress(texts[row.id]).decode('utf-8')) is not None:
+                    text_count += 1
+            db.session.commit()
+            processed += len(rows)
+            if progress:
+                progress(processed, total)
+    return meta_count, text_count
+
+
+def init_document_similarity(app):
+    """Registra la detección de documentos casi duplicados con configuración por defecto"""
+    app.config.setdefault('DOC_SIMILARITY_ENABLED', os.environ.get('DOC_SIMILARITY_ENABLED', 'true').lower() == 'true')
+    app.config.setdefault('DOC_SIMILARITY_THRESHOLD', float(os.environ.get('DOC_SIMILARITY_THRESHOLD', 0.7)))
+    app.config.setdefault('DOC_SIMILARITY_LIMIT', int(os.environ.get('DOC_SIMILARITY_LIMIT', 5)))
+
+    documents = DocumentSimilarity(
+        enabled=app.config['DOC_SIMILARITY_ENABLED'],
+        threshold=app.config['DOC_SIMILARITY_THRESHOLD'],
+        limit=app.config['DOC_SIMILARITY_LIMIT'],
+    )
+    app.extensions['metadatos_documents'] = documents
+    return documents
@@ -0,0 +1,253 @@
+"""
+Metadatos embebidos en los archivos para proponer campos Dublin Core
+
+Lee autor, idioma y derechos de:
+- imágenes: EXIF (Artist, Copyright) y XMP (dc:creator, dc:rights,
+  dc:language) con Pillow, que en Image.open solo analiza la cabecera;
+  nunca se llama a load(), así que los píxeles no se decodifican.
+- OOXML (docx/xlsx/pptx): docProps/core.xml.
+- ODF (odt/ods/odp): meta.xml.
+
+Para los formatos ZIP solo se lee el directorio central y un único miembro
+XML pequeño (acotado a MAX_XML_BYTES), sin descomprimir el documento. Es lo
+bastante barato para ejecutarse en cada subida y en backfills masivos; con
+S3 el backfill lee esos tramos con GET por rangos (storage.reader) en lugar
+de descargar los objetos.
+"""
+
+import logging
+import zipfile
+from xml.etree import ElementTree
+
+import bleach
+from sqlalchemy import bindparam, select, update
+
+from database import (DEFAULT_CREATOR, DEFAULT_RIGHTS, LANGUAGE_LABELS, FacetCount, File, db,
+                      record_catalog_change)
+
+logger = logging.getLogger(__name__)
+
+MAX_XML_BYTES = 256 * 1024
+
+DC_NS = '{http://purl.org/dc/elements/1.1/}'
+RDF_NS = '{http://www.w3.org/1999/02/22-rdf-syntax-ns#}'
+META_NS = '{urn:oasis:names:tc:opendocument:xmlns:meta:1.0}'
+
+EXIF_ARTIST = 0x013B
+EXIF_COPYRIGHT = 0x8298
+
+IMAGE_EXTENSIONS = ('jpg', 'jpeg', 'png', 'gif', 'webp', 'bmp')
+OOXML_EXTENSIONS = ('docx', 'xlsx', 'pptx')
+ODF_EXTENSIONS = ('odt', 'ods', 'odp')
+
+FIELD_LIMITS = {'creator': 255, 'rights': 500, 'language': 10}
+
+
+def _clean(value, limit):
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', 'replace')
+    # Texto ajeno: sin HTML, igual que las entradas del formulario
+    value = bleach.clean(str(value or '').replace('\x00', ' '), tags=[], attributes={}, strip=True)
+    return ' '.join(value.split())[:limit] or None
+
+
+XMP_APP1_HEADER = b'http://ns.adobe.com/xap/1.0/\x00'
+
+
+def _first_text(root, path):
+    element = root.find(path)
+    return ''.join(element.itertext()) if element is not None else None
+
+
+def _parse_xml(data):
+    if not data or len(data) > MAX_XML_BYTES:
+        return None
+    try:
+        return ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        return None
+
+
+def _from_xmp(data):
+    root = _parse_xml(data.encode('utf-8') if isinstance(data, str) else data)
+    if root is None:
+        return {}
+    return {
+        'creator': _first_text(root, f'.//{DC_NS}creator//{RDF_NS}li'),
+        'rights': _first_text(root, f'.//{DC_NS}rights//{RDF_NS}li'),
+        'language': _first_text(root, f'.//{DC_NS}language//{RDF_NS}li'),
+    }
+
+
+def _jpeg_xmp(image):
+    # Pillow < 11 no expone el XMP de JPEG en info: está en el segmento APP1
+    for marker, payload in getattr(image, 'applist', ()):
+        if marker == 'APP1' and payload.startswith(XMP_APP1_HEADER):
+            return payload[len(XMP_APP1_HEADER):]
+    return None
+
+
+def _from_image(path):
+    from PIL import Image
+
+    found = {}
+    # Image.open es perezoso: lee la cabecera y los segmentos previos a los píxeles
+    with Image.open(path) as image:
+        # En PNG, getexif() sin un eXIf antes de los píxeles decodifica la imagen entera para buscarlo
+        exif = {} if image.format == 'PNG' and 'exif' not in image.info else image.getexif()
+        found['creator'] = exif.get(EXIF_ARTIST)
+        found['rights'] = exif.get(EXIF_COPYRIGHT)
+        xmp = image.info.get('xmp') or image.info.get('XML:com.adobe.xmp') or _jpeg_xmp(image)
+        if xmp:
+            # XMP es más rico que EXIF (Unicode, varios idiomas): tiene prioridad
+            found.update({key: value for key, value in _from_xmp(xmp).items() if value})
+    return found
+
+
+def _read_member(path, member):
+    with zipfile.ZipFile(path) as archive:
+        try:
+            info = archive.getinfo(member)
+        except KeyError:
+            return None
+        if info.file_size > MAX_XML_BYTES:
+            return None
+        with archive.open(info) as stream:
+            return stream.read(MAX_XML_BYTES)
+
+
+def _from_ooxml(path):
+    root = _parse_xml(_read_member(path, 'docProps/core.xml'))
+    if root is None:
+        return {}
+    return {
+        'creator': _first_text(root, f'{DC_NS}creator'),
+        'rights': _first_text(root, f'{DC_NS}rights'),
+        'language': _first_text(root, f'{DC_NS}language'),
+    }
+
+
+def _from_odf(path):
+    root = _parse_xml(_read_member(path, 'meta.xml'))
+    if root is None:
+        return {}
+    return {
+        'creator': _first_text(root, f'.//{DC_NS}creator') or _first_text(root, f'.//{META_NS}initial-creator'),
+        'rights': _first_text(root, f'.//{DC_NS}rights'),
+        'language': _first_text(root, f'.//{DC_NS}language'),
+    }
+
+
+def normalize_language(value, known):
+    """'es-ES' -> 'es'; códigos fuera de `known` -> 'other'"""
+    if not value:
+        return None
+    code = value.strip().lower().replace('_', '-').split('-')[0]
+    if not code or code == 'x':
+        return None
+    return code if code in known else 'other'
+
+
+def read_embedded_metadata(path, extension, known_languages=tuple(LANGUAGE_LABELS)):
+    """Autor, idioma y derechos embebidos en un archivo: {'creator', 'language', 'rights'}
+
+    `path` puede ser una ruta o un archivo abierto con seek. Devuelve solo
+    las claves encontradas; ante cualquier error de formato devuelve {} (los
+    metadatos embebidos son una sugerencia, nunca bloquean).
+    """
+    extension = (extension or '').lower()
+    try:
+        if extension in IMAGE_EXTENSIONS:
+            found = _from_image(path)
+        elif extension in OOXML_EXTENSIONS:
+            found = _from_ooxml(path)
+        elif extension in ODF_EXTENSIONS:
+            found = _from_odf(path)
+        else:
+            return {}
+    except Exception as e:
+        logger.info(f'Metadatos embebidos ilegibles ({extension}): {type(e).__name__}')
+        return {}
+
+    result = {}
+    for key, limit in FIELD_LIMITS.items():
+        value = _clean(found.get(key), limit)
+        if key == 'language':
+            value = normalize_language(value, known_languages)
+        if value:
+            result[key] = value
+    return result
+
+
+SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS + OOXML_EXTENSIONS + ODF_EXTENSIONS
+
+
+def run_metadata_backfill(app, batch_size=500, include_language=False, progress=None):
+    """Completa dc_creator/dc_rights (y opcionalmente dc_language) de archivos ya subidos
+
+    Solo sustituye valores que siguen siendo los por defecto, así que no pisa
+    lo que el administrador escribió. El idioma por defecto ('es') no se
+    distingue de uno elegido a mano, por eso solo se toca con include_language.
+    Devuelve (archivos revisados, archivos actualizados).
+    """
+    files = File.__table__
+    statement = (update(files).where(files.c.id == bindparam('file_id'))
+                 .values(dc_creator=bindparam('creator'), dc_rights=bindparam('rights'),
+                         dc_language=bindparam('language')))
+    storage = app.extensions['metadatos_storage']
+    scanned = updated = 0
+    languages_changed = False
+    last_id = 0
+
+    with app.app_context():
+        connection = db.session.connection()
+        total = connection.scalar(select(db.func.count()).select_from(files)
+                                  .where(files.c.extension.in_(SUPPORTED_EXTENSIONS)))
+        while True:
+            # Paginación por clave: cada lote es un recorrido corto del índice de id
+            rows = connection.execute(
+                select(files.c.id, files.c.filename, files.c.extension, files.c.dc_creator,
+                       files.c.dc_rights, files.c.dc_language)
+                .where(files.c.id > last_id, files.c.extension.in_(SUPPORTED_EXTENSIONS))
+                .order_by(files.c.id).limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            changes = []
+            for row in rows:
+                creator, rights, language = row.dc_creator, row.dc_rights, row.dc_language
+                if creator not in (None, '', DEFAULT_CREATOR) and rights not in (None, '', DEFAULT_RIGHTS) \
+                        and not include_language:
+                    continue
+                try:
+                    # Solo la cabecera o el directorio central: con S3, unos pocos GET por rangos
+                    with storage.reader(row.filename) as source:
+                        found = read_embedded_metadata(source, row.extension)
+                except FileNotFoundError:
+                    found = {}
+                if found.get('creator') and creator in (None, '', DEFAULT_CREATOR):
+                    creator = found['creator']
+                if found.get('rights') and rights in (None, '', DEFAULT_RIGHTS):
+                    rights = found['rights']
+                if include_language and found.get('language') and found['language'] != language:
+                    language = found['language']
+                    languages_changed = True
+                if (creator, rights, language) != (row.dc_creator, row.dc_rights, row.dc_language):
+                    changes.append({'file_id': row.id, 'creator': creator, 'rights': rights, 'language': language})
+            scanned += len(rows)
+            if changes:
+                connection.execute(statement, changes)
+                updated += len(changes)
+            db.session.commit()
+            connection = db.session.connection()
+            if progress:
+                progress(scanned, total)
+
+        if updated:
+            # El UPDATE masivo no pasa por los eventos del ORM
+            if languages_changed:
+                FacetCount.rebuild()
+            record_catalog_change('bulk')
+            db.session.commit()
+    return scanned, updated
@@ -0,0 +1,232 @@
+"""
+Eventos del catálogo en tiempo real (Server-Sent Events)
+
+/events empuja a quioscos y paneles las subidas, los borrados y los cambios
+de metadatos, en lugar de que recarguen la portada cada pocos segundos.
+
+- Un único hilo difusor por proceso lee catalog_changes, el registro de
+  cambios que comparten todos los workers, cada EVENTS_POLL_SECONDS y solo
+  mientras haya suscriptores. Guarda en memoria los últimos EVENTS_BACKLOG
+  eventos ya serializados.
+- Todos los suscriptores esperan en la misma Condition: una conexión
+  inactiva no consulta la BD ni ocupa una conexión del pool, solo envía un
+  comentario de keepalive cada EVENTS_KEEPALIVE_SECONDS.
+- El id de cada evento es el de catalog_changes. Al reconectar, el
+  navegador envía Last-Event-ID y recibe lo que se perdió, de memoria o con
+  una consulta si es anterior. Si falta demasiado recibe `reload`.
+
+Con el worker gthread cada conexión abierta ocupa un hilo, así que /events
+lo sirve un gunicorn con worker gevent (servicio metadatos-events), donde un
+suscriptor es una greenlet, y las páginas lo enlazan con EVENTS_PUBLIC_URL.
+EVENTS_MAX_CLIENTS limita las conexiones por proceso con gevent; con hilos
+el límite es EVENTS_THREAD_MAX_CLIENTS, por debajo de los hilos del worker,
+para que unos pocos suscriptores no lo dejen sin hilos para las páginas.
+EVENTS_STREAM_SECONDS cierra las conexiones de vez en cuando; el navegador
+reconecta solo y sin perder eventos.
+"""
+
+import bisect
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+from database import CatalogChange, File, db
+
+logger = logging.getLogger(__name__)
+
+# Acción de catalog_changes -> nombre del evento
+EVENT_NAMES = {'insert': 'upload', 'update': 'update', 'delete': 'delete', 'bulk': 'reload'}
+
+
+def cooperative():
+    """True con el worker gevent (sockets parcheados): una conexión abierta es una greenlet"""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('socket')
+
+
+def format_event(event_id, name, data):
+    return f'id: {event_id}\nevent: {name}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n'
+
+
+def _changes(after, limit):
+    """[(id, action, file_id, title)] posteriores a `after`, a lo sumo `limit`"""
+    changes, files = CatalogChange.__table__, File.__table__
+    return db.session.execute(
+        db.select(changes.c.id, changes.c.action, changes.c.file_id, files.c.title)
+        .select_from(changes.outerjoin(files, files.c.id == changes.c.file_id))
+        .where(changes.c.id > after, changes.c.action != CatalogChange.NEIGHBOURS)
+        .order_by(changes.c.id).limit(limit)
+    ).all()
+
+
+class EventBroadcaster:
+    """Difusor de los cambios del catálogo a las conexiones SSE de un proceso"""
+
+    def __init__(self, app, poll_seconds=1.0, backlog=1000, keepalive_seconds=15.0, max_clients=500,
+                 thread_max_clients=1, stream_seconds=300.0, retry_ms=3000):
+        self.app = app
+        self.poll_seconds = poll_seconds
+        self.backlog = backlog
+        self.keepalive_seconds = keepalive_seconds
+        self.max_clients = max_clients
+        self.thread_max_clients = thread_max_clients
+        self.stream_seconds = stream_seconds
+        self.retry_ms = retry_ms
+        self.version = None  # Último cambio leído
+        self._floor = None  # En memoria están los eventos con id > _floor
+        self._events = []  # [(id, texto)] en orden
+        self._clients = 0
+        self._condition = threading.Condition()
+        self._active = threading.Event()
+        self._thread = None
+
+    # ----- difusión -----
+
+    def _render(self, rows):
+        urls = self.app.url_map.bind('localhost', script_name=self.app.config.get('APPLICATION_ROOT') or '/')
+        events = []
+        for change_id, action, file_id, title in rows:
+            name = EVENT_NAMES.get(action, 'update')
+            data = {}
+            if file_id is not None:
+                data['file_id'] = file_id
+                if title is not None:
+                    data.update(title=title, url=urls.build('view_file', {'file_id': file_id}))
+            events.append((change_id, format_event(change_id, name, data)))
+        return events
+
+    def poll(self):
+        """Lee los cambios nuevos y despierta a los suscriptores; devuelve cuántos eventos hubo"""
+        with self.app.app_context():
+            if self.version is None:
+                rows, version = [], CatalogChange.version()
+            else:
+                rows = _changes(self.version, self.backlog + 1)
+                version = None
+                if len(rows) > self.backlog:
+                    # Demasiados para la memoria: los que estén detrás recibirán `reload`
+                    rows, version = [], CatalogChange.version()
+        events = self._render(rows)
+        with self._condition:
+            if version is not None:
+                self._events = []
+                self.version = self._floor = version
+            elif events:
+                self._events.extend(events)
+                excess = len(self._events) - self.backlog
+                if excess > 0:
+                    self._floor = self._events[excess - 1][0]
+                    del self._events[:excess]
+                self.version = events[-1][0]
+            self._condition.notify_all()
+        return len(events)
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.warning(f'No se pudieron leer los cambios del catálogo: {type(e).__name__}')
+            time.sleep(self.poll_seconds)
+
+    def subscribe(self):
+        """Reserva una conexión y arranca el difusor; False si se alcanzó el límite del proceso"""
+        limit = self.max_clients if cooperative() else min(self.max_clients, self.thread_max_clients)
+        with self._condition:
+            if self._clients >= limit:
+                return False
+            self._clients += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='events-broadcaster', daemon=True)
+                self._thread.start()
+        self._active.set()
+        return True
+
+    def unsubscribe(self):
+        with self._condition:
+            self._clients -= 1
+            if self._clients == 0:
+                self._active.clear()
+
+    def clients(self):
+        return self._clients
+
+    # ----- suscriptores -----
+
+    def resume(self, last_event_id):
+        """(cursor, texto inicial) de una conexión nueva (en el contexto de la petición)
+
+        Solo consulta la BD si el difusor aún no tiene versión o si lo que
+        pide Last-Event-ID ya no está en memoria.
+        """
+        with self._condition:
+            version, floor = self.version, self._floor
+        if last_event_id is None:
+            return (version if version is not None else CatalogChange.version()), ''
+        if version is not None and last_event_id >= floor:
+            return last_event_id, ''
+        rows = _changes(last_event_id, self.backlog + 1)
+        if len(rows) > self.backlog:
+            version = CatalogChange.version()
+            return version, format_event(version, 'reload', {})
+        if not rows:
+            return last_event_id, ''
+        return rows[-1][0], ''.join(text for _, text in self._render(rows))
+
+    def _pending(self, cursor):
+        """(cursor, texto) de lo posterior a `cursor`; llamar con el candado"""
+        if self._floor is not None and cursor < self._floor:
+            return self.version, format_event(self.version, 'reload', {})
+        start = bisect.bisect_right(self._events, cursor, key=lambda event: event[0])
+        if start == len(self._events):
+            return cursor, ''
+        return self._events[-1][0], ''.join(text for _, text in self._events[start:])
+
+    def stream(self, cursor, initial=''):
+        """Cuerpo de la respuesta: eventos durante EVENTS_STREAM_SECONDS
+
+        La conexión reservada con subscribe() se libera al cerrar la
+        respuesta (response.call_on_close), aunque el cuerpo no llegue a
+        recorrerse.
+        """
+        deadline = time.monotonic() + self.stream_seconds
+        yield f'retry: {self.retry_ms}\n\n{initial}'
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            with self._condition:
+                cursor, text = self._pending(cursor)
+                if not text:
+                    self._condition.wait(min(self.keepalive_seconds, remaining))
+                    cursor, text = self._pending(cursor)
+            # Un comentario mantiene viva la conexión y detecta a los clientes que se fueron
+            yield text or ': keepalive\n\n'
+
+
+def init_events(app):
+    """Registra el difusor de eventos SSE con configuración por defecto"""
+    app.config.setdefault('EVENTS_POLL_SECONDS', float(os.environ.get('EVENTS_POLL_SECONDS', 1)))
+    app.config.setdefault('EVENTS_BACKLOG', int(os.environ.get('EVENTS_BACKLOG', 1000)))
+    app.config.setdefault('EVENTS_KEEPALIVE_SECONDS', float(os.environ.get('EVENTS_KEEPALIVE_SECONDS', 15)))
+    app.config.setdefault('EVENTS_MAX_CLIENTS', int(os.environ.get('EVENTS_MAX_CLIENTS', 500)))
+    app.config.setdefault('EVENTS_THREAD_MAX_CLIENTS', int(os.environ.get('EVENTS_THREAD_MAX_CLIENTS', 1)))
+    # Dónde abren /events los navegadores (p. ej. el servicio metadatos-events); por defecto, esta app
+    app.config.setdefault('EVENTS_PUBLIC_URL', os.environ.get('EVENTS_PUBLIC_URL', ''))
+    app.config.setdefault('EVENTS_STREAM_SECONDS', float(os.environ.get('EVENTS_STREAM_SECONDS', 300)))
+
+    broadcaster = EventBroadcaster(
+        app,
+        poll_seconds=app.config['EVENTS_POLL_SECONDS'],
+        backlog=app.config['EVENTS_BACKLOG'],
+        keepalive_seconds=app.config['EVENTS_KEEPALIVE_SECONDS'],
+        max_clients=app.config['EVENTS_MAX_CLIENTS'],
+        thread_max_clients=app.config['EVENTS_THREAD_MAX_CLIENTS'],
+        stream_seconds=app.config['EVENTS_STREAM_SECONDS'],
+    )
+    app.extensions['metadatos_events'] = broadcaster
+    return broadcaster
@@ -0,0 +1,339 @@
+"""
+Extracción del texto contenido en los archivos subidos
+
+Obtiene texto plano de txt/csv, docx, odt y xlsx (ZIP + XML, solo con la
+biblioteca estándar) y de pdf (con pypdf, dependencia opcional). La
+extracción se hace fuera de la petición, en un pool de procesos: la subida
+solo encola el trabajo y un callback guarda el resultado comprimido en
+file_texts y lo indexa en FTS5.
+
+La memoria está acotada: los archivos se leen por bloques, el XML se
+recorre con iterparse liberando cada párrafo y la extracción se detiene al
+alcanzar EXTRACT_MAX_CHARS caracteres por archivo.
+
+El pool usa 'fork': con 'spawn' o 'forkserver' cada proceso hijo vuelve a
+ejecutar el script principal (p. ej. `python app.py`, que inicializa la
+BD). Los hijos solo ejecutan extract_text, sin tocar la BD ni el logging,
+así que heredar el estado de un worker con hilos no es un problema.
+"""
+
+import atexit
+import codecs
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack
+from xml.etree.ElementTree import iterparse
+
+from compression import open_stored
+from database import TEXT_EXTRACTABLE, CatalogChange, File, FileText, db, record_catalog_change
+
+logger = logging.getLogger(__name__)
+
+READ_CHUNK = 64 * 1024
+
+W_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+S_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+TEXT_NS = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+
+
+class ExtractionUnsupported(Exception):
+    """El formato no se puede procesar en este entorno (p. ej. falta pypdf)"""
+
+
+class TextBuffer:
+    """Acumula texto hasta un máximo de caracteres"""
+
+    __slots__ = ('parts', 'size', 'max_chars', 'truncated')
+
+    def __init__(self, max_chars):
+        self.parts = []
+        self.size = 0
+        self.max_chars = max_chars
+        self.truncated = False
+
+    @property
+    def full(self):
+        return self.truncated
+
+    def add(self, text):
+        """Añade texto; devuelve False cuando se alcanzó el límite"""
+        if not text or self.truncated:
+            return not self.truncated
+        room = self.max_chars - self.size
+        if len(text) > room:
+            text = text[:room]
+            self.truncated = True
+        self.parts.append(text)
+        self.size += len(text)
+        return not self.truncated
+
+    def text(self):
+        return ' '.join(' '.join(self.parts).split())
+
+
+# ===== EXTRACTORES POR FORMATO =====
+
+def _detect_encoding(sample):
+    try:
+        codecs.getincrementaldecoder('utf-8')('strict').decode(sample, final=False)
+        return 'utf-8-sig' if sample.startswith(codecs.BOM_UTF8) else 'utf-8'
+    except UnicodeDecodeError:
+        return 'cp1252'
+
+
+def _extract_plain(path, buffer):
+    # txt/csv pueden estar comprimidos en reposo (compression.py)
+    with open_stored(path) as fh:
+        chunk = fh.read(READ_CHUNK)
+        decoder = codecs.getincrementaldecoder(_detect_encoding(chunk))('replace')
+        while chunk:
+            if not buffer.add(decoder.decode(chunk)):
+                return
+            chunk = fh.read(READ_CHUNK)
+        buffer.add(decoder.decode(b'', final=True))
+
+
+def _extract_xml(archive, member, tags, buffer):
+    """Texto de los elementos `tags` de un miembro XML, liberando cada uno"""
+    with archive.open(member) as stream:
+        for _, element in iterparse(stream, events=('end',)):
+            if element.tag in tags:
+                if not buffer.add(''.join(element.itertext()) + '\n'):
+                    return
+                element.clear()
+
+
+def _extract_docx(path, buffer):
+    with zipfile.ZipFile(path) as archive:
+        _extract_xml(archive, 'word/document.xml', {W_NS + 'p'}, buffer)
+
+
+def _extract_odt(path, buffer):
+    with zipfile.ZipFile(path) as archive:
+        _extract_xml(archive, 'content.xml', {TEXT_NS + 'p', TEXT_NS + 'h'}, buffer)
+
+
+def _extract_xlsx(path, buffer):
+    with zipfile.ZipFile(path) as archive:
+        names = archive.namelist()
+        # Las celdas de texto viven en la tabla de cadenas compartidas
+        if 'xl/sharedStrings.xml' in names:
+            _extract_xml(archive, 'xl/sharedStrings.xml', {S_NS + 'si'}, buffer)
+        for name in sorted(n for n in names if n.startswith('xl/worksheets/') and n.endswith('.xml')):
+            if buffer.full:
+                return
+            _extract_xml(archive, name, {S_NS + 'is'}, buffer)
+
+
+def _extract_pdf(path, buffer):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionUnsupported('pypdf no está instalado')
+    reader = PdfReader(path)
+    for page in reader.pages:
+        if not buffer.add((page.extract_text() or '') + '\n'):
+            return
+
+
+EXTRACTORS = {
+    'txt': _extract_plain,
+    'csv': _extract_plain,
+    'pdf': _extract_pdf,
+    'docx': _extract_docx,
+    'odt': _extract_odt,
+    'xlsx': _extract_xlsx,
+}
+
+
+def extract_text(path, extension, max_chars):
+    """Extrae el texto de un archivo (se ejecuta en un proceso del pool)
+
+    Devuelve (status, texto, truncado, error) con status done, empty,
+    failed o unsupported.
+    """
+    extractor = EXTRACTORS.get(extension)
+    if extractor is None:
+        return 'unsupported', '', False, f'Formato sin extractor: {extension}'
+    buffer = TextBuffer(max_chars)
+    try:
+        extractor(path, buffer)
+    except ExtractionUnsupported as e:
+        return 'unsupported', '', False, str(e)
+    except Exception as e:
+        # Conservar lo ya extraído si el fallo llega a mitad del archivo
+        if not buffer.size:
+            return 'failed', '', False, f'{type(e).__name__}: {e}'
+    text = buffer.text()
+    return ('done' if text else 'empty'), text, buffer.truncated, None
+
+
+def _extract_job(job):
+    file_id, path, extension, max_chars = job
+    return file_id, extract_text(path, extension, max_chars)
+
+
+def _process_pool(workers):
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('fork'))
+
+
+# ===== ETAPA EN SEGUNDO PLANO =====
+
+class TextExtractor:
+    """Encola extracciones en un pool de procesos y guarda sus resultados"""
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config['EXTRACT_ENABLED']
+        self.workers = app.config['EXTRACT_WORKERS']
+        self.max_chars = app.config['EXTRACT_MAX_CHARS']
+        self._executor = None
+        # Un único hilo escribe los resultados: serializa las escrituras en
+        # SQLite y evita que un trabajo ya terminado se guarde en el hilo de
+        # la petición (add_done_callback ejecuta en línea si el futuro acabó)
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='extract-writer')
+        self._lock = threading.Lock()
+        self._pending = 0
+        atexit.register(self.shutdown)
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = _process_pool(self.workers)
+            return self._executor
+
+    def submit(self, file_id, path, extension, cleanup=False):
+        """Encola la extracción de un archivo recién subido (no bloquea)
+
+        `path` es la copia local; con `cleanup` se borra al terminar (la copia
+        preparada de un backend remoto). Devuelve None si no hay nada que
+        extraer, y entonces la copia sigue siendo del llamador.
+        """
+        if not self.enabled or extension not in TEXT_EXTRACTABLE:
+            return None
+        future = self._pool().submit(_extract_job, (file_id, path, extension, self.max_chars))
+        with self._lock:
+            self._pending += 1
+
+        def done(finished):
+            if cleanup:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._writer.submit(self._store, finished)
+        future.add_done_callback(done)
+        return future
+
+    def backlog(self):
+        """Extracciones encoladas en este proceso cuyo resultado aún no se ha guardado"""
+        return self._pending
+
+    def _store(self, future):
+        try:
+            self._write(future)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def _write(self, future):
+        try:
+            file_id, result = future.result()
+        except Exception as e:
+            error_id = str(uuid.uuid4())[:8]
+            logger.error(f'Error ID {error_id} en el pool de extracción: {type(e).__name__}', exc_info=True)
+            return
+        with self.app.app_context():
+            try:
+                # El archivo pudo eliminarse mientras se extraía
+                if db.session.get(File, file_id) is None:
+                    return
+                connection = db.session.connection()
+                FileText.store(connection, file_id, *result)
+                self._index_signature(connection, file_id, result[1])
+                # El texto cambia los resultados de búsqueda (y las ETag de las páginas)
+                CatalogChange.record(connection, 'update', file_id)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                error_id = str(uuid.uuid4())[:8]
+                logger.error(f'Error ID {error_id} guardando texto del archivo {file_id}: {type(e).__name__}',
+                             exc_info=True)
+
+    def _index_signature(self, connection, file_id, text):
+        """Firma MinHash del contenido y aviso en el log si duplica otro documento"""
+        documents = self.app.extensions.get('metadatos_documents')
+        if documents is None or not documents.enabled:
+            return
+        signature = documents.index(connection, file_id, 'text', text)
+        matches = documents.near('text', signature, exclude=file_id)
+        if matches:
+            logger.warning(f'Archivo {file_id}: contenido casi idéntico a '
+                           + ', '.join(f'{match_id} ({score:.0%})' for score, match_id, _ in matches))
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=False)
+                self._executor = None
+        self._writer.shutdown(wait=True)
+
+
+def run_backfill(app, workers=None, batch_size=200, retry_failed=False, progress=None):
+    """Extrae el texto de todos los archivos pendientes usando todos los núcleos
+
+    Devuelve un dict con el número de archivos por estado.
+    """
+    workers = workers or os.cpu_count() or 1
+    max_chars = app.config['EXTRACT_MAX_CHARS']
+    storage = app.extensions['metadatos_storage']
+    totals = {}
+
+    with app.app_context():
+        if retry_failed:
+            for (file_id,) in db.session.query(FileText.file_id).filter(FileText.status == 'failed').all():
+                FileText.remove(db.session.connection(), file_id)
+            db.session.commit()
+
+        pending = db.session.execute(FileText.pending_query()).all()
+        if not pending:
+            return totals
+
+        documents = app.extensions.get('metadatos_documents')
+        with _process_pool(workers) as pool:
+            # Por ventanas para no acumular en memoria resultados de todo el catálogo
+            # (ni, con un backend remoto, copias descargadas en disco)
+            for start in range(0, len(pending), batch_size):
+                with ExitStack() as copies:
+                    window = [(file_id, copies.enter_context(storage.local_file(storage.locate(filename) or filename)),
+                               extension, max_chars)
+                              for file_id, filename, extension in pending[start:start + batch_size]]
+                    for file_id, result in pool.map(_extract_job, window,
+                                                    chunksize=max(1, len(window) // (workers * 4))):
+                        FileText.store(db.session.connection(), file_id, *result)
+                        if documents is not None:
+                            documents.index(db.session.connection(), file_id, 'text', result[1])
+                        totals[result[0]] = totals.get(result[0], 0) + 1
+                db.session.commit()
+                if progress:
+                    progress(start + len(window), len(pending))
+        # FileText.store no pasa por los eventos del ORM
+        record_catalog_change('bulk')
+        db.session.commit()
+    return totals
+
+
+def init_extraction(app):
+    """Registra la etapa de extracción en la aplicación con configuración por defecto"""
+    app.config.setdefault('EXTRACT_ENABLED', os.environ.get('EXTRACT_ENABLED', 'true').lower() == 'true')
+    app.config.setdefault('EXTRACT_WORKERS', int(os.environ.get('EXTRACT_WORKERS', 2)))
+    app.config.setdefault('EXTRACT_MAX_CHARS', int(os.environ.get('EXTRACT_MAX_CHARS', 200_000)))
+
+    extractor = TextExtractor(app)
+    app.extensions['metadatos_extractor'] = extractor
+    return extractor
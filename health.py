@@ -0,0 +1,199 @@
+"""
+Sondas de vida y disponibilidad
+
+/health/live solo comprueba que el proceso responde: no toca la BD ni el
+disco, para que el reinicio de Docker no dependa de servicios externos.
+
+/health/ready informa en un JSON compacto de lo que de verdad nos tumba:
+
+- db: latencia de un SELECT 1;
+- pool: conexiones en uso, libres y de desbordamiento del pool de SQLAlchemy;
+- disk: espacio e inodos libres del volumen de subidas (con S3, el de la
+  carpeta de preparación);
+- jobs: extracciones y borrados de archivos pendientes en este proceso;
+- scan: antigüedad y resultado del último gc-uploads (maintenance_runs).
+
+Las sondas con E/S (db, disk, scan) se cachean HEALTH_CACHE_SECONDS por
+proceso y solo un hilo las refresca: mientras tanto los demás reciben el
+último valor, así que una BD colgada no acumula peticiones de
+monitorización. pool y jobs son contadores en memoria y se leen siempre.
+
+El estado es `ok`, `degraded` (latencia, cola, disco o escaneo fuera de
+umbral: se sigue sirviendo, HTTP 200) o `fail` (sin BD o sin espacio
+mínimo en disco: HTTP 503 para que el balanceador saque la instancia).
+"""
+
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from database import MaintenanceRun, db
+from reconcile import SCAN_TASK
+
+logger = logging.getLogger(__name__)
+
+MB = 1024 * 1024
+
+
+class CachedProbe:
+    """Resultado de una sonda reutilizado durante `ttl` segundos"""
+
+    def __init__(self, probe, ttl):
+        self.probe = probe
+        self.ttl = ttl
+        self._value = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        """(valor, antigüedad en segundos)"""
+        if self._value is not None and time.monotonic() - self._checked_at < self.ttl:
+            return self._value, time.monotonic() - self._checked_at
+        # Si otro hilo ya está sondeando se devuelve el valor anterior sin esperar
+        if not self._lock.acquire(blocking=self._value is None):
+            return self._value, time.monotonic() - self._checked_at
+        try:
+            if self._value is None or time.monotonic() - self._checked_at >= self.ttl:
+                self._value = self.probe()
+                self._checked_at = time.monotonic()
+            return self._value, time.monotonic() - self._checked_at
+        finally:
+            self._lock.release()
+
+
+def _probe_db():
+    started = time.perf_counter()
+    try:
+        db.session.execute(db.select(db.literal(1))).scalar()
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f'Sonda de BD fallida: {type(e).__name__}')
+        return {'ok': False, 'error': type(e).__name__}
+    return {'ok': True, 'ms': round((time.perf_counter() - started) * 1000, 2)}
+
+
+def _pool_usage():
+    pool = db.engine.pool
+    if not hasattr(pool, 'checkedout'):
+        return {'class': type(pool).__name__}
+    return {'size': pool.size(), 'in_use': pool.checkedout(), 'idle': pool.checkedin(),
+            'overflow': max(0, pool.overflow()), 'max_overflow': getattr(pool, '_max_overflow', 0)}
+
+
+def _volume_usage(folder):
+    try:
+        stat = os.statvfs(folder)
+    except (OSError, AttributeError) as e:  # statvfs no existe en Windows
+        return {'error': type(e).__name__}
+    usage = {'free_mb': stat.f_bavail * stat.f_frsize // MB, 'total_mb': stat.f_blocks * stat.f_frsize // MB,
+             'free_pct': round(100 * stat.f_bavail / stat.f_blocks, 1) if stat.f_blocks else None}
+    if stat.f_files:  # 0 en sistemas de archivos sin límite de inodos
+        usage['inodes_free'] = stat.f_favail
+        usage['inodes_free_pct'] = round(100 * stat.f_favail / stat.f_files, 1)
+    return usage
+
+
+def _last_scan():
+    try:
+        last = MaintenanceRun.last(SCAN_TASK)
+    except Exception as e:
+        db.session.rollback()
+        return {'error': type(e).__name__}
+    if last is None:
+        return {'age_h': None}
+    finished_at, summary = last
+    return {'age_h': round((datetime.utcnow() - finished_at).total_seconds() / 3600, 1),
+            'dangling': summary.get('dangling'), 'orphans': summary.get('orphans')}
+
+
+class HealthMonitor:
+    """Sondas cacheadas y umbrales de /health/ready"""
+
+    def __init__(self, storage, extractor=None, sweeper=None, ttl=5.0, max_db_ms=250.0, min_free_mb=500,
+                 min_free_pct=5.0, min_inodes_pct=5.0, max_backlog=100, max_scan_age_hours=48.0):
+        self.storage = storage
+        self.extractor = extractor
+        self.sweeper = sweeper
+        self.max_db_ms = max_db_ms
+        self.min_free_mb = min_free_mb
+        self.min_free_pct = min_free_pct
+        self.min_inodes_pct = min_inodes_pct
+        self.max_backlog = max_backlog
+        self.max_scan_age_hours = max_scan_age_hours
+        self.started = time.monotonic()
+        self._db = CachedProbe(_probe_db, ttl)
+        self._disk = CachedProbe(lambda: _volume_usage(storage.volume()), ttl)
+        self._scan = CachedProbe(_last_scan, ttl)
+
+    def live(self):
+        return {'status': 'ok', 'pid': os.getpid(), 'uptime_s': int(time.monotonic() - self.started)}
+
+    def database_ok(self):
+        """Estado cacheado de la BD (para el /health clásico)"""
+        return self._db.get()[0]['ok']
+
+    def _jobs(self):
+        return {'extract': self.extractor.backlog() if self.extractor is not None else 0,
+                'sweep': self.sweeper.backlog() if self.sweeper is not None else 0}
+
+    def ready(self):
+        """(estado, informe): estado es 'ok', 'degraded' o 'fail'"""
+        database, db_age = self._db.get()
+        disk, _ = self._disk.get()
+        scan, _ = self._scan.get()
+        checks = {'db': dict(database, age_s=round(db_age, 1)), 'pool': _pool_usage(), 'disk': disk,
+                  'jobs': self._jobs(), 'scan': scan}
+
+        failures, warnings = [], []
+        if not database['ok']:
+            failures.append('db')
+        elif database['ms'] > self.max_db_ms:
+            warnings.append('db_latency')
+        if 'free_mb' in disk:
+            if disk['free_mb'] < self.min_free_mb:
+                failures.append('disk_space')
+            elif disk['free_pct'] is not None and disk['free_pct'] < self.min_free_pct:
+                warnings.append('disk_space')
+            if disk.get('inodes_free_pct') is not None and disk['inodes_free_pct'] < self.min_inodes_pct:
+                warnings.append('disk_inodes')
+        pool = checks['pool']
+        if 'in_use' in pool and pool['in_use'] >= pool['size'] + pool['max_overflow']:
+            warnings.append('pool_exhausted')
+        if sum(checks['jobs'].values()) > self.max_backlog:
+            warnings.append('job_backlog')
+        if scan.get('age_h') is None or scan['age_h'] > self.max_scan_age_hours:
+            warnings.append('integrity_scan')
+
+        status = 'fail' if failures else 'degraded' if warnings else 'ok'
+        report = {'status': status, 'checks': checks}
+        if failures or warnings:
+            report['problems'] = failures + warnings
+        return status, report
+
+
+def init_health(app, storage, extractor=None, sweeper=None):
+    """Registra las sondas de salud con configuración por defecto"""
+    app.config.setdefault('HEALTH_CACHE_SECONDS', float(os.environ.get('HEALTH_CACHE_SECONDS', 5)))
+    app.config.setdefault('HEALTH_MAX_DB_MS', float(os.environ.get('HEALTH_MAX_DB_MS', 250)))
+    app.config.setdefault('HEALTH_MIN_FREE_MB', int(os.environ.get('HEALTH_MIN_FREE_MB', 500)))
+    app.config.setdefault('HEALTH_MIN_FREE_PCT', float(os.environ.get('HEALTH_MIN_FREE_PCT', 5)))
+    app.config.setdefault('HEALTH_MIN_INODES_PCT', float(os.environ.get('HEALTH_MIN_INODES_PCT', 5)))
+    app.config.setdefault('HEALTH_MAX_BACKLOG', int(os.environ.get('HEALTH_MAX_BACKLOG', 100)))
+    app.config.setdefault('HEALTH_MAX_SCAN_AGE_HOURS', float(os.environ.get('HEALTH_MAX_SCAN_AGE_HOURS', 48)))
+
+    monitor = HealthMonitor(
+        storage,
+        extractor=extractor,
+        sweeper=sweeper,
+        ttl=app.config['HEALTH_CACHE_SECONDS'],
+        max_db_ms=app.config['HEALTH_MAX_DB_MS'],
+        min_free_mb=app.config['HEALTH_MIN_FREE_MB'],
+        min_free_pct=app.config['HEALTH_MIN_FREE_PCT'],
+        min_inodes_pct=app.config['HEALTH_MIN_INODES_PCT'],
+        max_backlog=app.config['HEALTH_MAX_BACKLOG'],
+        max_scan_age_hours=app.config['HEALTH_MAX_SCAN_AGE_HOURS'],
+    )
+    app.extensions['metadatos_health'] = monitor
+    return monitor
@@ -0,0 +1,195 @@
+"""
+Validación condicional (ETag, Last-Modified y 304) de las páginas HTML
+
+Las páginas públicas solo cambian cuando cambia el catálogo, el archivo
+mostrado, las plantillas o el estado de la sesión, así que sus validadores
+se calculan sin ejecutar las consultas de la página ni renderizar nada:
+
+- la versión del catálogo es el id más alto de catalog_changes, y su
+  created_at la fecha de Last-Modified (una búsqueda por clave primaria);
+- la ficha de un archivo no depende del resto del catálogo: usa su
+  updated_at y el último cambio del propio archivo o de sus relacionados
+  (vecinos recalculados, títulos editados, borrados), en una consulta por
+  los índices de related_files y catalog_changes.file_id; las imágenes
+  añaden la generación del índice de similares (image_similarity.py);
+- la ayuda depende solo de las plantillas.
+
+La ETag débil es un hash de esas partes, de la huella de las plantillas
+(ruta, tamaño y mtime de cada una, calculada al arrancar), de la versión del
+manifiesto de recursos estáticos (assets.py) y del estado de la
+sesión que cambia el HTML (sesión iniciada, usuario y token CSRF). Si el
+cliente la envía en If-None-Match (o If-Modified-Since no es anterior) se
+responde 304 sin cuerpo. Las respuestas llevan `Cache-Control: no-cache`:
+el navegador guarda la página pero revalida en cada visita.
+
+Las respuestas con mensajes flash (pendientes o emitidos durante la
+petición) no llevan validadores, porque el mensaje no forma parte de la
+ETag.
+"""
+
+import hashlib
+import logging
+import os
+from datetime import datetime, timezone
+from functools import wraps
+
+from flask import g, make_response, message_flashed, request, session
+
+from database import IMAGE_HASHABLE, CatalogChange, File, RelatedFile, db
+
+logger = logging.getLogger(__name__)
+
+SESSION_KEYS = ('logged_in', 'username', 'csrf_token')
+
+
+def _utc(value):
+    """datetime naive en UTC (como se guarda en la BD) a aware, sin microsegundos"""
+    if value is None:
+        return None
+    return value.replace(tzinfo=timezone.utc, microsecond=0)
+
+
+def template_fingerprint(folder):
+    """(huella, fecha de la plantilla más reciente) de los archivos de `folder`"""
+    digest = hashlib.sha256()
+    newest = 0.0
+    for root, dirs, names in os.walk(folder):
+        dirs.sort()
+        for name in sorted(names):
+            path = os.path.join(root, name)
+            stat = os.stat(path)
+            digest.update(f'{os.path.relpath(path, folder)}:{stat.st_size}:{stat.st_mtime_ns}\n'.encode())
+            newest = max(newest, stat.st_mtime)
+    return digest.hexdigest()[:16], datetime.fromtimestamp(int(newest), timezone.utc)
+
+
+def _mark_flashed(sender, **extra):
+    g.page_flashed = True
+
+
+class PageCache:
+    """Validadores de las páginas HTML y decorador que responde 304"""
+
+    def __init__(self, enabled=True, salt='', built_at=None, image_index=None):
+        self.enabled = enabled
+        self.salt = salt
+        self.built_at = built_at
+        self.image_index = image_index
+
+    # ----- validadores: (partes de la ETag, Last-Modified) o None -----
+
+    @staticmethod
+    def _latest_change():
+        return db.select(CatalogChange.id, CatalogChange.created_at).order_by(CatalogChange.id.desc()).limit(1)
+
+    def catalog_validators(self, **view_args):
+        """Páginas que dependen de todo el catálogo (portada, búsqueda, facetas, etiquetas)"""
+        latest = db.session.execute(self._latest_change()).first()
+        if latest is None:
+            return ('catalog', 0), self.built_at
+        return ('catalog', latest.id), max(_utc(latest.created_at), self.built_at)
+
+    def file_validators(self, file_id, **view_args):
+        """Ficha de un archivo: su updated_at, sus relacionados y, si es imagen, el índice de similares"""
+        neighbours = db.select(RelatedFile.related_id).where(RelatedFile.file_id == file_id)
+        latest = db.select(CatalogChange.id, CatalogChange.created_at).where(db.or_(
+            CatalogChange.file_id == file_id, CatalogChange.file_id.in_(neighbours)
+        )).order_by(CatalogChange.id.desc()).limit(1).subquery()
+        row = db.session.execute(
+            db.select(db.func.coalesce(File.updated_at, File.upload_date).label('updated_at'), File.extension,
+                      latest.c.id, latest.c.created_at)
+            .select_from(File).outerjoin(latest, db.true()).where(File.id == file_id)
+        ).first()
+        if row is None:
+            return None  # La vista responde 404
+        parts = ['file', file_id, row.id or 0, row.updated_at]
+        dates = [_utc(row.updated_at), _utc(row.created_at), self.built_at]
+        index = self.image_index
+        if index is not None and index.enabled and row.extension in IMAGE_HASHABLE:
+            index.refresh()
+            parts.append(index.generation)
+            dates.append(index.changed_at and index.changed_at.replace(microsecond=0))
+        return tuple(parts), max(value for value in dates if value)
+
+    def template_validators(self, **view_args):
+        """Páginas estáticas: solo dependen de las plantillas"""
+        return ('static',), self.built_at
+
+    # ----- respuesta condicional -----
+
+    def etag(self, parts):
+        """ETag de las partes de la página, las plantillas y el estado de la sesión"""
+        state = [self.salt, request.endpoint, *parts, *(session.get(key) for key in SESSION_KEYS)]
+        return hashlib.sha256('|'.join(map(str, state)).encode()).hexdigest()[:24]
+
+    @staticmethod
+    def _not_modified(etag, last_modified):
+        if request.if_none_match:
+            return request.if_none_match.contains_weak(etag)
+        if request.if_modified_since and last_modified is not None:
+            return last_modified <= request.if_modified_since
+        return False
+
+    @staticmethod
+    def _apply(response, etag, last_modified):
+        response.set_etag(etag, weak=True)
+        if last_modified is not None:
+            response.last_modified = last_modified
+        response.cache_control.no_cache = True
+        if session.get('logged_in'):
+            response.cache_control.private = True
+
+    def conditional(self, validators):
+        """Decorador: responde 304 si el cliente tiene la versión actual de la página
+
+        `validators(**view_args)` devuelve (partes, Last-Modified), o None si la
+        vista debe ejecutarse igualmente (p. ej. para responder 404).
+        """
+        def decorator(view):
+            @wraps(view)
+            def decorated_function(*args, **kwargs):
+                if not self.enabled or request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+                    return view(*args, **kwargs)
+                try:
+                    result = validators(**kwargs)
+                except Exception as e:
+                    # La vista maneja (y registra) el error de BD por su cuenta
+                    logger.warning(f'Validadores de {request.endpoint} no disponibles: {type(e).__name__}')
+                    db.session.rollback()
+                    result = None
+                if result is None:
+                    return view(*args, **kwargs)
+
+                parts, last_modified = result
+                etag = self.etag(parts)
+                if self._not_modified(etag, last_modified):
+                    response = make_response('', 304)
+                    self._apply(response, etag, last_modified)
+                    return response
+
+                response = make_response(view(*args, **kwargs))
+                if response.status_code == 200 and not g.get('page_flashed'):
+                    # Después de renderizar: la plantilla puede haber creado el token CSRF
+                    self._apply(response, self.etag(parts), last_modified)
+                return response
+            return decorated_function
+        return decorator
+
+
+def init_http_cache(app):
+    """Registra la validación condicional de páginas con configuración por defecto"""
+    app.config.setdefault('HTTP_CACHE_ENABLED', os.environ.get('HTTP_CACHE_ENABLED', 'true').lower() == 'true')
+    app.config.setdefault('HTTP_CACHE_SALT', os.environ.get('HTTP_CACHE_SALT', ''))
+
+    fingerprint, built_at = template_fingerprint(os.path.join(app.root_path, app.template_folder))
+    # Las páginas enlazan los css/js por su nombre con huella
+    assets = app.extensions.get('metadatos_assets')
+    page_cache = PageCache(
+        enabled=app.config['HTTP_CACHE_ENABLED'],
+        salt=app.config['HTTP_CACHE_SALT'] + fingerprint + (assets.version if assets else ''),
+        built_at=built_at,
+        image_index=app.extensions.get('metadatos_similarity'),
+    )
+    message_flashed.connect(_mark_flashed, app)
+    app.extensions['metadatos_http_cache'] = page_cache
+    return page_cache
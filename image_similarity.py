@@ -0,0 +1,396 @@
+"""
+Detección de imágenes casi duplicadas con hashes perceptuales
+
+Para cada imagen se calculan tres hashes de 64 bits con NumPy sobre una
+versión reducida en escala de grises:
+- aHash: cada píxel de 8x8 frente a la media.
+- dHash: gradiente horizontal en 9x8.
+- pHash: signo de las frecuencias bajas de una DCT 32x32 frente a la mediana.
+
+Dos copias de la misma imagen (redimensionada, recomprimida, con otro
+formato) quedan a pocos bits de distancia de Hamming. El pHash es la clave
+de búsqueda y el dHash confirma la coincidencia.
+
+La búsqueda usa una tabla hash multi-índice: el pHash se divide en
+INDEX_CHUNKS trozos, cada uno con su diccionario. Si dos hashes distan como
+mucho r bits, algún trozo dista como mucho r // INDEX_CHUNKS (principio del
+palomar), así que basta con consultar las variantes cercanas de cada trozo:
+el coste depende del radio y no del tamaño del catálogo, y a diferencia de
+un BK-tree admite borrados. El índice vive en memoria en cada worker y se
+sincroniza con catalog_changes igual que el de sugerencias: los cambios
+sueltos se aplican al vuelo y la reconstrucción completa (primer arranque,
+carga masiva, muchos cambios) va en un hilo de fondo, mientras se sigue
+consultando la tabla anterior.
+
+NumPy es opcional: sin él no se calculan hashes y el resto de la aplicación
+funciona igual.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from itertools import combinations
+
+from database import CatalogChange, ImageHash, db, record_catalog_change
+
+try:
+    import numpy as np
+except ImportError:  # Dependencia opcional
+    np = None
+
+logger = logging.getLogger(__name__)
+
+HASH_BITS = 64
+INDEX_CHUNKS = 4
+CHUNK_BITS = HASH_BITS // INDEX_CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+FULL_MASK = (1 << HASH_BITS) - 1
+
+DCT_SIZE = 32
+LOW_FREQUENCIES = 8
+
+# Transposición equivalente a cada orientación EXIF (como ImageOps.exif_transpose)
+EXIF_ORIENTATION = 0x0112
+_ORIENTATION_METHODS = {2: 'FLIP_LEFT_RIGHT', 3: 'ROTATE_180', 4: 'FLIP_TOP_BOTTOM',
+                        5: 'TRANSPOSE', 6: 'ROTATE_270', 7: 'TRANSVERSE', 8: 'ROTATE_90'}
+
+_dct_matrix = None
+
+
+def hashing_available():
+    return np is not None
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+def _dct():
+    """Matriz DCT-II ortonormal DCT_SIZE x DCT_SIZE (se calcula una vez)"""
+    global _dct_matrix
+    if _dct_matrix is None:
+        k = np.arange(DCT_SIZE)[:, None]
+        n = np.arange(DCT_SIZE)[None, :]
+        matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * DCT_SIZE)) * np.sqrt(2 / DCT_SIZE)
+        matrix[0] /= np.sqrt(2)
+        _dct_matrix = matrix
+    return _dct_matrix
+
+
+def _to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def _pixels(gray, size):
+    from PIL import Image
+    return np.asarray(gray.resize(size, Image.Resampling.LANCZOS), dtype=np.float32)
+
+
+def compute_hashes(path):
+    """(ahash, dhash, phash) sin signo de una imagen, o None si no se puede leer"""
+    if np is None:
+        return None
+    from PIL import Image
+
+    try:
+        with Image.open(path) as image:
+            # JPEG: decodificar directamente a 1/2..1/8 de escala; el resto se decodifica entero
+            image.draft('L', (DCT_SIZE * 4, DCT_SIZE * 4))
+            orientation = image.getexif().get(EXIF_ORIENTATION)
+            gray = image.convert('L')
+    except Exception:
+        return None
+    # Sin draft (PNG, WebP...): reducir con un filtro de caja antes de los remuestreos finos
+    factor = min(gray.size) // (DCT_SIZE * 4)
+    if factor > 1:
+        gray = gray.reduce(factor)
+    if orientation in _ORIENTATION_METHODS:
+        gray = gray.transpose(getattr(Image.Transpose, _ORIENTATION_METHODS[orientation]))
+
+    small = _pixels(gray, (8, 8))
+    ahash = _to_int(small > small.mean())
+
+    wide = _pixels(gray, (9, 8))
+    dhash = _to_int(wide[:, 1:] > wide[:, :-1])
+
+    dct = _dct()
+    coefficients = dct @ _pixels(gray, (DCT_SIZE, DCT_SIZE)) @ dct.T
+    low = coefficients[:LOW_FREQUENCIES, :LOW_FREQUENCIES]
+    # La mediana sin el término DC, que solo refleja el brillo medio
+    phash = _to_int(low > np.median(low.ravel()[1:]))
+    return ahash, dhash, phash
+
+
+# ===== ÍNDICE EN MEMORIA =====
+
+class MultiIndexHashTable:
+    """Búsqueda por distancia de Hamming con un diccionario por trozo del hash"""
+
+    __slots__ = ('tables', 'hashes', '_flips')
+
+    def __init__(self):
+        self.tables = [{} for _ in range(INDEX_CHUNKS)]
+        self.hashes = {}  # file_id -> (phash, dhash)
+        self._flips = {}
+
+    def __len__(self):
+        return len(self.hashes)
+
+    @staticmethod
+    def _chunks(value):
+        return [(value >> (CHUNK_BITS * position)) & CHUNK_MASK for position in range(INDEX_CHUNKS)]
+
+    def add(self, file_id, phash, dhash):
+        self.remove(file_id)
+        self.hashes[file_id] = (phash, dhash)
+        for table, chunk in zip(self.tables, self._chunks(phash)):
+            table.setdefault(chunk, set()).add(file_id)
+
+    def remove(self, file_id):
+        stored = self.hashes.pop(file_id, None)
+        if stored is None:
+            return
+        for table, chunk in zip(self.tables, self._chunks(stored[0])):
+            bucket = table.get(chunk)
+            if bucket is not None:
+                bucket.discard(file_id)
+                if not bucket:
+                    del table[chunk]
+
+    def _flip_masks(self, radius):
+        """Máscaras con hasta `radius` bits a 1 dentro de un trozo"""
+        if radius not in self._flips:
+            masks = [0]
+            for count in range(1, radius + 1):
+                masks.extend(sum(1 << bit for bit in bits) for bits in combinations(range(CHUNK_BITS), count))
+            self._flips[radius] = masks
+        return self._flips[radius]
+
+    def search(self, phash, max_distance):
+        """[(distancia pHash, file_id)] a lo sumo a max_distance bits"""
+        masks = self._flip_masks(max_distance // INDEX_CHUNKS)
+        candidates = set()
+        for table, chunk in zip(self.tables, self._chunks(phash)):
+            for mask in masks:
+                bucket = table.get(chunk ^ mask)
+                if bucket:
+                    candidates.update(bucket)
+        found = []
+        for file_id in candidates:
+            distance = hamming(phash, self.hashes[file_id][0])
+            if distance <= max_distance:
+                found.append((distance, file_id))
+        return found
+
+
+class SimilarImageIndex:
+    """Índice de hashes perceptuales de un worker, sincronizado con la versión del catálogo"""
+
+    def __init__(self, app, enabled=True, max_distance=8, limit=6, refresh_seconds=2.0, rebuild_threshold=500):
+        self.app = app
+        self.enabled = enabled and hashing_available()
+        self.max_distance = max_distance
+        self.limit = limit
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_threshold = rebuild_threshold
+        self.version = None
+        self.checked_at = 0.0
+        # Versión del catálogo en la que cambió la tabla por última vez, y cuándo: la ETag de las
+        # fichas de imágenes (los similares) solo cambia con ella
+        self.generation = 0
+        self.changed_at = None
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._builder = None
+        self._table = MultiIndexHashTable()
+        self._added = set()  # Indexadas al subir, aún sin contar en generation
+
+    # ----- sincronización -----
+
+    def refresh(self):
+        """Aplica los cambios del catálogo si la versión cambió (a lo sumo cada refresh_seconds)"""
+        if time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        with self._refresh_lock:
+            if time.monotonic() - self.checked_at < self.refresh_seconds:
+                return
+            self.checked_at = time.monotonic()
+            if self._builder is not None:
+                # La reconstrucción en curso deja la versión desde la que seguir
+                return
+            version = CatalogChange.version()
+            if version == self.version:
+                return
+            changes = CatalogChange.since(self.version) if self.version is not None and version > self.version else None
+            if (changes is None or len(changes) > self.rebuild_threshold
+                    or any(action == 'bulk' for _, action, _ in changes)):
+                self._start_rebuild()
+            else:
+                if self._apply({file_id for _, _, file_id in changes if file_id is not None}):
+                    self._changed(version)
+                self.version = version
+
+    def _changed(self, version):
+        self.generation = version
+        self.changed_at = datetime.now(timezone.utc)
+
+    def _start_rebuild(self):
+        self._builder = threading.Thread(target=self._rebuild, name='image-index-rebuild', daemon=True)
+        self._builder.start()
+
+    def wait(self, timeout=None):
+        """Espera a que termine la reconstrucción en curso, si la hay"""
+        builder = self._builder
+        if builder is not None:
+            builder.join(timeout)
+
+    def _rebuild(self):
+        version = None
+        try:
+            with self.app.app_context():
+                version = CatalogChange.version()
+                table = MultiIndexHashTable()
+                for file_id, _, dhash, phash in ImageHash.rows():
+                    table.add(file_id, phash, dhash)
+            with self._lock:
+                self._table = table
+            self._changed(version)
+        except Exception as e:
+            logger.warning(f'No se pudo reconstruir el índice de imágenes: {type(e).__name__}', exc_info=True)
+            version = self.version
+        finally:
+            with self._refresh_lock:
+                # Los cambios posteriores a version se aplican en el siguiente refresh
+                self.version = version
+                self._builder = None
+                self.checked_at = 0.0
+
+    def _apply(self, file_ids):
+        """Reindexa los archivos cambiados; True si cambió algún hash (no basta con editar el título)"""
+        rows = ImageHash.rows(file_ids) if file_ids else []
+        current = {file_id: (phash, dhash) for file_id, _, dhash, phash in rows}
+        with self._lock:
+            changed = any(file_id in self._added or self._table.hashes.get(file_id) != current.get(file_id)
+                          for file_id in file_ids)
+            self._added.difference_update(file_ids)
+            for file_id in file_ids:
+                self._table.remove(file_id)
+            for file_id, (phash, dhash) in current.items():
+                self._table.add(file_id, phash, dhash)
+        return changed
+
+    def add(self, file_id, hashes):
+        """Indexa una imagen recién guardada sin esperar al siguiente refresco"""
+        _, dhash, phash = hashes
+        with self._lock:
+            self._table.add(file_id, phash, dhash)
+            self._added.add(file_id)
+
+    # ----- consulta -----
+
+    def near(self, phash, dhash, exclude=None, limit=None):
+        """Imágenes casi idénticas: [(distancia, file_id)] de más a menos parecida
+
+        Coinciden si el pHash está a max_distance bits o menos y el dHash lo
+        confirma (a 2 * max_distance o menos). Un hash sin bits a 1 o sin
+        bits a 0 (imagen lisa) no distingue nada y no se compara.
+        """
+        if phash in (0, FULL_MASK):
+            return []
+        self.refresh()
+        with self._lock:
+            matches = []
+            for distance, file_id in self._table.search(phash, self.max_distance):
+                if file_id == exclude:
+                    continue
+                confirm = hamming(dhash, self._table.hashes[file_id][1])
+                if confirm <= 2 * self.max_distance:
+                    matches.append((distance + confirm, file_id))
+        return sorted(matches)[:limit or self.limit]
+
+    def similar(self, file_id, limit=None):
+        """Imágenes casi idénticas a un archivo ya indexado"""
+        self.refresh()
+        with self._lock:
+            stored = self._table.hashes.get(file_id)
+        if stored is None:
+            return []
+        return self.near(stored[0], stored[1], exclude=file_id, limit=limit)
+
+    def stats(self):
+        with self._lock:
+            return {'version': self.version, 'images': len(self._table),
+                    'buckets': sum(len(table) for table in self._table.tables),
+                    'generation': self.generation,
+                    'rebuilding': self._builder is not None}
+
+
+# ===== BACKFILL =====
+
+def _hash_job(job):
+    file_id, path = job
+    return file_id, compute_hashes(path)
+
+
+def run_hash_backfill(app, workers=None, batch_size=500, progress=None):
+    """Calcula los hashes de las imágenes que aún no los tienen
+
+    Devuelve (imágenes con hash, imágenes ilegibles).
+    """
+    from extraction import _process_pool
+
+    if np is None:
+        raise RuntimeError('NumPy no está instalado')
+    workers = workers or os.cpu_count() or 1
+    storage = app.extensions['metadatos_storage']
+    hashed = failed = 0
+
+    with app.app_context():
+        pending = db.session.execute(ImageHash.pending_query()).all()
+        if not pending:
+            return hashed, failed
+
+        with _process_pool(workers) as pool:
+            for start in range(0, len(pending), batch_size):
+                connection = db.session.connection()
+                with ExitStack() as copies:
+                    window = [(file_id, copies.enter_context(storage.local_file(filename)))
+                              for file_id, filename in pending[start:start + batch_size]]
+                    for file_id, hashes in pool.map(_hash_job, window,
+                                                    chunksize=max(1, len(window) // (workers * 4))):
+                        if hashes is None:
+                            failed += 1
+                            continue
+                        ImageHash.store(connection, file_id, *hashes)
+                        hashed += 1
+                db.session.commit()
+                if progress:
+                    progress(start + len(window), len(pending))
+
+        if hashed:
+            # Los índices en memoria se reconstruyen al ver el cambio masivo
+            record_catalog_change('bulk')
+            db.session.commit()
+    return hashed, failed
+
+
+def init_similarity(app):
+    """Registra el índice de imágenes similares en la aplicación con configuración por defecto"""
+    app.config.setdefault('IMAGE_HASH_ENABLED', os.environ.get('IMAGE_HASH_ENABLED', 'true').lower() == 'true')
+    app.config.setdefault('IMAGE_HASH_MAX_DISTANCE', int(os.environ.get('IMAGE_HASH_MAX_DISTANCE', 8)))
+    app.config.setdefault('IMAGE_SIMILAR_LIMIT', int(os.environ.get('IMAGE_SIMILAR_LIMIT', 6)))
+    app.config.setdefault('IMAGE_HASH_REFRESH_SECONDS', float(os.environ.get('IMAGE_HASH_REFRESH_SECONDS', 2)))
+
+    index = SimilarImageIndex(
+        app,
+        enabled=app.config['IMAGE_HASH_ENABLED'],
+        max_distance=app.config['IMAGE_HASH_MAX_DISTANCE'],
+        limit=app.config['IMAGE_SIMILAR_LIMIT'],
+        refresh_seconds=app.config['IMAGE_HASH_REFRESH_SECONDS'],
+    )
+    app.extensions['metadatos_similarity'] = index
+    return index
+
@@ -0,0 +1,222 @@
+"""
+Migraciones de esquema versionadas para Metadatos App
+
+db.create_all() crea las tablas nuevas pero no altera las existentes. Cada
+migración de este módulo añade columnas, índices o datos derivados a una
+base de datos creada con una versión anterior. Las migraciones se
+registran en la tabla schema_migrations y son idempotentes: en una BD
+nueva create_all ya crea las columnas y la migración solo rellena datos.
+"""
+
+from datetime import datetime
+
+import zlib
+
+from sqlalchemy import bindparam, inspect, text
+from sqlalchemy.exc import DBAPIError, OperationalError
+
+MIGRATIONS = []
+
+
+def migration(version, name):
+    """Registra una función como migración con número de versión"""
+    def decorator(func):
+        MIGRATIONS.append((version, name, func))
+        return func
+    return decorator
+
+
+def _columns(connection, table):
+    return {column['name'] for column in inspect(connection).get_columns(table)}
+
+
+def add_column_if_missing(connection, table, column, ddl_type):
+    if column not in _columns(connection, table):
+        connection.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl_type}'))
+
+
+def create_index_if_missing(connection, name, table, columns):
+    connection.execute(text(f'CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})'))
+
+
+def _ensure_table(connection):
+    connection.execute(text(
+        'CREATE TABLE IF NOT EXISTS schema_migrations ('
+        'version INTEGER PRIMARY KEY, name VARCHAR(100) NOT NULL, applied_at TIMESTAMP NOT NULL)'
+    ))
+
+
+def applied_versions(connection):
+    _ensure_table(connection)
+    return {row[0] for row in connection.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def run_migrations(db):
+    """Aplica en orden las migraciones pendientes, cada una en su transacción"""
+    with db.engine.begin() as connection:
+        done = applied_versions(connection)
+
+    for version, name, func in sorted(MIGRATIONS):
+        if version in done:
+            continue
+        with db.engine.begin() as connection:
+            # Otro worker pudo aplicarla mientras tanto
+            if version in applied_versions(connection):
+                continue
+            func(connection)
+            connection.execute(
+                text('INSERT INTO schema_migrations (version, name, applied_at) VALUES (:v, :n, :t)'),
+                {'v': version, 'n': name, 't': datetime.utcnow()}
+            )
+        print(f"✅ Migración {version:03d} aplicada: {name}")
+
+
+# ===== MIGRACIONES =====
+
+@migration(1, 'columnas indexadas de tipo de archivo y facetas')
+def _file_type_columns(connection):
+    from database import FacetCount, derived_file_columns
+
+    add_column_if_missing(connection, 'files', 'extension', 'VARCHAR(16)')
+    add_column_if_missing(connection, 'files', 'category', 'VARCHAR(20)')
+    add_column_if_missing(connection, 'files', 'upload_year', 'INTEGER')
+    create_index_if_missing(connection, 'ix_files_extension', 'files', 'extension')
+    create_index_if_missing(connection, 'ix_files_category', 'files', 'category')
+    create_index_if_missing(connection, 'ix_files_upload_year', 'files', 'upload_year')
+    create_index_if_missing(connection, 'ix_files_mime_type', 'files', 'mime_type')
+    create_index_if_missing(connection, 'ix_files_dc_language', 'files', 'dc_language')
+
+    # Backfill por lotes de las filas anteriores a estas columnas, paginando por id
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            'SELECT id, filename, upload_date FROM files '
+            'WHERE id > :last AND (extension IS NULL OR category IS NULL) ORDER BY id LIMIT 1000'
+        ), {'last': last_id}).fetchall()
+        if not rows:
+            break
+        batch = []
+        for file_id, filename, upload_date in rows:
+            if isinstance(upload_date, str):
+                upload_date = datetime.fromisoformat(upload_date)
+            values = derived_file_columns(filename, upload_date)
+            values['id'] = file_id
+            batch.append(values)
+        _update_derived(connection, batch)
+        last_id = rows[-1][0]
+
+    FacetCount.rebuild(connection)
+
+
+def _update_derived(connection, batch):
+    connection.execute(text(
+        'UPDATE files SET extension = :extension, category = :category, '
+        'mime_type = COALESCE(mime_type, :mime_type), upload_year = :upload_year WHERE id = :id'
+    ), batch)
+
+
+@migration(2, 'índice normalizado de palabras clave (tags)')
+def _tag_index(connection):
+    from database import Tag
+
+    # Las cuentas por palabra clave pasan de facet_counts a tags.file_count
+    connection.execute(text("DELETE FROM facet_counts WHERE facet = 'subject'"))
+    Tag.rebuild(connection)
+
+
+@migration(3, 'índice de texto completo del contenido (FTS5)')
+def _content_fts(connection):
+    from database import FTS_TABLE
+
+    # Índice sin contenido: el texto vive comprimido en file_texts
+    if connection.dialect.name != 'sqlite':
+        return
+    try:
+        connection.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "body, content='', tokenize='unicode61 remove_diacritics 2')"
+        ))
+    except OperationalError:
+        # SQLite compilado sin FTS5: el texto se extrae igual pero no se indexa
+        print("⚠️ SQLite sin FTS5: búsqueda en el contenido desactivada")
+
+
+def _create_extension(connection, name):
+    """CREATE EXTENSION en un savepoint: sin permisos o sin contrib la migración sigue"""
+    try:
+        with connection.begin_nested():
+            connection.execute(text(f'CREATE EXTENSION IF NOT EXISTS {name}'))
+        return True
+    except DBAPIError:
+        return False
+
+
+@migration(4, 'búsqueda nativa de PostgreSQL (tsvector y pg_trgm)')
+def _postgres_search(connection):
+    if connection.dialect.name != 'postgresql':
+        return
+
+    # Normalización común al índice y a las consultas; IMMUTABLE para poder
+    # usarla en una columna generada. Sin unaccent se distinguen los acentos.
+    if _create_extension(connection, 'unaccent'):
+        body = "SELECT public.unaccent('public.unaccent'::regdictionary, value)"
+    else:
+        print("⚠️ PostgreSQL sin la extensión unaccent: la búsqueda distingue acentos")
+        body = 'SELECT value'
+    connection.execute(text(
+        'CREATE OR REPLACE FUNCTION metadatos_search_text(value text) RETURNS text '
+        f'LANGUAGE sql IMMUTABLE PARALLEL SAFE AS $$ {body} $$'
+    ))
+
+    # Título, descripción y palabras clave en un tsvector generado, con índice GIN
+    connection.execute(text(
+        "ALTER TABLE files ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+        "to_tsvector('simple', metadatos_search_text("
+        "coalesce(title, '') || ' ' || coalesce(description, '') || ' ' || coalesce(dc_subject, '')))"
+        ") STORED"
+    ))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_files_search_vector ON files USING GIN (search_vector)'))
+
+    # Fragmentos dentro de una palabra (ILIKE '%...%') servidos por índices de trigramas
+    if _create_extension(connection, 'pg_trgm'):
+        for column in ('title', 'description'):
+            connection.execute(text(
+                f'CREATE INDEX IF NOT EXISTS ix_files_{column}_trgm ON files USING GIN ({column} gin_trgm_ops)'
+            ))
+    else:
+        print("⚠️ PostgreSQL sin la extensión pg_trgm: la búsqueda por fragmentos recorre la tabla")
+
+    # Contenido extraído: el equivalente del índice FTS5 de SQLite
+    connection.execute(text('ALTER TABLE file_texts ADD COLUMN IF NOT EXISTS body_tsv tsvector'))
+    connection.execute(text('CREATE INDEX IF NOT EXISTS ix_file_texts_body_tsv ON file_texts USING GIN (body_tsv)'))
+    last_id = 0
+    while True:
+        rows = connection.execute(text(
+            'SELECT file_id, content FROM file_texts WHERE file_id > :last AND content IS NOT NULL '
+            'ORDER BY file_id LIMIT 500'
+        ), {'last': last_id}).fetchall()
+        if not rows:
+            break
+        connection.execute(text(
+            "UPDATE file_texts SET body_tsv = strip(to_tsvector('simple', metadatos_search_text(:body))) "
+            "WHERE file_id = :file_id"
+        ), [{'file_id': file_id, 'body': zlib.decompress(content).decode('utf-8')} for file_id, content in rows])
+        last_id = rows[-1][0]
+
+
+@migration(5, 'tamaño exacto y CRC-32 de los archivos (descargas en ZIP)')
+def _file_checksums(connection):
+    # Se rellenan al preparar la primera descarga que los incluya o con `flask checksum-files`
+    add_column_if_missing(connection, 'files', 'size_bytes', 'BIGINT')
+    add_column_if_missing(connection, 'files', 'crc32', 'BIGINT')
+
+
+@migration(6, 'archivos guardados comprimidos (sin sondear el almacenamiento)')
+def _file_compressed(connection):
+    from compression import COMPRESSIBLE
+
+    add_column_if_missing(connection, 'files', 'compressed', 'BOOLEAN')
+    # Solo txt/csv pueden estar comprimidos; los demás se resuelven aquí y esos con `flask compress-uploads`
+    connection.execute(text(
+        'UPDATE files SET compressed = :false WHERE compressed IS NULL AND extension NOT IN :compressible'
+    ).bindparams(bindparam('compressible', expanding=True)), {'false': False, 'compressible': sorted(COMPRESSIBLE)})
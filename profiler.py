@@ -0,0 +1,369 @@
+"""
+Perfilador de peticiones lentas para Metadatos App
+
+Instrumentación opcional que registra, para las peticiones que superan un
+umbral, la ruta, las sentencias SQL con su duración y filas, el tiempo de
+renderizado de plantillas y un perfil muestreado de la pila de Python.
+
+Se activa globalmente con PROFILER_ENABLED=true o, para una sola petición,
+enviando la cabecera X-Profile-Request con una sesión de administrador.
+Cuando está desactivado, el coste por sentencia SQL es una lectura de
+ContextVar y no se crea ningún hilo de muestreo.
+"""
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from flask import before_render_template, g, request, session, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+# Traza activa del contexto actual (petición o bloque capture_sql)
+_active_trace = ContextVar('metadatos_profiler_trace', default=None)
+
+_events_installed = False
+_events_lock = threading.Lock()
+
+MAX_STATEMENT_LENGTH = 2000
+MAX_STACK_DEPTH = 40
+TOP_STACKS = 25
+
+
+class SqlTrace:
+    """Acumula las sentencias SQL ejecutadas mientras está activa"""
+
+    def __init__(self):
+        self.statements = []
+        self._pending = []
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def total_ms(self):
+        return round(sum(s['duration_ms'] for s in self.statements), 3)
+
+    def _before(self, statement):
+        self._pending.append((statement, time.perf_counter()))
+
+    def _after(self, rowcount):
+        if not self._pending:
+            return
+        statement, started = self._pending.pop()
+        self.statements.append({
+            'sql': statement[:MAX_STATEMENT_LENGTH],
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+            # rowcount es -1 para SELECT en la mayoría de drivers; se
+            # completa desde do_orm_execute cuando la consulta es del ORM
+            'rows': rowcount if rowcount is not None and rowcount >= 0 else None,
+        })
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'statements': self.statements,
+        }
+
+
+class RequestTrace(SqlTrace):
+    """Traza completa de una petición: SQL, plantillas y muestras de pila"""
+
+    def __init__(self, forced=False):
+        super().__init__()
+        self.id = uuid.uuid4().hex[:12]
+        self.forced = forced
+        self.started = time.perf_counter()
+        self.templates = []
+        self._template_starts = []
+        self.samples = None
+
+    def template_started(self, name):
+        self._template_starts.append((name, time.perf_counter()))
+
+    def template_finished(self):
+        if not self._template_starts:
+            return
+        name, started = self._template_starts.pop()
+        self.templates.append({
+            'name': name,
+            'duration_ms': round((time.perf_counter() - started) * 1000, 3),
+        })
+
+
+class StackSampler:
+    """Hilo único que muestrea periódicamente la pila de los hilos registrados"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def register(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._targets[thread_id] = samples
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name='metadatos-profiler-sampler', daemon=True
+                )
+                self._thread.start()
+        self._wakeup.set()
+        return samples
+
+    def unregister(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._targets
+                if idle:
+                    self._wakeup.clear()
+                else:
+                    # Se muestrea bajo el lock para que unregister() garantice
+                    # que el Counter ya no se modifica al leerlo
+                    frames = sys._current_frames()
+                    for thread_id, samples in self._targets.items():
+                        frame = frames.get(thread_id)
+                        if frame is not None:
+                            samples[_collapse_stack(frame)] += 1
+                    del frames
+            if idle:
+                self._wakeup.wait()
+                continue
+            time.sleep(self.interval)
+
+
+def _collapse_stack(frame):
+    """Convierte una pila en una línea 'archivo:función;...' (raíz primero)"""
+    parts = []
+    while frame is not None and len(parts) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    parts.reverse()
+    return ';'.join(parts)
+
+
+# ===== EVENTOS DE SQLALCHEMY =====
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _active_trace.get()
+    if trace is not None:
+        trace._before(statement)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    trace = _active_trace.get()
+    if trace is not None:
+        trace._after(getattr(cursor, 'rowcount', None))
+
+
+def _do_orm_execute(orm_execute_state):
+    """Cuenta filas devueltas por SELECT del ORM mientras hay traza activa"""
+    trace = _active_trace.get()
+    if trace is None or not orm_execute_state.is_select:
+        return None
+
+    options = orm_execute_state.execution_options
+    if options.get('yield_per') or options.get('stream_results'):
+        # No bufferizar resultados que el llamador quiere consumir en streaming
+        return None
+
+    first_new = len(trace.statements)
+    frozen = orm_execute_state.invoke_statement().freeze()
+    if len(trace.statements) > first_new:
+        trace.statements[-1]['rows'] = len(frozen.data)
+    return frozen()
+
+
+def _install_events():
+    global _events_installed
+    with _events_lock:
+        if _events_installed:
+            return
+        event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+        event.listen(Session, 'do_orm_execute', _do_orm_execute)
+        _events_installed = True
+
+
+@contextmanager
+def capture_sql():
+    """Captura las sentencias SQL ejecutadas dentro del bloque
+
+    Uso:
+        with capture_sql() as trace:
+            client.get('/')
+        trace.count, trace.total_ms, trace.statements
+    """
+    _install_events()
+    trace = SqlTrace()
+    token = _active_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _active_trace.reset(token)
+
+
+# ===== INTEGRACIÓN CON FLASK =====
+
+class RequestProfiler:
+    """Conecta la traza de peticiones con el ciclo de vida de Flask"""
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = app.config['PROFILER_ENABLED']
+        self.threshold_ms = app.config['PROFILER_THRESHOLD_MS']
+        self.header = app.config['PROFILER_HEADER']
+        self.log_file = app.config['PROFILER_LOG_FILE']
+        self.sampler = StackSampler(app.config['PROFILER_SAMPLE_INTERVAL_MS'] / 1000.0)
+        self._logger = None
+        self._logger_lock = threading.Lock()
+
+        _install_events()
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+        template_rendered.connect(self._template_rendered, app)
+        before_render_template.connect(self._before_render_template, app)
+
+    def _start(self):
+        forced = bool(request.headers.get(self.header)) and session.get('logged_in', False)
+        if not self.enabled and not forced:
+            return
+
+        trace = RequestTrace(forced=forced)
+        trace.samples = self.sampler.register(threading.get_ident())
+        g._profiler_trace = trace
+        g._profiler_token = _active_trace.set(trace)
+
+    def _finish(self, response):
+        trace = g.get('_profiler_trace')
+        if trace is None:
+            return response
+
+        self.sampler.unregister(threading.get_ident())
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        if trace.forced or duration_ms >= self.threshold_ms:
+            self._write(self._build_record(trace, response, duration_ms))
+            response.headers['X-Profile-Id'] = trace.id
+        return response
+
+    def _teardown(self, exc):
+        token = g.pop('_profiler_token', None)
+        if token is not None:
+            self.sampler.unregister(threading.get_ident())
+            _active_trace.reset(token)
+            g.pop('_profiler_trace', None)
+
+    def _before_render_template(self, sender, template, context, **extra):
+        trace = _active_trace.get()
+        if isinstance(trace, RequestTrace):
+            trace.template_started(template.name)
+
+    def _template_rendered(self, sender, template, context, **extra):
+        trace = _active_trace.get()
+        if isinstance(trace, RequestTrace):
+            trace.template_finished()
+
+    def _build_record(self, trace, response, duration_ms):
+        samples = trace.samples or Counter()
+        return {
+            'id': trace.id,
+            'timestamp': datetime.utcnow().isoformat(),
+            'method': request.method,
+            'route': request.url_rule.rule if request.url_rule else None,
+            'endpoint': request.endpoint,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(duration_ms, 3),
+            'forced': trace.forced,
+            'sql': trace.to_dict(),
+            'templates': {
+                'count': len(trace.templates),
+                'total_ms': round(sum(t['duration_ms'] for t in trace.templates), 3),
+                'rendered': trace.templates,
+            },
+            'profile': {
+                'interval_ms': self.app.config['PROFILER_SAMPLE_INTERVAL_MS'],
+                'samples': sum(samples.values()),
+                'top_stacks': samples.most_common(TOP_STACKS),
+            },
+        }
+
+    def _get_logger(self):
+        if self._logger is None:
+            with self._logger_lock:
+                if self._logger is None:
+                    log_dir = os.path.dirname(self.log_file)
+                    if log_dir:
+                        os.makedirs(log_dir, exist_ok=True)
+                    handler = RotatingFileHandler(
+                        self.log_file,
+                        maxBytes=self.app.config['PROFILER_LOG_MAX_BYTES'],
+                        backupCount=self.app.config['PROFILER_LOG_BACKUPS'],
+                    )
+                    handler.setFormatter(logging.Formatter('%(message)s'))
+                    logger = logging.getLogger('metadatos.profiler')
+                    logger.setLevel(logging.INFO)
+                    logger.propagate = False
+                    logger.addHandler(handler)
+                    self._logger = logger
+        return self._logger
+
+    def _write(self, record):
+        try:
+            self._get_logger().info(json.dumps(record, default=str))
+        except Exception as e:
+            # El perfilador nunca debe romper la petición
+            self.app.logger.warning(f'No se pudo escribir el registro del perfilador: {type(e).__name__}')
+
+    def recent_records(self, limit=50):
+        """Lee los últimos registros del archivo actual (todos los workers)"""
+        if not os.path.exists(self.log_file):
+            return []
+
+        lines = deque(maxlen=limit)
+        with open(self.log_file, 'r', encoding='utf-8', errors='replace') as fh:
+            for line in fh:
+                lines.append(line)
+
+        records = []
+        for line in reversed(lines):
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+
+def init_profiler(app):
+    """Registra el perfilador en la aplicación con configuración por defecto"""
+    app.config.setdefault('PROFILER_ENABLED', os.environ.get('PROFILER_ENABLED', 'false').lower() == 'true')
+    app.config.setdefault('PROFILER_THRESHOLD_MS', float(os.environ.get('PROFILER_THRESHOLD_MS', 500)))
+    app.config.setdefault('PROFILER_SAMPLE_INTERVAL_MS', float(os.environ.get('PROFILER_SAMPLE_INTERVAL_MS', 5)))
+    app.config.setdefault('PROFILER_HEADER', 'X-Profile-Request')
+    app.config.setdefault('PROFILER_LOG_FILE', os.environ.get('PROFILER_LOG_FILE', os.path.join('logs', 'slow_requests.log')))
+    app.config.setdefault('PROFILER_LOG_MAX_BYTES', 5 * 1024 * 1024)
+    app.config.setdefault('PROFILER_LOG_BACKUPS', 3)
+
+    profiler = RequestProfiler(app)
+    app.extensions['metadatos_profiler'] = profiler
+    return profiler
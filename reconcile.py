@@ -0,0 +1,212 @@
+"""
+Conciliación de la carpeta de subidas con la tabla files
+
+Una caída entre guardar el archivo y confirmar la fila (o entre el commit
+de un borrado y el barrido del archivo) deja archivos en disco sin fila o
+filas sin archivo. Este recolector los encuentra con un merge-join de dos
+flujos ordenados por nombre:
+
+- el listado del almacenamiento (os.scandir o list_objects_v2, ver
+  storage.py), ordenado por ordenación externa: tramos de GC_RUN_SIZE
+  nombres ordenados en memoria y volcados a temporales, que se mezclan
+  con heapq.merge;
+- los nombres de files recorridos por su índice único en orden, por
+  páginas con paginación por clave.
+
+La memoria está acotada por el tamaño del tramo y de la página, no por el
+número de archivos. Ambos lados se comparan como bytes UTF-8 (el orden
+BINARY de SQLite y COLLATE "C" en PostgreSQL).
+
+Los archivos huérfanos con más de GC_GRACE_SECONDS (para no tocar subidas
+en curso) se mueven a la cuarentena, fuera de la carpeta o el prefijo
+servidos, y se borran definitivamente cuando llevan GC_PURGE_DAYS en ella.
+Las filas sin archivo solo se informan. Cada ejecución queda anotada en
+maintenance_runs, de donde /health/ready lee la antigüedad del último escaneo.
+"""
+
+import heapq
+import logging
+import os
+import tempfile
+import time
+
+from compression import COMPRESSIBLE, SUFFIX
+from database import File, MaintenanceRun, db, extension_of
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 5000
+DANGLING_SAMPLE = 50
+KEEP = {'favicon.ico'}  # nginx sirve /favicon.ico desde la carpeta de subidas
+SCAN_TASK = 'gc-uploads'
+SCAN_SUMMARY = ('files', 'rows', 'orphans', 'quarantined', 'dangling')
+
+
+def logical_name(name):
+    """Nombre de files.filename al que corresponde una entrada del disco
+
+    Las versiones comprimidas en reposo (`x.txt.gz`) pertenecen a `x.txt`.
+    """
+    if name.endswith(SUFFIX) and extension_of(name[:-len(SUFFIX)]) in COMPRESSIBLE:
+        return name[:-len(SUFFIX)]
+    return name
+
+
+def _sort_key(name):
+    return os.fsencode(logical_name(name))
+
+
+def _write_run(names, directory):
+    names.sort(key=_sort_key)
+    run = tempfile.TemporaryFile(dir=directory)
+    for name in names:
+        run.write(os.fsencode(name) + b'\n')
+    run.seek(0)
+    return run
+
+
+def _read_run(run):
+    for line in run:
+        yield os.fsdecode(line[:-1])
+
+
+def sorted_listing(keys, run_size, skip=(), temp_dir=None):
+    """Las claves de `keys` en orden de _sort_key, con memoria acotada
+
+    Devuelve (iterador, número de entradas). Los nombres con salto de línea
+    no caben en los temporales y se ignoran con un aviso.
+    """
+    runs, names, count = [], [], 0
+    for name in keys:
+        if name in skip or name.startswith('.'):
+            continue
+        if '\n' in name:
+            logger.warning(f'Nombre de archivo no procesable: {name!r}')
+            continue
+        names.append(name)
+        count += 1
+        if len(names) >= run_size:
+            runs.append(_write_run(names, temp_dir))
+            names = []
+
+    if not runs:
+        names.sort(key=_sort_key)
+        return iter(names), count
+
+    if names:
+        runs.append(_write_run(names, temp_dir))
+
+    def merged():
+        try:
+            yield from heapq.merge(*(_read_run(run) for run in runs), key=_sort_key)
+        finally:
+            for run in runs:
+                run.close()
+    return merged(), count
+
+
+def _catalog_names(page_size):
+    """files.filename en orden de bytes, por páginas con paginación por clave"""
+    column = File.filename
+    if db.session.connection().dialect.name == 'postgresql':
+        column = column.collate('C')
+    last = None
+    while True:
+        query = db.select(File.id, File.filename).order_by(column).limit(page_size)
+        if last is not None:
+            query = query.where(column > last)
+        rows = db.session.execute(query).all()
+        if not rows:
+            return
+        yield from rows
+        last = rows[-1].filename
+
+
+def merge_join(listing, catalog):
+    """Recorre a la vez los dos flujos ordenados y produce ('orphan', nombre) o ('dangling', fila)"""
+    disk = next(listing, None)
+    row = next(catalog, None)
+    while disk is not None or row is not None:
+        disk_key = _sort_key(disk) if disk is not None else None
+        row_key = os.fsencode(row.filename) if row is not None else None
+        if row_key is None or (disk_key is not None and disk_key < row_key):
+            yield 'orphan', disk
+            disk = next(listing, None)
+        elif disk_key is None or row_key < disk_key:
+            yield 'dangling', row
+            row = next(catalog, None)
+        else:
+            # Puede haber original y versión comprimida para la misma fila
+            while disk is not None and _sort_key(disk) == row_key:
+                disk = next(listing, None)
+            row = next(catalog, None)
+
+
+class UploadReconciler:
+    """Encuentra huérfanos y filas sin archivo, y gestiona la cuarentena"""
+
+    def __init__(self, storage, grace_seconds=3600, purge_days=7, run_size=200_000):
+        self.storage = storage
+        self.grace_seconds = grace_seconds
+        self.purge_days = purge_days
+        self.run_size = run_size
+
+    def run(self, dry_run=False, page_size=PAGE_SIZE, progress=None):
+        """Concilia disco y BD; devuelve un dict con el informe"""
+        report = {'files': 0, 'rows': 0, 'orphans': 0, 'orphan_bytes': 0, 'quarantined': 0, 'in_grace': 0,
+                  'dangling': 0, 'dangling_sample': [], 'purged': 0, 'purged_bytes': 0}
+        now = time.time()
+        listing, report['files'] = sorted_listing(self.storage.iter_keys(), self.run_size, skip=KEEP)
+
+        def catalog():
+            for row in _catalog_names(page_size):
+                report['rows'] += 1
+                if progress and report['rows'] % page_size == 0:
+                    progress(report['rows'])
+                yield row
+
+        for kind, item in merge_join(listing, catalog()):
+            if kind == 'dangling':
+                report['dangling'] += 1
+                if len(report['dangling_sample']) < DANGLING_SAMPLE:
+                    report['dangling_sample'].append((item.id, item.filename))
+                continue
+            stat = self.storage.stat(item)
+            if stat is None:
+                continue  # Borrado mientras se recorría (p. ej. por el barrido)
+            size, modified = stat
+            report['orphans'] += 1
+            report['orphan_bytes'] += size
+            if now - modified < self.grace_seconds:
+                report['in_grace'] += 1
+                continue
+            if not dry_run:
+                try:
+                    self.storage.quarantine(item)
+                except FileNotFoundError:
+                    continue
+                logger.info(f'Archivo huérfano en cuarentena: {item}')
+            report['quarantined'] += 1
+
+        report['purged'], report['purged_bytes'] = self.storage.purge_quarantine(
+            now - self.purge_days * 86400, dry_run=dry_run)
+        # Último escaneo de integridad, para /health/ready
+        MaintenanceRun.record(SCAN_TASK, {key: report[key] for key in SCAN_SUMMARY} | {'dry_run': dry_run})
+        db.session.commit()
+        return report
+
+
+def init_reconcile(app):
+    """Registra el recolector de huérfanos con configuración por defecto"""
+    app.config.setdefault('GC_GRACE_SECONDS', int(os.environ.get('GC_GRACE_SECONDS', 3600)))
+    app.config.setdefault('GC_PURGE_DAYS', int(os.environ.get('GC_PURGE_DAYS', 7)))
+    app.config.setdefault('GC_RUN_SIZE', int(os.environ.get('GC_RUN_SIZE', 200_000)))
+
+    reconciler = UploadReconciler(
+        app.extensions['metadatos_storage'],
+        grace_seconds=app.config['GC_GRACE_SECONDS'],
+        purge_days=app.config['GC_PURGE_DAYS'],
+        run_size=app.config['GC_RUN_SIZE'],
+    )
+    app.extensions['metadatos_reconcile'] = reconciler
+    return reconciler
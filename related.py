@@ -0,0 +1,428 @@
+"""
+Archivos relacionados por similitud TF-IDF precalculada
+
+Cada archivo se convierte en un vector disperso de términos (título con
+doble peso, descripción, palabras clave y el principio del texto extraído)
+usando el truco del hash: el término se identifica por crc32 módulo
+FEATURES, así que no hace falta vocabulario y los vectores guardados en
+file_vectors siguen siendo válidos entre ejecuciones. Se guarda la
+frecuencia (1 + log tf); el IDF se aplica al cargar la matriz.
+
+La matriz del catálogo se monta en formato CSR con NumPy y se transpone a
+CSC (listas invertidas por término). Las similitudes coseno de un bloque de
+filas se calculan recorriendo solo las listas de sus términos y sumando los
+productos de cada par (fila, candidato) con np.add.reduceat; los k vecinos
+salen de ordenar esos pares. El resultado se guarda en related_files, así
+que mostrar el panel es una consulta por clave primaria sin cálculo en la
+petición.
+
+`flask related-files` es incremental: vectoriza los archivos nuevos o
+modificados y recalcula solo sus vecinos, los de los archivos a los que
+ahora superan y los que perdieron un vecino borrado. Las listas invertidas
+y el IDF de la última matriz completa se guardan en RELATED_INDEX_FOLDER;
+una ejecución incremental lee de la BD solo los vectores cambiados desde
+entonces y de la instantánea (por mmap) solo las listas de los términos que
+consulta. Cuando los cambios superan RELATED_MAX_DELTA del catálogo, o con
+--full, se rehace la matriz completa con el IDF actual.
+"""
+
+import math
+import os
+import re
+import unicodedata
+import zlib
+from datetime import datetime
+
+from database import CatalogChange, File, FileText, FileVector, RelatedFile, db, parse_tags
+
+try:
+    import numpy as np
+except ImportError:  # Dependencia opcional
+    np = None
+
+FEATURES = 1 << 20
+MIN_TOKEN_LENGTH = 3
+BLOCK_ROWS = 64
+QUERY_TERMS = 32
+MIN_DOCUMENTS_FOR_MAX_DF = 20  # En catálogos pequeños cualquier término común es significativo
+
+STOPWORDS = frozenset('''
+    las los del por para con una uno unos unas que como más pero sus les este esta estos estas ese esa
+    eso entre sobre sin desde hasta todo toda todos todas también otro otra otros otras muy cada donde
+    cuando fue son ser han hay está están sido the and for with that this from are was were not
+    '''.split())
+
+
+def available():
+    return np is not None
+
+
+def tokens(text):
+    """Palabras normalizadas (minúsculas, sin tildes), sin vacías ni números"""
+    text = unicodedata.normalize('NFKD', text or '').lower()
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return [word for word in re.findall(r'[^\W\d_]+', text)
+            if len(word) >= MIN_TOKEN_LENGTH and word not in STOPWORDS]
+
+
+def term_vector(title, description, dc_subject, text, max_terms):
+    """(índices uint32 ordenados, frecuencias float32) con como mucho max_terms términos"""
+    counts = {}
+    for weight, words in ((2, tokens(title)), (1, tokens(description)), (1, tokens(text))):
+        for word in words:
+            feature = zlib.crc32(word.encode('utf-8')) % FEATURES
+            counts[feature] = counts.get(feature, 0) + weight
+    # Cada palabra clave completa cuenta como un término propio
+    for name in parse_tags(dc_subject):
+        feature = zlib.crc32(b'tag:' + name.encode('utf-8')) % FEATURES
+        counts[feature] = counts.get(feature, 0) + 2
+    if len(counts) > max_terms:
+        counts = dict(sorted(counts.items(), key=lambda item: -item[1])[:max_terms])
+    indices = np.fromiter(sorted(counts), dtype=np.uint32, count=len(counts))
+    frequencies = np.array([1.0 + math.log(counts[index]) for index in indices.tolist()], dtype=np.float32)
+    return indices, frequencies
+
+
+def pack_vector(indices, frequencies):
+    return indices.astype('<u4').tobytes() + frequencies.astype('<f4').tobytes()
+
+
+def unpack_vector(blob):
+    size = len(blob) // 8
+    return np.frombuffer(blob, dtype='<u4', count=size), np.frombuffer(blob, dtype='<f4', count=size, offset=size * 4)
+
+
+class TermMatrix:
+    """Matriz TF-IDF dispersa (filas normalizadas) con su traspuesta"""
+
+    ARRAYS = ('file_ids', 'colptr', 'col_rows', 'col_data', 'idf')
+
+    def __init__(self, vectors, max_df=0.5, idf=None):
+        """vectors: {file_id: (índices, frecuencias)}; idf: el de otra matriz en lugar de calcularlo"""
+        self.file_ids = np.fromiter(sorted(vectors), dtype=np.int64, count=len(vectors))
+        self.row_of = {file_id: row for row, file_id in enumerate(self.file_ids.tolist())}
+        rows = [vectors[file_id] for file_id in self.file_ids.tolist()]
+        lengths = np.array([len(indices) for indices, _ in rows], dtype=np.int64)
+        self.indptr = np.concatenate(([0], np.cumsum(lengths)))
+        self.indices = np.concatenate([indices for indices, _ in rows]) if rows else np.zeros(0, np.uint32)
+        data = np.concatenate([frequencies for _, frequencies in rows]) if rows else np.zeros(0, np.float32)
+
+        count = len(rows)
+        if idf is None:
+            # IDF suavizado; los términos presentes en más de max_df de los archivos no discriminan
+            df = np.bincount(self.indices, minlength=FEATURES)
+            idf = (np.log((1 + count) / (1 + df)) + 1).astype(np.float32)
+            if count >= MIN_DOCUMENTS_FOR_MAX_DF:
+                idf[df > max_df * count] = 0
+        self.idf = idf
+        data = data * idf[self.indices]
+        row_ids = np.repeat(np.arange(count), lengths)
+        norms = np.sqrt(np.bincount(row_ids, weights=data.astype(np.float64) ** 2, minlength=count))
+        norms[norms == 0] = 1
+        self.data = (data / norms[row_ids]).astype(np.float32)
+
+        # CSC: para cada término, las filas que lo contienen (listas invertidas)
+        order = np.argsort(self.indices, kind='stable')
+        self.col_rows = row_ids[order]
+        self.col_data = self.data[order]
+        self.colptr = np.concatenate(([0], np.cumsum(np.bincount(self.indices, minlength=FEATURES))))
+
+    def __len__(self):
+        return len(self.file_ids)
+
+    # ----- instantánea en disco -----
+
+    def save(self, folder):
+        """Guarda las listas invertidas y el IDF (sin las filas) para las ejecuciones incrementales"""
+        os.makedirs(folder, exist_ok=True)
+        for name in self.ARRAYS:
+            path = os.path.join(folder, name + '.npy')
+            with open(path + '.tmp', 'wb') as handle:
+                np.save(handle, getattr(self, name))
+            os.replace(path + '.tmp', path)
+        save_delta(folder, [])
+
+    @classmethod
+    def load(cls, folder):
+        """Instantánea guardada con save(), o None; las listas invertidas se leen por mmap"""
+        try:
+            arrays = {name: np.load(os.path.join(folder, name + '.npy'),
+                                    mmap_mode='r' if name in ('col_rows', 'col_data') else None)
+                      for name in cls.ARRAYS}
+        except (OSError, ValueError):
+            return None
+        if len(arrays['colptr']) != FEATURES + 1:
+            return None
+        matrix = cls.__new__(cls)
+        for name, value in arrays.items():
+            setattr(matrix, name, value)
+        matrix.row_of = None
+        return matrix
+
+    # ----- búsqueda -----
+
+    def queries(self, block):
+        """(fila del bloque, término, peso) de los QUERY_TERMS términos de más peso de cada fila"""
+        starts, ends = self.indptr[block], self.indptr[block + 1]
+        local = np.repeat(np.arange(len(block)), ends - starts)
+        positions = np.concatenate([np.arange(s, e) for s, e in zip(starts.tolist(), ends.tolist())]) \
+            if len(block) else np.zeros(0, np.int64)
+        terms, weights = self.indices[positions], self.data[positions]
+        # Los términos comunes aportan poco al coseno y son los de listas invertidas más largas
+        order = np.lexsort((-weights, local))
+        rank = np.arange(len(order)) - np.repeat(np.concatenate(([0], np.cumsum(ends - starts)[:-1])),
+                                                 ends - starts)
+        keep = order[(rank < QUERY_TERMS) & (weights[order] > 0)]
+        return local[keep], terms[keep], weights[keep]
+
+    def postings(self, local, terms, weights, skip=None):
+        """(fila del bloque, file_id, producto) recorriendo de una vez las listas de los términos
+
+        skip marca las filas de esta matriz que no deben contar (borradas o sustituidas).
+        """
+        terms = terms.astype(np.int64)
+        lengths = self.colptr[terms + 1] - self.colptr[terms]
+        total = int(lengths.sum())
+        offsets = np.repeat(self.colptr[terms] - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        positions = offsets + np.arange(total)
+        rows = np.asarray(self.col_rows[positions])
+        products = np.repeat(weights.astype(np.float64), lengths) * self.col_data[positions]
+        local = np.repeat(local, lengths)
+        if skip is not None:
+            keep = ~skip[rows]
+            local, rows, products = local[keep], rows[keep], products[keep]
+        return local, self.file_ids[rows], products
+
+    def top_k(self, rows, k):
+        """{file_id: [(file_id vecino, similitud)]} para las filas indicadas"""
+        return nearest(self, rows, k, [(self, None)])
+
+
+def nearest(queries, rows, k, indexes):
+    """{file_id: [(file_id vecino, similitud)]} de filas de queries contra varias matrices
+
+    indexes: [(matriz, filas a omitir o None)] cuyas listas invertidas se recorren.
+    Las similitudes se acumulan solo para los pares (fila, candidato) que
+    aparecen en las listas, nunca en una matriz densa bloque × catálogo.
+    """
+    result = {}
+    for start in range(0, len(rows), BLOCK_ROWS):
+        block = np.asarray(rows[start:start + BLOCK_ROWS], dtype=np.int64)
+        own = queries.file_ids[block]
+        local, terms, weights = queries.queries(block)
+        parts = [matrix.postings(local, terms, weights, skip) for matrix, skip in indexes]
+        local = np.concatenate([part[0] for part in parts])
+        others = np.concatenate([part[1] for part in parts]).astype(np.int64)
+        products = np.concatenate([part[2] for part in parts])
+
+        stride = int(max(others.max(initial=0), own.max(initial=0))) + 1
+        keys = local * stride + others
+        order = np.argsort(keys, kind='stable')
+        keys, products = keys[order], products[order]
+        if len(keys):
+            first = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+            scores, keys = np.add.reduceat(products, first), keys[first]
+        else:
+            scores = products
+        local, others = np.divmod(keys, stride)
+        keep = (others != own[local]) & (scores > 0)  # Sin el propio archivo
+        local, others, scores = local[keep], others[keep], scores[keep]
+
+        # Por fila, de mayor a menor similitud; los k primeros de cada tramo
+        order = np.lexsort((others, -scores, local))
+        local, others, scores = local[order], others[order], scores[order]
+        bounds = np.searchsorted(local, np.arange(len(block) + 1)).tolist()
+        for position, file_id in enumerate(own.tolist()):
+            begin = bounds[position]
+            end = min(bounds[position + 1], begin + k)
+            result[file_id] = list(zip(others[begin:end].tolist(), scores[begin:end].tolist()))
+    return result
+
+
+def load_delta(folder):
+    try:
+        return np.load(os.path.join(folder, 'delta.npy')).tolist()
+    except (OSError, ValueError):
+        return []
+
+
+def save_delta(folder, file_ids):
+    """Archivos vectorizados después de la instantánea (sus filas en ella ya no valen)"""
+    path = os.path.join(folder, 'delta.npy')
+    with open(path + '.tmp', 'wb') as handle:
+        np.save(handle, np.asarray(sorted(file_ids), dtype=np.int64))
+    os.replace(path + '.tmp', path)
+
+
+class RelatedFiles:
+    """Configuración y consultas de archivos relacionados"""
+
+    def __init__(self, enabled=True, top_k=6, max_terms=100, max_chars=20000, max_df=0.5, min_score=0.05,
+                 index_folder=None, max_delta=0.25):
+        self.enabled = enabled and available()
+        self.top_k = top_k
+        self.max_terms = max_terms
+        self.max_chars = max_chars
+        self.max_df = max_df
+        self.min_score = min_score
+        self.index_folder = index_folder
+        self.max_delta = max_delta
+
+    def for_file(self, file_id):
+        if not self.enabled:
+            return []
+        return RelatedFile.for_file(file_id)
+
+    # ----- cálculo por lotes -----
+
+    def _vectorize(self, file_ids, batch_size):
+        """Calcula y guarda los vectores de los archivos indicados"""
+        table = FileVector.__table__
+        for start in range(0, len(file_ids), batch_size):
+            window = file_ids[start:start + batch_size]
+            rows = db.session.query(File.id, File.title, File.description, File.dc_subject, FileText.content) \
+                .outerjoin(FileText, FileText.file_id == File.id).filter(File.id.in_(window)).all()
+            now = datetime.utcnow()
+            connection = db.session.connection()
+            connection.execute(table.delete().where(table.c.file_id.in_(window)))
+            values = []
+            for file_id, title, description, dc_subject, content in rows:
+                text = zlib.decompress(content).decode('utf-8')[:self.max_chars] if content else ''
+                indices, frequencies = term_vector(title, description, dc_subject, text, self.max_terms)
+                values.append({'file_id': file_id, 'terms': pack_vector(indices, frequencies), 'computed_at': now})
+            if values:
+                connection.execute(table.insert(), values)
+            db.session.commit()
+
+    def _vectors(self, file_ids=None, batch_size=500):
+        """{file_id: (índices, frecuencias)} guardados, de todos o de los archivos indicados"""
+        table = FileVector.__table__
+        if file_ids is None:
+            return {file_id: unpack_vector(terms) for file_id, terms in db.session.execute(
+                db.select(table.c.file_id, table.c.terms))}
+        file_ids, vectors = list(file_ids), {}
+        for start in range(0, len(file_ids), batch_size):
+            vectors.update((file_id, unpack_vector(terms)) for file_id, terms in db.session.execute(
+                db.select(table.c.file_id, table.c.terms).where(table.c.file_id.in_(file_ids[start:start + batch_size]))))
+        return vectors
+
+    def _store(self, neighbours):
+        table = RelatedFile.__table__
+        connection = db.session.connection()
+        file_ids = list(neighbours)
+        for start in range(0, len(file_ids), 500):
+            window = file_ids[start:start + 500]
+            stored = {file_id: [] for file_id in window}
+            for file_id, related_id, score in connection.execute(
+                db.select(table.c.file_id, table.c.related_id, table.c.score)
+                .where(table.c.file_id.in_(window)).order_by(table.c.file_id, table.c.rank)
+            ):
+                stored[file_id].append((related_id, score))
+            rows = {file_id: [(related_id, round(float(score), 4)) for related_id, score in neighbours[file_id]
+                              if score >= self.min_score]
+                    for file_id in window}
+            changed = [file_id for file_id in window if rows[file_id] != stored[file_id]]
+            if not changed:
+                continue
+            connection.execute(table.delete().where(table.c.file_id.in_(changed)))
+            values = [{'file_id': file_id, 'rank': rank, 'related_id': related_id, 'score': score}
+                      for file_id in changed
+                      for rank, (related_id, score) in enumerate(rows[file_id])]
+            if values:
+                connection.execute(table.insert(), values)
+            # Cambia el panel de relacionados (y la ETag) solo de esas fichas
+            CatalogChange.record_many(connection, CatalogChange.NEIGHBOURS, changed)
+        db.session.commit()
+
+    def refresh(self, full=False, batch_size=500, progress=None):
+        """Actualiza vectores y vecinos; devuelve (archivos vectorizados, archivos con vecinos recalculados)"""
+        if not self.enabled:
+            raise RuntimeError('Archivos relacionados desactivados (RELATED_ENABLED o NumPy no disponible)')
+        vectors_table, related_table = FileVector.__table__, RelatedFile.__table__
+        existing = db.select(File.id)
+
+        # Archivos borrados: en SQLite las FK no se aplican y sus filas quedan huérfanas
+        orphaned = {file_id for (file_id,) in db.session.execute(
+            db.select(related_table.c.file_id).distinct().where(related_table.c.related_id.not_in(existing))
+        )}
+        db.session.execute(vectors_table.delete().where(vectors_table.c.file_id.not_in(existing)))
+        db.session.execute(related_table.delete().where(db.or_(
+            related_table.c.file_id.not_in(existing), related_table.c.related_id.not_in(existing)
+        )))
+        db.session.commit()
+
+        pending = [file_id for (file_id,) in db.session.execute(FileVector.pending_query())]
+        self._vectorize(pending, batch_size)
+
+        snapshot = None
+        if not full and self.index_folder:
+            snapshot = TermMatrix.load(self.index_folder)
+            delta = set(load_delta(self.index_folder)) | set(pending) if snapshot is not None else set()
+            if snapshot is not None and len(delta) > self.max_delta * len(snapshot):
+                snapshot = None  # Demasiados cambios desde la instantánea: se rehace
+
+        if snapshot is None:
+            # Matriz completa con el IDF actual; se guarda como instantánea para las siguientes
+            matrix = TermMatrix(self._vectors(), max_df=self.max_df)
+            if self.index_folder:
+                matrix.save(self.index_folder)
+            indexes = [(matrix, None)]
+
+            def queries(file_ids):
+                return matrix, [matrix.row_of[file_id] for file_id in file_ids if file_id in matrix.row_of]
+        else:
+            # Solo los vectores nuevos o cambiados desde la instantánea, con su IDF; del resto
+            # del catálogo se leen únicamente las listas invertidas de los términos consultados
+            changed = TermMatrix(self._vectors(delta, batch_size), idf=snapshot.idf)
+            existing_ids = np.fromiter(db.session.execute(db.select(File.id)).scalars(), dtype=np.int64)
+            stale = ~np.isin(snapshot.file_ids, existing_ids) | np.isin(snapshot.file_ids, changed.file_ids)
+            indexes = [(snapshot, stale), (changed, None)]
+            save_delta(self.index_folder, changed.file_ids.tolist())
+
+            def queries(file_ids):
+                matrix = TermMatrix(self._vectors(file_ids, batch_size), idf=snapshot.idf)
+                return matrix, list(range(len(matrix)))
+
+        targets = matrix.file_ids.tolist() if full else sorted(set(pending) | orphaned)
+        neighbours = self._nearest(queries, targets, indexes, batch_size, progress)
+
+        if not full:
+            # Los vecinos de los archivos nuevos pueden tenerlos ahora entre sus k mejores
+            affected = {related_id for file_id in neighbours for related_id, _ in neighbours[file_id]}
+            neighbours.update(self._nearest(queries, sorted(affected - set(neighbours)), indexes, batch_size))
+
+        self._store(neighbours)
+        return len(pending), len(neighbours)
+
+    def _nearest(self, queries, file_ids, indexes, batch_size, progress=None):
+        neighbours = {}
+        for start in range(0, len(file_ids), batch_size):
+            matrix, rows = queries(file_ids[start:start + batch_size])
+            neighbours.update(nearest(matrix, rows, self.top_k, indexes))
+            if progress:
+                progress(min(start + batch_size, len(file_ids)), len(file_ids))
+        return neighbours
+
+
+def init_related(app):
+    """Registra los archivos relacionados en la aplicación con configuración por defecto"""
+    app.config.setdefault('RELATED_ENABLED', os.environ.get('RELATED_ENABLED', 'true').lower() == 'true')
+    app.config.setdefault('RELATED_TOP_K', int(os.environ.get('RELATED_TOP_K', 6)))
+    app.config.setdefault('RELATED_MAX_TERMS', int(os.environ.get('RELATED_MAX_TERMS', 100)))
+    app.config.setdefault('RELATED_MAX_CHARS', int(os.environ.get('RELATED_MAX_CHARS', 20000)))
+    app.config.setdefault('RELATED_MAX_DF', float(os.environ.get('RELATED_MAX_DF', 0.5)))
+    default_folder = os.path.join(os.path.dirname(os.path.abspath(app.config['UPLOAD_FOLDER'])), 'related_index')
+    app.config.setdefault('RELATED_INDEX_FOLDER', os.environ.get('RELATED_INDEX_FOLDER', default_folder))
+    app.config.setdefault('RELATED_MAX_DELTA', float(os.environ.get('RELATED_MAX_DELTA', 0.25)))
+
+    related = RelatedFiles(
+        enabled=app.config['RELATED_ENABLED'],
+        top_k=app.config['RELATED_TOP_K'],
+        max_terms=app.config['RELATED_MAX_TERMS'],
+        max_chars=app.config['RELATED_MAX_CHARS'],
+        max_df=app.config['RELATED_MAX_DF'],
+        index_folder=app.config['RELATED_INDEX_FOLDER'],
+        max_delta=app.config['RELATED_MAX_DELTA'],
+    )
+    app.extensions['metadatos_related'] = related
+    return related
@@ -0,0 +1,288 @@
+"""
+sitemap.xml troceado y feed Atom de las últimas subidas, generados en disco
+
+Los rastreadores descubrían los archivos paginando la portada, la ruta más
+cara. Ahora tienen en SITEMAP_FOLDER:
+
+- sitemap.xml: índice de los trozos, con la fecha del cambio más reciente
+  de cada uno;
+- sitemap-pages.xml: portada, etiquetas y ayuda;
+- sitemap-00001.xml, ...: fichas de archivo, SITEMAP_CHUNK_SIZE por trozo
+  (50.000, el máximo del protocolo). Cada trozo cubre un rango fijo de ids,
+  así que un cambio solo afecta al trozo del id que cambió;
+- feed.atom: las SITEMAP_FEED_SIZE subidas más recientes.
+
+Como el índice de sugerencias, se sincronizan con catalog_changes: tras
+una subida, un borrado o una acción masiva se encola una actualización en
+un hilo de fondo que regenera solo los trozos de los ids cambiados, el feed
+y el índice (una carga masiva o el primer arranque lo regeneran todo). La
+versión aplicada se guarda en state.json junto a los archivos, de modo que
+cualquier worker continúa donde lo dejó otro.
+
+Un archivo solo se reescribe si su contenido cambia (con os.replace, nunca
+queda a medias), así que su ETag se mantiene mientras no cambie. Los sirve
+nginx como estáticos, o la app con send_file y validación condicional.
+"""
+
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from urllib.parse import urlsplit
+from xml.sax.saxutils import escape
+
+from database import CatalogChange, File, db, parse_tags
+
+logger = logging.getLogger(__name__)
+
+INDEX = 'sitemap.xml'
+PAGES = 'sitemap-pages.xml'
+FEED = 'feed.atom'
+STATE = 'state.json'
+SUMMARY_LENGTH = 500
+SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
+PUBLIC_PAGES = ('index', 'tags_page', 'help_page')
+
+
+def chunk_name(chunk):
+    return f'sitemap-{chunk + 1:05d}.xml'
+
+
+def _attr(value):
+    return escape(value, {'"': '&quot;'})
+
+
+def w3c_datetime(value):
+    """Fecha UTC naive de la BD en el formato de sitemaps y Atom"""
+    return value.strftime('%Y-%m-%dT%H:%M:%SZ')
+
+
+class SitemapWriter:
+    """Genera y mantiene al día los sitemaps y el feed de una carpeta"""
+
+    def __init__(self, app, folder, base_url, chunk_size=50000, feed_size=50, title='Metadatos App',
+                 refresh_seconds=60.0):
+        self.app = app
+        self.folder = folder
+        self.base_url = base_url.rstrip('/')
+        self.chunk_size = chunk_size
+        self.feed_size = feed_size
+        self.title = title
+        self.refresh_seconds = refresh_seconds
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._queued = False
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sitemap-writer')
+        atexit.register(self.shutdown)
+        os.makedirs(folder, exist_ok=True)
+
+    # ----- URLs absolutas sin contexto de petición -----
+
+    def _urls(self):
+        parts = urlsplit(self.base_url)
+        return self.app.url_map.bind(parts.netloc, script_name=parts.path or '/', url_scheme=parts.scheme or 'https')
+
+    # ----- escritura -----
+
+    def path(self, name):
+        return os.path.join(self.folder, name)
+
+    def _write(self, name, content):
+        """Escribe `content` si difiere del actual; devuelve si se escribió"""
+        path = self.path(name)
+        try:
+            with open(path, 'rb') as fh:
+                if fh.read() == content:
+                    return False
+        except FileNotFoundError:
+            pass
+        temporary = f'{path}.{os.getpid()}.tmp'
+        with open(temporary, 'wb') as fh:
+            fh.write(content)
+        os.replace(temporary, path)
+        return True
+
+    def _load_state(self):
+        try:
+            with open(self.path(STATE)) as fh:
+                state = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+        state['chunks'] = {int(chunk): info for chunk, info in state['chunks'].items()}
+        return state
+
+    def _write_chunk(self, urls, chunk):
+        """Regenera un trozo; devuelve {'count', 'lastmod'} o None si quedó vacío (y se borra)"""
+        first = chunk * self.chunk_size + 1
+        rows = db.session.execute(
+            db.select(File.id, db.func.coalesce(File.updated_at, File.upload_date))
+            .where(File.id.between(first, first + self.chunk_size - 1)).order_by(File.id)
+        ).all()
+        if not rows:
+            try:
+                os.remove(self.path(chunk_name(chunk)))
+            except FileNotFoundError:
+                pass
+            return None
+        lines = [f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n']
+        for file_id, modified in rows:
+            location = _attr(urls.build('view_file', {'file_id': file_id}, force_external=True))
+            lines.append(f'<url><loc>{location}</loc><lastmod>{w3c_datetime(modified)}</lastmod></url>\n')
+        lines.append('</urlset>\n')
+        self._write(chunk_name(chunk), ''.join(lines).encode('utf-8'))
+        return {'count': len(rows), 'lastmod': w3c_datetime(max(modified for _, modified in rows))}
+
+    def _write_pages(self, urls):
+        lines = [f'<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="{SITEMAP_NS}">\n']
+        for endpoint in PUBLIC_PAGES:
+            lines.append(f'<url><loc>{_attr(urls.build(endpoint, force_external=True))}</loc></url>\n')
+        lines.append('</urlset>\n')
+        self._write(PAGES, ''.join(lines).encode('utf-8'))
+
+    def _write_index(self, urls, chunks):
+        lines = [f'<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="{SITEMAP_NS}">\n']
+        names = [(PAGES, None)] + [(chunk_name(chunk), chunks[chunk]['lastmod']) for chunk in sorted(chunks)]
+        for name, lastmod in names:
+            location = _attr(urls.build('sitemap_chunk', {'name': name}, force_external=True))
+            lines.append(f'<sitemap><loc>{location}</loc>'
+                         + (f'<lastmod>{lastmod}</lastmod>' if lastmod else '') + '</sitemap>\n')
+        lines.append('</sitemapindex>\n')
+        self._write(INDEX, ''.join(lines).encode('utf-8'))
+
+    def _write_feed(self, urls):
+        rows = db.session.execute(
+            db.select(File.id, File.title, File.description, File.dc_creator, File.dc_subject, File.upload_date,
+                      db.func.coalesce(File.updated_at, File.upload_date).label('modified'))
+            .order_by(File.upload_date.desc(), File.id.desc()).limit(self.feed_size)
+        ).all()
+        feed_url = _attr(urls.build('atom_feed', force_external=True))
+        home_url = _attr(urls.build('index', force_external=True))
+        updated = max((row.modified for row in rows), default=datetime(1970, 1, 1))
+        lines = ['<?xml version="1.0" encoding="utf-8"?>\n<feed xmlns="http://www.w3.org/2005/Atom">\n',
+                 f'<title>{escape(self.title)}: archivos recientes</title>\n',
+                 f'<id>{feed_url}</id>\n<link rel="self" href="{feed_url}"/>\n',
+                 f'<link rel="alternate" type="text/html" href="{home_url}"/>\n',
+                 f'<updated>{w3c_datetime(updated)}</updated>\n']
+        for row in rows:
+            location = _attr(urls.build('view_file', {'file_id': row.id}, force_external=True))
+            summary = row.description
+            if len(summary) > SUMMARY_LENGTH:
+                summary = summary[:SUMMARY_LENGTH] + '…'
+            categories = ''.join(f'<category term="{_attr(name)}" label="{_attr(label)}"/>'
+                                 for name, label in parse_tags(row.dc_subject).items())
+            # Título y descripción se guardan ya escapados para HTML (sanitize_input)
+            lines.append(f'<entry><title type="html">{escape(row.title)}</title><id>{location}</id><link href="{location}"/>'
+                         f'<published>{w3c_datetime(row.upload_date)}</published>'
+                         f'<updated>{w3c_datetime(row.modified)}</updated>'
+                         f'<author><name>{escape(row.dc_creator or self.title)}</name></author>'
+                         f'{categories}<summary type="html">{escape(summary)}</summary></entry>\n')
+        lines.append('</feed>\n')
+        self._write(FEED, ''.join(lines).encode('utf-8'))
+
+    # ----- sincronización con el catálogo -----
+
+    def refresh(self, full=False):
+        """Aplica los cambios del catálogo desde la última versión; devuelve los trozos regenerados
+
+        Necesita un contexto de aplicación.
+        """
+        with self._lock:
+            # La carpeta puede haberse vaciado para forzar la regeneración
+            os.makedirs(self.folder, exist_ok=True)
+            state = self._load_state()
+            version = CatalogChange.version()
+            if not full and state is not None and state['version'] == version:
+                self.checked_at = time.monotonic()
+                return 0
+            changes = None
+            if not full and state is not None and version > state['version']:
+                changes = CatalogChange.since(state['version'])
+            urls = self._urls()
+            if changes is None or any(action == 'bulk' or file_id is None for _, action, file_id in changes):
+                last_id = db.session.query(db.func.max(File.id)).scalar() or 0
+                stale = set(state['chunks']) if state is not None else set()
+                chunks = set(range((last_id - 1) // self.chunk_size + 1 if last_id else 0)) | stale
+                state = {'chunks': {}}
+                self._write_pages(urls)
+            else:
+                chunks = {(file_id - 1) // self.chunk_size for _, _, file_id in changes}
+
+            for chunk in sorted(chunks):
+                info = self._write_chunk(urls, chunk)
+                if info is None:
+                    state['chunks'].pop(chunk, None)
+                else:
+                    state['chunks'][chunk] = info
+            self._write_feed(urls)
+            self._write_index(urls, state['chunks'])
+            state['version'] = version
+            self._write(STATE, json.dumps(state, sort_keys=True).encode('utf-8'))
+            self.checked_at = time.monotonic()
+            return len(chunks)
+
+    def schedule(self, force=True):
+        """Encola una actualización en segundo plano (no bloquea; varias seguidas se agrupan)
+
+        Sin `force` solo se encola si pasaron refresh_seconds desde la última
+        comprobación (para las peticiones de los propios sitemaps, que así
+        recogen los cambios hechos por otros workers o por la CLI).
+        """
+        if not force and time.monotonic() - self.checked_at < self.refresh_seconds:
+            return None
+        with self._queue_lock:
+            if self._queued:
+                return None
+            self._queued = True
+            self.checked_at = time.monotonic()
+        return self._executor.submit(self._run)
+
+    def _run(self):
+        self._queued = False
+        with self.app.app_context():
+            try:
+                self.refresh()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f'Error actualizando los sitemaps: {type(e).__name__}', exc_info=True)
+
+    def ensure(self, name):
+        """Ruta de un archivo generado y encola una comprobación
+
+        Si aún no se generó ninguno encola la generación completa en segundo
+        plano (en un catálogo grande tarda) y devuelve None.
+        """
+        if not os.path.exists(self.path(STATE)):
+            self.schedule()
+            return None
+        self.schedule(force=False)
+        return self.path(name)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+
+def init_sitemaps(app):
+    """Registra los sitemaps y el feed Atom con configuración por defecto"""
+    default_folder = os.path.join(os.path.dirname(os.path.abspath(app.config['UPLOAD_FOLDER'])), 'sitemaps')
+    app.config.setdefault('SITEMAP_FOLDER', os.environ.get('SITEMAP_FOLDER', default_folder))
+    app.config.setdefault('SITEMAP_BASE_URL', os.environ.get('SITEMAP_BASE_URL',
+                                                             os.environ.get('BASE_URL', 'http://localhost:5000')))
+    app.config.setdefault('SITEMAP_CHUNK_SIZE', min(int(os.environ.get('SITEMAP_CHUNK_SIZE', 50000)), 50000))
+    app.config.setdefault('SITEMAP_FEED_SIZE', int(os.environ.get('SITEMAP_FEED_SIZE', 50)))
+    app.config.setdefault('SITEMAP_REFRESH_SECONDS', float(os.environ.get('SITEMAP_REFRESH_SECONDS', 60)))
+
+    writer = SitemapWriter(
+        app,
+        app.config['SITEMAP_FOLDER'],
+        app.config['SITEMAP_BASE_URL'],
+        chunk_size=app.config['SITEMAP_CHUNK_SIZE'],
+        feed_size=app.config['SITEMAP_FEED_SIZE'],
+        refresh_seconds=app.config['SITEMAP_REFRESH_SECONDS'],
+    )
+    app.extensions['metadatos_sitemaps'] = writer
+    return writer
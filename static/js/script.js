@@ -380,7 +380,10 @@ const Forms = {
   },
 
   initFileUpload: () => {
-    const fileInputs = document.querySelectorAll('input[type="file"]');
+    // Los selectores múltiples (subida por lotes) tienen su propia lista
+    const fileInputs = document.querySelectorAll(
+      'input[type="file"]:not([multiple])',
+    );
 
     fileInputs.forEach((input) => {
       input.addEventListener("change", (e) => {
@@ -433,17 +436,19 @@ const Forms = {
   autoFillTitle: (input, file) => {
     const titleInput = document.getElementById("title");
     if (titleInput && !titleInput.value.trim()) {
-      const filename = file.name;
-      const nameWithoutExt =
-        filename.substring(0, filename.lastIndexOf(".")) || filename;
-      const cleanTitle = nameWithoutExt
-        .replace(/[-_]/g, " ")
-        .replace(/\b\w/g, (l) => l.toUpperCase());
-      titleInput.value = cleanTitle;
+      titleInput.value = Forms.titleFromFilename(file.name);
       titleInput.dispatchEvent(new Event("input"));
     }
   },
 
+  titleFromFilename: (filename) => {
+    const nameWithoutExt =
+      filename.substring(0, filename.lastIndexOf(".")) || filename;
+    return nameWithoutExt
+      .replace(/[-_]/g, " ")
+      .replace(/\b\w/g, (l) => l.toUpperCase());
+  },
+
   getFileIcon: (filename) => {
     const ext = filename.split(".").pop().toLowerCase();
     const iconMap = {
@@ -472,15 +477,8 @@ const Forms = {
 
     const searchForm = MetadatosApp.elements.searchInput.closest("form");
 
-    // Auto-submit on typing (with debounce)
-    MetadatosApp.elements.searchInput.addEventListener(
-      "input",
-      Utils.debounce((e) => {
-        if (e.target.value.length >= 2 || e.target.value.length === 0) {
-          searchForm.submit();
-        }
-      }, MetadatosApp.config.searchDelay),
-    );
+    // Sugerencias mientras se escribe (con debounce); el envío sigue siendo explícito
+    Forms.initSuggest(MetadatosApp.elements.searchInput);
 
     // Clear search button functionality
     const clearBtn = searchForm.querySelector(".btn-outline-secondary");
@@ -493,6 +491,107 @@ const Forms = {
     }
   },
 
+  initSuggest: (input) => {
+    const url = input.dataset.suggestUrl;
+    const list = document.getElementById("search-suggestions");
+    if (!url || !list) return;
+
+    let controller = null;
+    let active = -1;
+
+    const close = () => {
+      list.classList.add("d-none");
+      list.innerHTML = "";
+      input.setAttribute("aria-expanded", "false");
+      active = -1;
+    };
+
+    const render = (suggestions) => {
+      list.innerHTML = "";
+      suggestions.forEach((item, index) => {
+        const link = document.createElement("a");
+        link.href = item.url;
+        link.id = `suggestion-${index}`;
+        link.className =
+          "list-group-item list-group-item-action d-flex justify-content-between align-items-center";
+        link.setAttribute("role", "option");
+
+        const label = document.createElement("span");
+        const icon = document.createElement("i");
+        icon.className =
+          item.type === "tag" ? "bi bi-tag me-2 text-muted" : "bi bi-file-earmark me-2 text-muted";
+        label.appendChild(icon);
+        label.appendChild(document.createTextNode(item.label));
+        link.appendChild(label);
+
+        if (item.type === "tag") {
+          const badge = document.createElement("span");
+          badge.className = "badge bg-light text-muted";
+          badge.textContent = item.count;
+          link.appendChild(badge);
+        }
+        list.appendChild(link);
+      });
+      const open = suggestions.length > 0;
+      list.classList.toggle("d-none", !open);
+      input.setAttribute("aria-expanded", open ? "true" : "false");
+      active = -1;
+    };
+
+    const highlight = (index) => {
+      const items = list.querySelectorAll(".list-group-item");
+      if (!items.length) return;
+      active = (index + items.length) % items.length;
+      items.forEach((item, i) => item.classList.toggle("active", i === active));
+      input.setAttribute("aria-activedescendant", items[active].id);
+    };
+
+    const fetchSuggestions = Utils.debounce(async (value) => {
+      // Cancelar la petición anterior para que una respuesta tardía no pise a la nueva
+      if (controller) controller.abort();
+      if (value.trim().length < 2) {
+        close();
+        return;
+      }
+      controller = new AbortController();
+      try {
+        const response = await fetch(`${url}?q=${encodeURIComponent(value)}`, {
+          signal: controller.signal,
+          headers: { Accept: "application/json" },
+        });
+        if (!response.ok) return close();
+        const data = await response.json();
+        if (data.query === input.value.slice(0, 100)) {
+          render(data.suggestions || []);
+        }
+      } catch (error) {
+        if (error.name !== "AbortError") close();
+      }
+    }, MetadatosApp.config.searchDelay);
+
+    input.addEventListener("input", (e) => fetchSuggestions(e.target.value));
+
+    input.addEventListener("keydown", (e) => {
+      if (list.classList.contains("d-none")) return;
+      if (e.key === "ArrowDown") {
+        e.preventDefault();
+        highlight(active + 1);
+      } else if (e.key === "ArrowUp") {
+        e.preventDefault();
+        highlight(active - 1);
+      } else if (e.key === "Enter" && active >= 0) {
+        e.preventDefault();
+        window.location.href = list.querySelectorAll(".list-group-item")[active].href;
+      } else if (e.key === "Escape") {
+        close();
+      }
+    });
+
+    document.addEventListener("click", (e) => {
+      if (!list.contains(e.target) && e.target !== input) close();
+    });
+  },
+
   initCharacterCount: () => {
     const textInputs = document.querySelectorAll(
       "input[maxlength], textarea[maxlength]",
@@ -673,6 +772,30 @@ const PageSpecific = {
         PageSpecific.initFileDetailPage();
         break;
     }
+
+    // Componentes que se activan por su propio elemento, en cualquier página
+    PageSpecific.initBatchUpload();
+    PageSpecific.initLiveUpdates();
+  },
+
+  initLiveUpdates: () => {
+    const badge = document.getElementById("liveUpdates");
+    if (!badge || !window.EventSource) return;
+
+    // EventSource reconecta solo y envía Last-Event-ID; varios cambios seguidos
+    // (una subida y su extracción de texto) provocan una única recarga
+    const source = new EventSource(badge.dataset.eventsUrl);
+    let timer = null;
+    const scheduleReload = () => {
+      clearTimeout(timer);
+      timer = setTimeout(() => window.location.reload(), 2000);
+    };
+    ["upload", "update", "delete", "reload"].forEach((name) =>
+      source.addEventListener(name, scheduleReload),
+    );
+    source.addEventListener("open", () => badge.classList.replace("bg-secondary", "bg-success"));
+    source.addEventListener("error", () => badge.classList.replace("bg-success", "bg-secondary"));
+    window.addEventListener("beforeunload", () => source.close());
   },
 
   initAdminPage: () => {
@@ -703,6 +826,280 @@ const PageSpecific = {
     PageSpecific.initAutoSave();
   },
 
+  initBatchUpload: () => {
+    const form = document.getElementById("batchUploadForm");
+    if (!form) return;
+
+    const input = document.getElementById("batchFiles");
+    const list = document.getElementById("batchFileList");
+    const submitBtn = document.getElementById("batchSubmitBtn");
+    const cancelBtn = document.getElementById("batchCancelBtn");
+    const csrfToken = form.querySelector('input[name="csrf_token"]').value;
+    // Peticiones simultáneas por navegador: el servidor procesa cada archivo en paralelo
+    const concurrency = Math.max(1, parseInt(form.dataset.concurrency, 10) || 3);
+    const maxFiles = parseInt(form.dataset.maxFiles, 10) || 100;
+    const maxBytes = parseInt(form.dataset.maxBytes, 10) || 0;
+    const sharedFields = [
+      "description",
+      "dc_subject",
+      "dc_creator",
+      "dc_rights",
+      "dc_language",
+    ];
+    let items = [];
+    let batch = null;
+    let running = [];
+    let cancelled = false;
+
+    const post = (url) =>
+      fetch(url, {
+        method: "POST",
+        credentials: "same-origin",
+        headers: { "X-CSRFToken": csrfToken, Accept: "application/json" },
+      });
+
+    const readJson = async (response) => {
+      // Con la sesión caducada el servidor redirige al login (HTML)
+      if (response.redirected) {
+        throw new Error("La sesión ha caducado. Inicia sesión de nuevo.");
+      }
+      const body = await response.json().catch(() => ({}));
+      if (!response.ok) {
+        throw new Error(body.error || `Error ${response.status}`);
+      }
+      return body;
+    };
+
+    const setProgress = (item, percent, variant) => {
+      item.bar.style.width = `${percent}%`;
+      item.bar.setAttribute("aria-valuenow", Math.round(percent));
+      item.bar.className = `progress-bar${variant ? ` bg-${variant}` : ""}`;
+    };
+
+    const setStatus = (item, text, variant = "muted") => {
+      item.status.className = `small text-${variant}`;
+      item.status.textContent = text;
+    };
+
+    const renderList = () => {
+      list.textContent = "";
+      items.forEach((item) => list.appendChild(item.row));
+      submitBtn.disabled = items.length === 0;
+      submitBtn.innerHTML = `<i class="bi bi-cloud-upload-fill me-1"></i>Subir ${items.length} archivo(s)`;
+    };
+
+    const buildItem = (file) => {
+      const row = document.createElement("div");
+      row.className = "list-group-item";
+
+      const header = document.createElement("div");
+      header.className = "d-flex align-items-center gap-2 mb-2";
+      const icon = document.createElement("i");
+      icon.className = `bi ${Forms.getFileIcon(file.name)}`;
+      const title = document.createElement("input");
+      title.type = "text";
+      title.className = "form-control form-control-sm";
+      title.maxLength = 255;
+      title.required = true;
+      title.value = Forms.titleFromFilename(file.name);
+      title.setAttribute("aria-label", `Título de ${file.name}`);
+      const name = document.createElement("small");
+      name.className = "text-muted text-nowrap";
+      name.textContent = `${file.name} · ${Utils.formatFileSize(file.size)}`;
+      header.append(icon, title, name);
+
+      const progress = document.createElement("div");
+      progress.className = "progress";
+      progress.style.height = "6px";
+      const bar = document.createElement("div");
+      bar.className = "progress-bar";
+      bar.setAttribute("role", "progressbar");
+      bar.setAttribute("aria-valuemin", "0");
+      bar.setAttribute("aria-valuemax", "100");
+      bar.style.width = "0%";
+      progress.appendChild(bar);
+
+      const status = document.createElement("div");
+      status.className = "small text-muted";
+      status.textContent = "En espera";
+
+      row.append(header, progress, status);
+      const item = { file, row, title, bar, status, ok: false };
+      if (maxBytes && file.size > maxBytes) {
+        item.tooLarge = true;
+        setStatus(
+          item,
+          `Demasiado grande (máx. ${Utils.formatFileSize(maxBytes)}): no se subirá`,
+          "danger",
+        );
+      }
+      return item;
+    };
+
+    const uploadOne = (item) =>
+      new Promise((resolve) => {
+        const data = new FormData();
+        data.append("file", item.file);
+        data.append("title", item.title.value.trim());
+        sharedFields.forEach((field) =>
+          data.append(field, form.elements[field].value),
+        );
+
+        const xhr = new XMLHttpRequest();
+        running.push(xhr);
+        xhr.open("POST", batch.files_url);
+        xhr.setRequestHeader("X-CSRFToken", csrfToken);
+        xhr.setRequestHeader("Accept", "application/json");
+        xhr.responseType = "json";
+
+        xhr.upload.addEventListener("progress", (e) => {
+          if (e.lengthComputable) {
+            setProgress(item, (e.loaded / e.total) * 100);
+            setStatus(item, `Enviando... ${Math.round((e.loaded / e.total) * 100)}%`);
+          }
+        });
+        xhr.upload.addEventListener("load", () =>
+          setStatus(item, "Procesando en el servidor...", "info"),
+        );
+        xhr.addEventListener("load", () => {
+          const body = xhr.response || {};
+          const result = (body.files || [])[0];
+          if (xhr.status === 200 && result && result.ok) {
+            item.ok = true;
+            setProgress(item, 100, "success");
+            setStatus(
+              item,
+              result.warnings.length ? result.warnings.join(" ") : "Preparado",
+              result.warnings.length ? "warning" : "success",
+            );
+          } else {
+            const message =
+              result && result.errors
+                ? result.errors.join(" ")
+                : body.error || `Error ${xhr.status}`;
+            setProgress(item, 100, "danger");
+            setStatus(item, message, "danger");
+          }
+          resolve();
+        });
+        const fail = (message) => () => {
+          setProgress(item, 100, "danger");
+          setStatus(item, message, "danger");
+          resolve();
+        };
+        xhr.addEventListener("error", fail("Error de red"));
+        xhr.addEventListener("abort", fail("Cancelado"));
+        xhr.send(data);
+      });
+
+    // Como mucho `limit` tareas a la vez, en orden
+    const runPool = async (tasks, limit) => {
+      let next = 0;
+      const worker = async () => {
+        while (next < tasks.length && !cancelled) {
+          await tasks[next++]();
+        }
+      };
+      await Promise.all(
+        Array.from({ length: Math.min(limit, tasks.length) }, worker),
+      );
+    };
+
+    const setBusy = (busy) => {
+      input.disabled = busy;
+      submitBtn.disabled = busy || items.length === 0;
+      cancelBtn.disabled = !busy;
+      items.forEach((item) => (item.title.disabled = busy));
+      if (busy) {
+        submitBtn.innerHTML =
+          '<i class="bi bi-hourglass-split me-1"></i>Subiendo...';
+      }
+    };
+
+    const discard = () => {
+      if (batch) {
+        post(batch.discard_url).catch(() => {});
+        batch = null;
+      }
+    };
+
+    input.addEventListener("change", () => {
+      const files = Array.from(input.files);
+      if (files.length > maxFiles) {
+        Utils.showToast(
+          `Solo se subirán los primeros ${maxFiles} archivos`,
+          "warning",
+          5000,
+        );
+      }
+      items = files.slice(0, maxFiles).map(buildItem);
+      renderList();
+    });
+
+    cancelBtn.addEventListener("click", () => {
+      cancelled = true;
+      running.forEach((xhr) => xhr.abort());
+    });
+
+    form.addEventListener("submit", async (e) => {
+      e.preventDefault();
+      const description = form.elements.description;
+      description.classList.toggle("is-invalid", !description.value.trim());
+      const untitled = items.filter((item) => !item.title.value.trim());
+      untitled.forEach((item) => item.title.classList.add("is-invalid"));
+      if (!description.value.trim() || untitled.length) return;
+
+      const pending = items.filter((item) => !item.tooLarge);
+      cancelled = false;
+      running = [];
+      setBusy(true);
+      try {
+        batch = await readJson(await post(form.dataset.createUrl));
+        pending.forEach((item) => {
+          item.ok = false;
+          setProgress(item, 0);
+          setStatus(item, "En espera");
+        });
+        await runPool(
+          pending.map((item) => () => uploadOne(item)),
+          concurrency,
+        );
+        if (cancelled) {
+          discard();
+          Utils.showToast("Subida cancelada", "warning");
+          return;
+        }
+
+        const ready = items.filter((item) => item.ok).length;
+        if (!ready) {
+          throw new Error("No se pudo preparar ningún archivo");
+        }
+        if (
+          ready < items.length &&
+          !window.confirm(
+            `${items.length - ready} archivo(s) no se pudieron preparar. ¿Guardar los ${ready} restantes?`,
+          )
+        ) {
+          discard();
+          return;
+        }
+
+        submitBtn.innerHTML =
+          '<i class="bi bi-hourglass-split me-1"></i>Guardando...';
+        await readJson(await post(batch.commit_url));
+        batch = null;
+        // El mensaje de éxito llega como flash al recargar el panel
+        window.location.assign(window.location.pathname);
+      } catch (error) {
+        discard();
+        Utils.showToast(error.message, "danger", 5000);
+      } finally {
+        setBusy(false);
+        renderList();
+      }
+    });
+  },
+
   initLoginPage: () => {
     // Password visibility toggle
     const togglePassword = document.getElementById("togglePassword");
@@ -1122,8 +1519,10 @@ const Performance = {
 
   initPreloadCriticalResources: () => {
     // Preload critical CSS and fonts
+    // La hoja propia se toma del <link> de la página: su nombre lleva huella (flask build-assets)
+    const mainStylesheet = document.querySelector('link[rel="stylesheet"][href*="/css/style."]');
     const criticalResources = [
-      { href: "/static/css/style.css", as: "style" },
+      ...(mainStylesheet ? [{ href: mainStylesheet.href, as: "style" }] : []),
       {
         href: "https://cdn.jsdelivr.net/npm/bootstrap-icons@1.11.3/font/bootstrap-icons.min.css",
         as: "style",
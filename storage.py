@@ -0,0 +1,447 @@
+"""
+Almacenamiento de los archivos subidos
+
+Todo acceso a los archivos pasa por un backend con la misma interfaz:
+
+- LocalStorage: la carpeta UPLOAD_FOLDER (un nodo, o un volumen compartido).
+- S3Storage: un bucket compatible con S3 (AWS, MinIO...) con boto3,
+  dependencia opcional. Los envíos grandes van en multipart leyendo el
+  archivo por partes, el cliente reutiliza un pool de conexiones y las
+  descargas se redirigen a URLs prefirmadas: los bytes no pasan por la app.
+
+Las claves son los valores de files.filename; la versión comprimida en
+reposo (compression.py) es la clave con sufijo '.gz'. Los archivos se
+procesan siempre en local (extracción, hashes, metadatos embebidos): con
+S3 la subida se prepara en STORAGE_STAGING_FOLDER y se envía al bucket al
+final, y quien lee archivos ya guardados usa local_file(), que descarga
+una copia temporal.
+"""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+from contextlib import contextmanager
+
+from compression import SUFFIX
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+    from botocore.config import Config as BotoConfig
+    from botocore.exceptions import ClientError
+except ImportError:  # Dependencia opcional
+    boto3 = None
+
+MB = 1024 * 1024
+
+
+class LocalStorage:
+    """Archivos en una carpeta del disco local"""
+
+    remote = False
+
+    def __init__(self, folder, quarantine):
+        self.folder = folder
+        self.quarantine_folder = quarantine
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.folder, key)
+
+    def staging_path(self, key):
+        """Dónde preparar una subida antes de save(): en local, su sitio definitivo"""
+        return self.path(key)
+
+    def exists(self, key):
+        return os.path.exists(self.path(key))
+
+    def locate(self, name):
+        """Clave guardada de un archivo: el original, su versión comprimida o None"""
+        for key in (name, name + SUFFIX):
+            if self.exists(key):
+                return key
+        return None
+
+    def resolve(self, name, compressed=None):
+        """Como locate(), empezando por la clave que indica files.compressed si se conoce"""
+        if compressed is not None and self.exists(name + SUFFIX if compressed else name):
+            return name + SUFFIX if compressed else name
+        return self.locate(name)
+
+    def save(self, local_path, key, content_type=None, content_encoding=None):
+        """Guarda un archivo preparado en local bajo `key` (lo mueve si no está ya en su sitio)"""
+        target = self.path(key)
+        if os.path.abspath(local_path) != os.path.abspath(target):
+            shutil.move(local_path, target)
+
+    def delete_key(self, key):
+        """Elimina una clave concreta; devuelve si existía"""
+        try:
+            os.remove(self.path(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def delete(self, name):
+        """Elimina un archivo en cualquiera de sus dos formas; devuelve si existía"""
+        removed = self.delete_key(name)
+        return self.delete_key(name + SUFFIX) or removed
+
+    def stat(self, key):
+        """(tamaño, fecha de modificación) o None si no existe"""
+        try:
+            stat = os.stat(self.path(key))
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime
+
+    def tail(self, key, length):
+        """Últimos `length` bytes del archivo"""
+        with open(self.path(key), 'rb') as fh:
+            fh.seek(-length, os.SEEK_END)
+            return fh.read(length)
+
+    def open(self, key, start=0):
+        """Archivo abierto en binario desde el byte `start`, para leerlo por bloques"""
+        fh = open(self.path(key), 'rb')
+        if start:
+            fh.seek(start)
+        return fh
+
+    def reader(self, key):
+        """Archivo de solo lectura con seek, para leer cabeceras sin recorrerlo entero"""
+        return open(self.path(key), 'rb')
+
+    @contextmanager
+    def local_file(self, key):
+        """Ruta local del archivo (si no existe, los lectores lo tratan como ilegible)"""
+        yield self.path(key)
+
+    def url(self, key):
+        """URL directa de descarga; None: la sirve la app (o nginx)"""
+        return None
+
+    def iter_keys(self):
+        """Claves guardadas, sin orden (para la conciliación con la BD)"""
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    yield entry.name
+
+    def quarantine(self, key):
+        """Aparta un archivo a la cuarentena, fuera de la carpeta servida"""
+        os.makedirs(self.quarantine_folder, exist_ok=True)
+        target = os.path.join(self.quarantine_folder, key)
+        if os.path.exists(target):
+            target = f'{target}.{int(time.time())}'
+        shutil.move(self.path(key), target)
+        # La antigüedad en cuarentena cuenta desde que entró
+        os.utime(target)
+
+    def purge_quarantine(self, before, dry_run=False):
+        """Borra lo que entró en la cuarentena antes de `before`; devuelve (archivos, bytes)"""
+        if not os.path.isdir(self.quarantine_folder):
+            return 0, 0
+        purged = size = 0
+        with os.scandir(self.quarantine_folder) as entries:
+            for entry in entries:
+                if not entry.is_file(follow_symlinks=False):
+                    continue
+                stat = entry.stat(follow_symlinks=False)
+                if stat.st_mtime >= before:
+                    continue
+                if not dry_run:
+                    os.remove(entry.path)
+                purged += 1
+                size += stat.st_size
+        return purged, size
+
+    def describe(self):
+        return os.path.abspath(self.folder)
+
+    def volume(self):
+        """Carpeta local cuyo sistema de archivos llenan las subidas"""
+        return self.folder
+
+
+class RangeReader(io.RawIOBase):
+    """Lector con posicionamiento sobre un objeto de S3 de tamaño conocido"""
+
+    def __init__(self, client, bucket, key, size):
+        self.client = client
+        self.bucket = bucket
+        self.key = key
+        self.size = size
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self.position, io.SEEK_END: self.size}[whence]
+        if base + offset < 0:
+            raise ValueError('Posición negativa')
+        self.position = base + offset
+        return self.position
+
+    def readinto(self, buffer):
+        if self.position >= self.size or not len(buffer):
+            return 0
+        end = min(self.size, self.position + len(buffer)) - 1
+        data = self.client.get_object(Bucket=self.bucket, Key=self.key,
+                                      Range=f'bytes={self.position}-{end}')['Body'].read()
+        buffer[:len(data)] = data
+        self.position += len(data)
+        return len(data)
+
+
+class S3Storage:
+    """Archivos en un bucket compatible con S3"""
+
+    remote = True
+
+    def __init__(self, bucket, prefix='', endpoint_url=None, region=None, access_key=None, secret_key=None,
+                 public_endpoint_url=None, staging_folder=None, quarantine_prefix='quarantine/', presign_expires=3600,
+                 multipart_threshold=8 * MB, multipart_chunksize=8 * MB, max_concurrency=4, max_pool_connections=10):
+        if boto3 is None:
+            raise RuntimeError('boto3 no está instalado (necesario con STORAGE_BACKEND=s3)')
+        self.bucket = bucket
+        self.prefix = prefix
+        self.quarantine_prefix = quarantine_prefix
+        self.presign_expires = presign_expires
+        self.staging_folder = staging_folder or tempfile.gettempdir()
+        os.makedirs(self.staging_folder, exist_ok=True)
+
+        def client(endpoint):
+            return boto3.client(
+                's3',
+                endpoint_url=endpoint or None,
+                region_name=region or None,
+                aws_access_key_id=access_key or None,
+                aws_secret_access_key=secret_key or None,
+                config=BotoConfig(
+                    max_pool_connections=max_pool_connections,
+                    retries={'max_attempts': 5, 'mode': 'standard'},
+                    signature_version='s3v4',
+                    # MinIO y otros servicios propios no tienen DNS por bucket
+                    s3={'addressing_style': 'path' if endpoint else 'auto'},
+                ),
+            )
+
+        # Un cliente por proceso, seguro entre hilos, con su pool de conexiones HTTP
+        self.client = client(endpoint_url)
+        # La firma incluye el host: las URLs para el navegador se firman con el público
+        # (p. ej. http://localhost:9000 cuando la app ve MinIO como http://minio:9000).
+        # Prefirmar no hace peticiones, así que este cliente no abre conexiones
+        self.presign_client = client(public_endpoint_url) \
+            if public_endpoint_url and public_endpoint_url != endpoint_url else self.client
+        self.transfer = TransferConfig(
+            multipart_threshold=multipart_threshold,
+            multipart_chunksize=multipart_chunksize,
+            max_concurrency=max_concurrency,
+        )
+
+    def _key(self, key):
+        return self.prefix + key
+
+    def staging_path(self, key):
+        return os.path.join(self.staging_folder, key)
+
+    def _head(self, key):
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._key(key))
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def exists(self, key):
+        return self._head(key) is not None
+
+    def locate(self, name):
+        for key in (name, name + SUFFIX):
+            if self.exists(key):
+                return key
+        return None
+
+    def resolve(self, name, compressed=None):
+        """Clave de un archivo según files.compressed, sin HEAD; si no se conoce, locate()"""
+        if compressed is None:
+            return self.locate(name)
+        return name + SUFFIX if compressed else name
+
+    def save(self, local_path, key, content_type=None, content_encoding=None):
+        """Envía el archivo preparado, en multipart por encima del umbral
+
+        La copia local se conserva (la extracción en segundo plano la lee);
+        la borra el llamador.
+        """
+        extra = {}
+        if content_type:
+            extra['ContentType'] = content_type
+        if content_encoding:
+            extra['ContentEncoding'] = content_encoding
+        self.client.upload_file(local_path, self.bucket, self._key(key), ExtraArgs=extra or None,
+                                Config=self.transfer)
+
+    def delete_key(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self._key(key))
+        return True
+
+    def delete(self, name):
+        self.client.delete_objects(Bucket=self.bucket, Delete={
+            'Objects': [{'Key': self._key(name)}, {'Key': self._key(name + SUFFIX)}], 'Quiet': True,
+        })
+        return True
+
+    def stat(self, key):
+        head = self._head(key)
+        if head is None:
+            return None
+        return head['ContentLength'], head['LastModified'].timestamp()
+
+    def tail(self, key, length):
+        response = self.client.get_object(Bucket=self.bucket, Key=self._key(key), Range=f'bytes=-{length}')
+        return response['Body'].read()
+
+    def open(self, key, start=0):
+        """Cuerpo de la respuesta de GET desde el byte `start`, leído del bucket según se consume"""
+        extra = {'Range': f'bytes={start}-'} if start else {}
+        return self.client.get_object(Bucket=self.bucket, Key=self._key(key), **extra)['Body']
+
+    def reader(self, key, buffer_size=64 * 1024):
+        """Objeto del bucket como archivo con seek: cada lectura es un GET con Range
+
+        Para el directorio central de un ZIP o la cabecera de una imagen basta
+        con unos pocos tramos de buffer_size, sin descargar el objeto.
+        """
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return io.BufferedReader(RangeReader(self.client, self.bucket, self._key(key), head['ContentLength']),
+                                 buffer_size)
+
+    @contextmanager
+    def local_file(self, key):
+        """Copia temporal descargada (en multipart si es grande), borrada al salir
+
+        Si la clave no existe se obtiene una ruta inexistente, como en local.
+        """
+        handle, path = tempfile.mkstemp(dir=self.staging_folder, suffix=os.path.splitext(key)[1])
+        os.close(handle)
+        try:
+            try:
+                self.client.download_file(self.bucket, self._key(key), path, Config=self.transfer)
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in ('404', 'NoSuchKey', 'NotFound'):
+                    raise
+                os.remove(path)
+            yield path
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def url(self, key):
+        """URL prefirmada de descarga directa desde el bucket, con el endpoint público"""
+        return self.presign_client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': self._key(key)}, ExpiresIn=self.presign_expires
+        )
+
+    def _list(self, prefix):
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            yield from page.get('Contents', ())
+
+    def iter_keys(self):
+        for item in self._list(self.prefix):
+            key = item['Key']
+            if self.quarantine_prefix and key.startswith(self.quarantine_prefix):
+                continue
+            yield key[len(self.prefix):]
+
+    def quarantine(self, key):
+        source = self._key(key)
+        self.client.copy_object(Bucket=self.bucket, Key=self.quarantine_prefix + key,
+                                CopySource={'Bucket': self.bucket, 'Key': source})
+        self.client.delete_object(Bucket=self.bucket, Key=source)
+
+    def purge_quarantine(self, before, dry_run=False):
+        purged = size = 0
+        expired = []
+        for item in self._list(self.quarantine_prefix):
+            if item['LastModified'].timestamp() >= before:
+                continue
+            purged += 1
+            size += item['Size']
+            expired.append({'Key': item['Key']})
+        if not dry_run:
+            # delete_objects admite 1000 claves por petición
+            for start in range(0, len(expired), 1000):
+                self.client.delete_objects(Bucket=self.bucket,
+                                           Delete={'Objects': expired[start:start + 1000], 'Quiet': True})
+        return purged, size
+
+    def describe(self):
+        return f's3://{self.bucket}/{self.prefix}'
+
+    def volume(self):
+        # El bucket no se llena; el disco local solo guarda las subidas en preparación
+        return self.staging_folder
+
+
+def init_storage(app):
+    """Registra el backend de almacenamiento (STORAGE_BACKEND=local|s3)"""
+    default_quarantine = os.path.join(os.path.dirname(os.path.abspath(app.config['UPLOAD_FOLDER'])), 'quarantine')
+    app.config.setdefault('STORAGE_BACKEND', os.environ.get('STORAGE_BACKEND', 'local').lower())
+    app.config.setdefault('GC_QUARANTINE_FOLDER', os.environ.get('GC_QUARANTINE_FOLDER', default_quarantine))
+
+    if app.config['STORAGE_BACKEND'] == 'local':
+        storage = LocalStorage(app.config['UPLOAD_FOLDER'], app.config['GC_QUARANTINE_FOLDER'])
+    elif app.config['STORAGE_BACKEND'] == 's3':
+        app.config.setdefault('S3_BUCKET', os.environ.get('S3_BUCKET'))
+        app.config.setdefault('S3_PREFIX', os.environ.get('S3_PREFIX', 'uploads/'))
+        app.config.setdefault('S3_QUARANTINE_PREFIX', os.environ.get('S3_QUARANTINE_PREFIX', 'quarantine/'))
+        app.config.setdefault('S3_ENDPOINT_URL', os.environ.get('S3_ENDPOINT_URL'))
+        app.config.setdefault('S3_PUBLIC_ENDPOINT_URL', os.environ.get('S3_PUBLIC_ENDPOINT_URL'))
+        app.config.setdefault('S3_REGION', os.environ.get('S3_REGION'))
+        app.config.setdefault('S3_ACCESS_KEY_ID', os.environ.get('S3_ACCESS_KEY_ID'))
+        app.config.setdefault('S3_SECRET_ACCESS_KEY', os.environ.get('S3_SECRET_ACCESS_KEY'))
+        app.config.setdefault('S3_PRESIGN_EXPIRES', int(os.environ.get('S3_PRESIGN_EXPIRES', 3600)))
+        app.config.setdefault('S3_MULTIPART_THRESHOLD_MB', int(os.environ.get('S3_MULTIPART_THRESHOLD_MB', 8)))
+        app.config.setdefault('S3_MULTIPART_CHUNK_MB', int(os.environ.get('S3_MULTIPART_CHUNK_MB', 8)))
+        app.config.setdefault('S3_MAX_CONCURRENCY', int(os.environ.get('S3_MAX_CONCURRENCY', 4)))
+        app.config.setdefault('S3_MAX_POOL_CONNECTIONS', int(os.environ.get('S3_MAX_POOL_CONNECTIONS', 10)))
+        app.config.setdefault('STORAGE_STAGING_FOLDER', os.environ.get('STORAGE_STAGING_FOLDER',
+                                                                      os.path.join(tempfile.gettempdir(),
+                                                                                   'metadatos-staging')))
+        if not app.config['S3_BUCKET']:
+            raise RuntimeError('S3_BUCKET es obligatorio con STORAGE_BACKEND=s3')
+        storage = S3Storage(
+            app.config['S3_BUCKET'],
+            prefix=app.config['S3_PREFIX'],
+            endpoint_url=app.config['S3_ENDPOINT_URL'],
+            region=app.config['S3_REGION'],
+            access_key=app.config['S3_ACCESS_KEY_ID'],
+            secret_key=app.config['S3_SECRET_ACCESS_KEY'],
+            public_endpoint_url=app.config['S3_PUBLIC_ENDPOINT_URL'],
+            staging_folder=app.config['STORAGE_STAGING_FOLDER'],
+            quarantine_prefix=app.config['S3_QUARANTINE_PREFIX'],
+            presign_expires=app.config['S3_PRESIGN_EXPIRES'],
+            multipart_threshold=app.config['S3_MULTIPART_THRESHOLD_MB'] * MB,
+            multipart_chunksize=app.config['S3_MULTIPART_CHUNK_MB'] * MB,
+            max_concurrency=app.config['S3_MAX_CONCURRENCY'],
+            max_pool_connections=app.config['S3_MAX_POOL_CONNECTIONS'],
+        )
+    else:
+        raise RuntimeError(f"STORAGE_BACKEND desconocido: {app.config['STORAGE_BACKEND']}")
+
+    app.extensions['metadatos_storage'] = storage
+    return storage
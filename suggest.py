@@ -0,0 +1,304 @@
+"""
+Autocompletado con índice de palabras en memoria
+
+Cada worker mantiene un vocabulario ordenado de las palabras normalizadas
+de los títulos (el título entero en minúsculas y sin tildes, partido en
+palabras sin la puntuación), y para cada palabra la lista de ids de archivo (array de
+enteros) que la contienen. Una búsqueda toma las palabras completas de la
+consulta como exactas y la última como prefijo: un bisect en el vocabulario
+más un recorrido corto da los candidatos, y sus títulos se leen por clave
+primaria en una sola consulta para comprobarlos y ordenarlos. Las palabras
+clave (muchas menos) se indexan por nombre en un arreglo ordenado por cada
+sufijo; sus cuentas se leen al consultar, por el índice único de tags.name.
+
+El índice se actualiza de forma incremental leyendo catalog_changes desde la
+última versión aplicada: se añaden las palabras y las palabras clave de los
+archivos cambiados. Las entradas de títulos viejos o borrados y las palabras
+clave sin archivos se quedan en memoria y se descartan al consultar. Una carga
+masiva, muchos cambios de golpe o acumulados provocan una reconstrucción
+completa en un hilo de fondo, que se intercambia al terminar; mientras
+tanto se sirve el índice anterior (vacío en el primer arranque).
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_left, insort
+
+from database import CatalogChange, File, Tag, db, file_tags, normalize_tag
+
+logger = logging.getLogger(__name__)
+
+MIN_QUERY_LENGTH = 2
+WORD = re.compile(r'\w+')
+
+
+def fold_words(text):
+    """Palabras de un texto en minúsculas y sin tildes, sin puntuación
+
+    A diferencia de normalize_tag no recorta a 100 caracteres: los títulos
+    largos se indexan enteros.
+    """
+    folded = unicodedata.normalize('NFKD', (text or '').lower())
+    return WORD.findall(''.join(char for char in folded if not unicodedata.combining(char)))
+
+
+def title_words(title):
+    """Palabras normalizadas de un título, sin repetir y en orden"""
+    return dict.fromkeys(fold_words(title))
+
+
+class PrefixIndex:
+    """Arreglo ordenado de (clave, referencia) con búsqueda por prefijo"""
+
+    __slots__ = ('entries',)
+
+    def __init__(self, entries=()):
+        self.entries = sorted(entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, ref):
+        position = bisect_left(self.entries, (key, ref))
+        if position == len(self.entries) or self.entries[position] != (key, ref):
+            self.entries.insert(position, (key, ref))
+
+    def remove(self, key, ref):
+        position = bisect_left(self.entries, (key, ref))
+        if position < len(self.entries) and self.entries[position] == (key, ref):
+            del self.entries[position]
+
+    def matches(self, prefix, max_scan):
+        """Referencias cuyas claves empiezan por prefix (como mucho max_scan entradas)"""
+        entries = self.entries
+        position = bisect_left(entries, (prefix,))
+        end = min(len(entries), position + max_scan)
+        while position < end and entries[position][0].startswith(prefix):
+            yield entries[position]
+            position += 1
+
+
+def tag_entries(name):
+    """Entradas de una palabra clave: su nombre desde cada palabra"""
+    words = name.split()
+    return [(' '.join(words[start:]), name) for start in range(len(words))]
+
+
+class WordIndex:
+    """Vocabulario ordenado de palabras con la lista de ids de archivo de cada una"""
+
+    __slots__ = ('words', 'postings', 'stale')
+
+    def __init__(self, postings=None):
+        self.postings = postings or {}
+        self.words = sorted(self.postings)
+        self.stale = 0  # archivos añadidos desde la última reconstrucción
+
+    @classmethod
+    def build(cls, rows):
+        postings = {}
+        for file_id, title in rows:
+            for word in title_words(title):
+                ids = postings.get(word)
+                if ids is None:
+                    postings[word] = array('i', (file_id,))
+                else:
+                    ids.append(file_id)
+        return cls(postings)
+
+    def add(self, file_id, title):
+        for word in title_words(title):
+            ids = self.postings.get(word)
+            if ids is None:
+                insort(self.words, word)
+                self.postings[word] = array('i', (file_id,))
+            elif ids[-1] != file_id:
+                ids.append(file_id)
+        self.stale += 1
+
+    def candidates(self, words, prefix, max_scan):
+        """Ids que contienen todas las palabras y alguna que empieza por prefix
+
+        Las más recientes primero, como mucho max_scan.
+        """
+        required = None
+        for word in sorted(words, key=lambda word: len(self.postings.get(word, ()))):
+            ids = self.postings.get(word)
+            if ids is None:
+                return []
+            required = set(ids) if required is None else required.intersection(ids)
+            if not required:
+                return []
+
+        found = {}
+        position = bisect_left(self.words, prefix)
+        while position < len(self.words) and self.words[position].startswith(prefix):
+            for file_id in reversed(self.postings[self.words[position]]):
+                if required is None or file_id in required:
+                    found[file_id] = None
+                    if len(found) >= max_scan:
+                        return list(found)
+            position += 1
+        return list(found)
+
+
+class SuggestIndex:
+    """Índice de sugerencias de un worker, sincronizado con la versión del catálogo"""
+
+    def __init__(self, app, limit=8, refresh_seconds=2.0, rebuild_threshold=500):
+        self.app = app
+        self.limit = limit
+        self.refresh_seconds = refresh_seconds
+        self.rebuild_threshold = rebuild_threshold
+        self.version = None
+        self.checked_at = 0.0
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._builder = None
+        self._titles = WordIndex()
+        self._tags = PrefixIndex()
+
+    # ----- sincronización -----
+
+    def refresh(self):
+        """Aplica los cambios del catálogo si la versión cambió (a lo sumo cada refresh_seconds)"""
+        if time.monotonic() - self.checked_at < self.refresh_seconds:
+            return
+        with self._refresh_lock:
+            if time.monotonic() - self.checked_at < self.refresh_seconds:
+                return
+            self.checked_at = time.monotonic()
+            if self._builder is not None:
+                # La reconstrucción en curso deja la versión desde la que seguir
+                return
+            version = CatalogChange.version()
+            if version == self.version:
+                return
+            changes = CatalogChange.since(self.version) if self.version is not None and version > self.version else None
+            if (changes is None or len(changes) > self.rebuild_threshold
+                    or any(action == 'bulk' for _, action, _ in changes)
+                    or self._titles.stale + len(changes) > self.rebuild_threshold):
+                self._start_rebuild()
+            else:
+                self._apply({file_id for _, _, file_id in changes})
+                self.version = version
+
+    def _start_rebuild(self):
+        self._builder = threading.Thread(target=self._rebuild, name='suggest-rebuild', daemon=True)
+        self._builder.start()
+
+    def wait(self, timeout=None):
+        """Espera a que termine la reconstrucción en curso, si la hay"""
+        builder = self._builder
+        if builder is not None:
+            builder.join(timeout)
+
+    def _rebuild(self):
+        version = None
+        try:
+            with self.app.app_context():
+                version = CatalogChange.version()
+                rows = db.session.execute(
+                    db.select(File.id, File.title).execution_options(yield_per=2000)
+                )
+                titles = WordIndex.build(rows)
+                tags = PrefixIndex(entry for name, in db.session.query(Tag.name).filter(Tag.file_count > 0)
+                                   for entry in tag_entries(name))
+            with self._lock:
+                self._titles, self._tags = titles, tags
+        except Exception as e:
+            logger.warning(f'No se pudo reconstruir el índice de sugerencias: {type(e).__name__}', exc_info=True)
+            version = self.version
+        finally:
+            with self._refresh_lock:
+                # Los cambios posteriores a version se aplican en el siguiente refresh
+                self.version = version
+                self._builder = None
+                self.checked_at = 0.0
+
+    def _apply(self, file_ids):
+        if not file_ids:
+            return
+        rows = db.session.query(File.id, File.title).filter(File.id.in_(file_ids)).all()
+        # Solo las palabras clave de los archivos cambiados, no todas
+        linked = db.session.query(Tag.name).join(file_tags, file_tags.c.tag_id == Tag.id).filter(
+            file_tags.c.file_id.in_(file_ids)
+        ).distinct().all()
+        with self._lock:
+            for file_id, title in rows:
+                self._titles.add(file_id, title)
+            for name, in linked:
+                for key, ref in tag_entries(name):
+                    self._tags.add(key, ref)
+
+    # ----- consulta -----
+
+    def suggest(self, query, limit=None):
+        """Sugerencias para un prefijo: palabras clave primero, luego títulos
+
+        Devuelve dicts con type ('tag' o 'file'), label, count o id.
+        """
+        limit = limit or self.limit
+        prefix = normalize_tag(query)
+        if len(prefix) < MIN_QUERY_LENGTH:
+            return []
+        self.refresh()
+        max_scan = limit * 20
+        query_words = fold_words(query)
+
+        with self._lock:
+            tag_names = {name for _, name in self._tags.matches(prefix, max_scan)}
+            candidates = []
+            if query_words:
+                *words, last = query_words
+                candidates = self._titles.candidates(words, last, max_scan)
+
+        tag_rows = []
+        if tag_names:
+            tag_rows = db.session.query(Tag.name, Tag.label, Tag.file_count).filter(
+                Tag.name.in_(tag_names), Tag.file_count > 0
+            ).order_by(Tag.file_count.desc(), Tag.name).limit(max(1, limit // 2)).all()
+
+        files = []
+        if candidates:
+            for file_id, title in db.session.query(File.id, File.title).filter(File.id.in_(candidates)):
+                # Las listas pueden guardar palabras de un título anterior: se comprueba el actual
+                current = fold_words(title)
+                if all(word in current for word in words) and any(word.startswith(last) for word in current):
+                    # Coincidencia desde la primera palabra antes que a mitad de título
+                    leading = len(current) > len(words) and current[:len(words)] == words \
+                        and current[len(words)].startswith(last)
+                    files.append((0 if leading else 1, len(title), file_id, title))
+
+        suggestions = [{'type': 'tag', 'name': name, 'label': label, 'count': count}
+                       for name, label, count in tag_rows]
+        suggestions.extend({'type': 'file', 'id': file_id, 'label': title}
+                           for _, _, file_id, title in sorted(files)[:limit - len(suggestions)])
+        return suggestions
+
+    def stats(self):
+        with self._lock:
+            return {'version': self.version, 'words': len(self._titles.words),
+                    'stale': self._titles.stale, 'tag_keys': len(self._tags),
+                    'rebuilding': self._builder is not None}
+
+
+def init_suggest(app):
+    """Registra el índice de sugerencias en la aplicación con configuración por defecto"""
+    app.config.setdefault('SUGGEST_LIMIT', int(os.environ.get('SUGGEST_LIMIT', 8)))
+    app.config.setdefault('SUGGEST_REFRESH_SECONDS', float(os.environ.get('SUGGEST_REFRESH_SECONDS', 2)))
+    app.config.setdefault('SUGGEST_REBUILD_THRESHOLD', int(os.environ.get('SUGGEST_REBUILD_THRESHOLD', 500)))
+
+    index = SuggestIndex(
+        app,
+        limit=app.config['SUGGEST_LIMIT'],
+        refresh_seconds=app.config['SUGGEST_REFRESH_SECONDS'],
+        rebuild_threshold=app.config['SUGGEST_REBUILD_THRESHOLD'],
+    )
+    app.extensions['metadatos_suggest'] = index
+    return index
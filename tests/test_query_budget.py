@@ -0,0 +1,16 @@
+"""
+Presupuesto de consultas SQL por ruta (benchmarks/query_budget.py) como test
+
+Equivale a `python -m benchmarks budget` con un catálogo pequeño: falla si
+una ruta excede su presupuesto, si sus consultas crecen con el catálogo
+(N+1) o si hay un endpoint sin presupuesto declarado.
+"""
+
+from benchmarks.harness import load_app
+from benchmarks.query_budget import run_budget_check
+
+
+def test_query_budget(tmp_path, capsys):
+    app_module = load_app(tmp_path / 'budget', 'budget')
+    ok = run_budget_check(app_module, rows=20, grow_to=60)
+    assert ok, capsys.readouterr().out
@@ -0,0 +1,105 @@
+"""
+Contadores de vistas y descargas con escritura diferida
+
+Un UPDATE files SET downloads = downloads + 1 por descarga serializaría a
+los escritores de SQLite. En su lugar, cada worker acumula las cuentas en
+un diccionario en memoria, sin tocar la BD en la petición: las vistas por id
+de archivo (la ruta de la ficha ya lo trae) y las descargas por nombre (la
+URL de /uploads y los avisos de nginx solo traen el nombre). Un hilo de fondo las vuelca cada STATS_FLUSH_SECONDS en
+file_stats con un único upsert (executemany) y una transacción. También
+vuelca al terminar el proceso (atexit). Si el volcado falla, las cuentas
+vuelven al diccionario y se reintentan en el siguiente.
+
+Una caída del proceso pierde como mucho los últimos STATS_FLUSH_SECONDS.
+Las cifras de la ficha y del panel suman lo pendiente del propio worker,
+pero no lo de los demás.
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+from database import FileStats, db
+
+logger = logging.getLogger(__name__)
+
+
+class UsageCounters:
+    """Cuentas de vistas y descargas de un proceso, pendientes de volcar a file_stats"""
+
+    def __init__(self, app, flush_seconds=30.0):
+        self.app = app
+        self.flush_seconds = flush_seconds
+        self._counts = {}  # file_id (vistas) o filename (descargas) -> [vistas, descargas]
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        atexit.register(self.shutdown)
+
+    def _add(self, key, views, downloads):
+        with self._lock:
+            counts = self._counts.get(key)
+            if counts is None:
+                self._counts[key] = [views, downloads]
+            else:
+                counts[0] += views
+                counts[1] += downloads
+            if self._thread is None:
+                # Se arranca con la primera cuenta: en el worker, no en el maestro antes del fork
+                self._thread = threading.Thread(target=self._run, name='usage-flush', daemon=True)
+                self._thread.start()
+
+    def view(self, file_id):
+        self._add(file_id, 1, 0)
+
+    def download(self, filename):
+        self._add(filename, 0, 1)
+
+    def pending(self, file_id, filename):
+        """(vistas, descargas) de este proceso aún sin volcar"""
+        with self._lock:
+            return self._counts.get(file_id, (0, 0))[0], self._counts.get(filename, (0, 0))[1]
+
+    def backlog(self):
+        """Archivos con cuentas pendientes en este proceso"""
+        return len(self._counts)
+
+    def flush(self):
+        """Vuelca las cuentas pendientes; devuelve cuántos archivos se actualizaron"""
+        with self._lock:
+            counts, self._counts = self._counts, {}
+        if not counts:
+            return 0
+        try:
+            with self.app.app_context():
+                with db.engine.begin() as connection:
+                    FileStats.add_many(connection, counts)
+        except Exception as e:
+            logger.warning(f'No se pudieron guardar las cuentas de {len(counts)} archivo(s): {type(e).__name__}')
+            with self._lock:
+                for key, (views, downloads) in counts.items():
+                    current = self._counts.setdefault(key, [0, 0])
+                    current[0] += views
+                    current[1] += downloads
+            return 0
+        return len(counts)
+
+    def _run(self):
+        while not self._stop.wait(self.flush_seconds):
+            self.flush()
+
+    def shutdown(self):
+        self._stop.set()
+        self.flush()
+
+
+def init_usage_counters(app):
+    """Registra los contadores de uso con configuración por defecto"""
+    app.config.setdefault('STATS_FLUSH_SECONDS', float(os.environ.get('STATS_FLUSH_SECONDS', 30)))
+    # Compartido con nginx: sin él no se cuentan las descargas que sirve nginx
+    app.config.setdefault('DOWNLOAD_HIT_SECRET', os.environ.get('DOWNLOAD_HIT_SECRET', ''))
+
+    counters = UsageCounters(app, flush_seconds=app.config['STATS_FLUSH_SECONDS'])
+    app.extensions['metadatos_usage'] = counters
+    return counters